@@ -0,0 +1,396 @@
+import argparse
+import csv
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+from event_log import read_blob, read_events
+
+# "<asctime> - <levelname> - <message>" as written by the agents' logging handlers.
+ENTRY_PATTERN = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - ([A-Z]+) - ")
+ITERATION_PATTERN = re.compile(r"^Iteration: (\d+), (?:Feedback|Error): ")
+TRAIN_SCORE_PATTERN = re.compile(r"total score: (-?\d+(?:\.\d+)?)")
+MEAN_REWARD_PATTERN = re.compile(r"(?:scoring|score is|average score of|average score is|Average score:)\s+(-?\d+(?:\.\d+)?)")
+EXCEPTION_PATTERN = re.compile(r"^\((\w*(?:Error|Exception))\)")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+INDEX_VERSION = 1
+# Feedback entries are kept in memory while they are parsed; beyond this only their size is tracked.
+MAX_FEEDBACK_BYTES = 64 * 1024
+HEAD_BYTES = 4096
+
+
+def _new_iteration(iteration):
+    return {
+        "iteration": iteration,
+        "start": None,
+        "end": None,
+        "train_score": None,
+        "mean_reward": None,
+        "feedback": None,  # [offset, length] of the first feedback entry
+        "errors": [],  # [offset, length, summary]
+        "responses": [],  # [offset, length]
+        "prompts": [],  # [offset, length]
+        "entries": 0,
+    }
+
+
+def _file_head(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(HEAD_BYTES)).hexdigest()
+
+
+class LogIndex:
+    """
+    Per-iteration timeline of an agent log, built in one streaming pass and saved as a byte-offset index.
+
+    Entries are attributed to iterations by the "Iteration: i, Feedback: ..." lines: everything logged
+    after the last such line of iteration i-1 (the evaluation, the feedback, the problem instance and
+    the LLM response) belongs to iteration i. For every iteration the index keeps the byte offset and
+    length of its feedback, prompt, LLM response and error entries, so they can be printed later
+    with a single seek.
+
+    The index is saved next to the log (<log>.idx.json) together with the offset up to which the log
+    was parsed. When the log has grown since (e.g. the run is still going) only the new bytes are
+    parsed; if it was replaced or truncated it is parsed again from the start.
+
+    Runs that write an event log keep their iterations there instead (see EventTimeline).
+    """
+
+    def __init__(self, log_path, index_path=None):
+        self.log_path = log_path
+        self.index_path = index_path or f"{log_path}.idx.json"
+        self._reset()
+
+    def _reset(self):
+        self.head = None
+        self.parsed_offset = 0
+        self.iterations = {}
+        self.current = None
+        self.pending = []  # Entries after the last iteration line, attributed to the next iteration
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path) as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if state.get("version") != INDEX_VERSION:
+            return False
+        self.head = state["head"]
+        self.parsed_offset = state["parsed_offset"]
+        self.iterations = {int(i): record for i, record in state["iterations"].items()}
+        self.current = state["current"]
+        self.pending = state["pending"]
+        return True
+
+    def save(self):
+        state = {
+            "version": INDEX_VERSION,
+            "log": os.path.abspath(self.log_path),
+            "head": self.head,
+            "parsed_offset": self.parsed_offset,
+            "iterations": self.iterations,
+            "current": self.current,
+            "pending": self.pending,
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.index_path)
+
+    def update(self):
+        """Parse what was appended to the log since the index was saved (or all of it). Returns the bytes parsed."""
+        size = os.path.getsize(self.log_path)
+        head = _file_head(self.log_path)
+        if self.head is not None and (size < self.parsed_offset or
+                                      (self.parsed_offset >= HEAD_BYTES and head != self.head)):
+            self._reset()
+        start = self.parsed_offset
+        self._parse(start)
+        self.head = head
+        return self.parsed_offset - start
+
+    def _parse(self, offset):
+        entry = None
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                match = ENTRY_PATTERN.match(line)
+                if match:
+                    if entry is not None:
+                        self._add_entry(entry)
+                    # Everything before this line is complete; a later update resumes here.
+                    self.parsed_offset = offset
+                    entry = {
+                        "offset": offset,
+                        "length": 0,
+                        "time": match.group(1).decode(),
+                        "level": match.group(2).decode(),
+                        "text": line[match.end():].decode(errors="replace"),
+                        "lines": 1,
+                    }
+                elif entry is not None:
+                    if entry["lines"] == 1 or (entry["text"].startswith("Iteration: ") and
+                                               len(entry["text"]) < MAX_FEEDBACK_BYTES):
+                        entry["text"] += line.decode(errors="replace")
+                    entry["lines"] += 1
+                offset += len(line)
+                if entry is not None:
+                    entry["length"] += len(line)
+        # The last entry may still be written to; it is included only once the next one starts.
+
+    def _add_entry(self, entry):
+        text = entry["text"]
+        match = ITERATION_PATTERN.match(text)
+        if match:
+            iteration = int(match.group(1))
+            record = self.iterations.setdefault(iteration, _new_iteration(iteration))
+            for pending in self.pending:
+                self._attribute(record, pending)
+            self.pending = []
+            self.current = iteration
+            self._attribute(record, entry)
+        else:
+            self.pending.append({key: entry[key] for key in ("offset", "length", "time", "level")} |
+                                {"text": text[:512]})
+
+    def _attribute(self, record, entry):
+        text = entry["text"]
+        span = [entry["offset"], entry["length"]]
+        record["entries"] += 1
+        record["start"] = record["start"] or entry["time"]
+        record["end"] = entry["time"]
+        match = ITERATION_PATTERN.match(text)
+        if match:
+            feedback = text[match.end():]
+            if record["feedback"] is None:
+                record["feedback"] = span
+                exception = EXCEPTION_PATTERN.match(feedback)
+                if exception:
+                    record["errors"].append(span + [exception.group(1)])
+            score = TRAIN_SCORE_PATTERN.search(feedback)
+            if score and record["train_score"] is None:
+                record["train_score"] = float(score.group(1))
+            reward = MEAN_REWARD_PATTERN.search(feedback)
+            if reward and record["mean_reward"] is None:
+                record["mean_reward"] = float(reward.group(1))
+        elif text.startswith("LLM response:"):
+            record["responses"].append(span)
+        elif text.startswith("\n#Instruction") or text.startswith("#Instruction"):
+            record["prompts"].append(span)
+        elif entry["level"] in ("ERROR", "CRITICAL") or "Traceback (most recent call last)" in text:
+            record["errors"].append(span + [text.strip().splitlines()[0][:200] if text.strip() else entry["level"]])
+
+    def timeline(self):
+        """One row per iteration, in order."""
+        rows = []
+        for iteration in sorted(self.iterations):
+            record = self.iterations[iteration]
+            duration = None
+            if record["start"] and record["end"]:
+                duration = (datetime.datetime.strptime(record["end"], TIME_FORMAT) -
+                            datetime.datetime.strptime(record["start"], TIME_FORMAT)).total_seconds()
+            rows.append({
+                "Iteration": iteration,
+                "Start": record["start"],
+                "Duration (s)": duration,
+                "Train Score": record["train_score"],
+                "Mean Reward": record["mean_reward"],
+                "Errors": len(record["errors"]),
+                "Error": record["errors"][0][2] if record["errors"] else "",
+                "LLM Responses": len(record["responses"]),
+                "Response Bytes": sum(length for _, length in record["responses"]),
+                "Prompt Bytes": sum(length for _, length in record["prompts"]),
+            })
+        return rows
+
+    def read(self, iteration, kind):
+        """Return the raw log entries of kind ("feedback", "prompts", "responses" or "errors") of an iteration."""
+        record = self.iterations[iteration]
+        spans = record[kind] if kind != "feedback" else [record["feedback"]] if record["feedback"] else []
+        texts = []
+        with open(self.log_path, "rb") as f:
+            for span in spans:
+                f.seek(span[0])
+                texts.append(f.read(span[1]).decode(errors="replace"))
+        return texts
+
+
+def _event_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)[:-3]
+
+
+def _payload_size(value):
+    """Length of an event field, whether it is inline or a blob reference."""
+    if isinstance(value, dict) and "blob" in value:
+        return value["bytes"]
+    return len(value) if isinstance(value, str) else 0
+
+
+class EventTimeline:
+    """
+    Per-iteration timeline of an event log (logs/events_<run>.jsonl, see event_log.EventLog).
+
+    The agents write their feedback, prompts and LLM responses there, tagged with the iteration, instead
+    of to the text log. The rotated parts of the log are read too; payloads moved to blobs are only read
+    back when they are printed (or, for the feedback, parsed for the training score).
+    """
+
+    def __init__(self, path):
+        self.log_path = path
+        self.blob_dir = Path(path).parent / "blobs"
+        self.iterations = {}
+        for event in read_events(path, include_rotated=True):
+            iteration = event.get("iteration")
+            if iteration is None:
+                continue
+            record = self.iterations.setdefault(iteration, _new_iteration(iteration))
+            record["entries"] += 1
+            record["start"] = record["start"] or event["time"]
+            record["end"] = event["time"]
+            kind = event["type"]
+            if kind == "eval":
+                record["mean_reward"] = event.get("mean_reward")
+            elif kind == "feedback":
+                if record["feedback"] is None:
+                    record["feedback"] = event["feedback"]
+                    feedback = self._text(event["feedback"])
+                    score = TRAIN_SCORE_PATTERN.search(feedback)
+                    if score:
+                        record["train_score"] = float(score.group(1))
+                    exception = EXCEPTION_PATTERN.match(feedback)
+                    if exception or event.get("error"):
+                        record["errors"].append([event["feedback"], exception.group(1) if exception else "Error"])
+            elif kind == "prompt":
+                record["prompts"].append(event["problem_instance"])
+            elif kind == "response":
+                record["responses"].append(event["response"])
+
+    def _text(self, value):
+        if isinstance(value, dict) and "blob" in value:
+            text = read_blob(self.blob_dir, value)
+            return text if text is not None else f"(blob {value['blob']} was pruned)"
+        return value if isinstance(value, str) else ""
+
+    def timeline(self):
+        """One row per iteration, in order (the same columns as LogIndex.timeline)."""
+        rows = []
+        for iteration in sorted(self.iterations):
+            record = self.iterations[iteration]
+            rows.append({
+                "Iteration": iteration,
+                "Start": _event_time(record["start"]),
+                "Duration (s)": record["end"] - record["start"],
+                "Train Score": record["train_score"],
+                "Mean Reward": record["mean_reward"],
+                "Errors": len(record["errors"]),
+                "Error": record["errors"][0][1] if record["errors"] else "",
+                "LLM Responses": len(record["responses"]),
+                "Response Bytes": sum(_payload_size(response) for response in record["responses"]),
+                "Prompt Bytes": sum(_payload_size(prompt) for prompt in record["prompts"]),
+            })
+        return rows
+
+    def read(self, iteration, kind):
+        """Return the payloads of kind ("feedback", "prompts", "responses" or "errors") of an iteration."""
+        record = self.iterations[iteration]
+        if kind == "feedback":
+            values = [record["feedback"]] if record["feedback"] is not None else []
+        elif kind == "errors":
+            values = [value for value, _ in record["errors"]]
+        else:
+            values = record[kind]
+        return [self._text(value) for value in values]
+
+
+def load_index(log_path, reindex=False):
+    """Load the saved index of log_path, bring it up to date with the log and save it."""
+    index = LogIndex(log_path)
+    if reindex or not index.load():
+        index = LogIndex(log_path)
+    parsed = index.update()
+    if parsed:
+        index.save()
+    return index, parsed
+
+
+def _format(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def print_timeline(rows, file=sys.stdout):
+    columns = ["Iteration", "Start", "Duration (s)", "Train Score", "Mean Reward", "Errors",
+               "LLM Responses", "Response Bytes", "Prompt Bytes", "Error"]
+    table = [[_format(row[c]) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[k]) for r in table]) for k, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip(), file=file)
+    for r in table:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)).rstrip(), file=file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-iteration timeline of optimize_policy logs')
+    parser.add_argument('logs', type=str, nargs='*',
+                        help='Log files or event logs (default: logs/*.log and the events_*.jsonl files in '
+                             'logs/ and results/logs/)')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Also write the timeline to this CSV (with a Log column when several logs are given)')
+    parser.add_argument('--iteration', type=int, default=None, help='Print the raw entries of this iteration')
+    parser.add_argument('--show', type=str, choices=['feedback', 'prompts', 'responses', 'errors'],
+                        default='feedback', help='Entries printed with --iteration')
+    parser.add_argument('--reindex', action='store_true', help='Ignore saved indexes and parse the logs again')
+    args = parser.parse_args()
+
+    # Pong and Breakout write their event logs to logs/, Space Invaders and Riverraid to results/logs/.
+    log_paths = args.logs or sorted(glob.glob(os.path.join("logs", "*.log")) +
+                                    glob.glob(os.path.join("logs", "events_*.jsonl")) +
+                                    glob.glob(os.path.join("results", "logs", "events_*.jsonl")))
+    if not log_paths:
+        parser.error("No log files given and none found in logs/")
+
+    all_rows = []
+    for log_path in log_paths:
+        if log_path.endswith(".jsonl"):
+            index, parsed = EventTimeline(log_path), None
+        else:
+            index, parsed = load_index(log_path, reindex=args.reindex)
+        if not index.iterations:
+            if parsed is None:
+                print(f"==> {log_path}: no events tagged with an iteration <==")
+            else:
+                # Runs since the event log was introduced write their feedback, prompts and responses there.
+                print(f"==> {log_path}: no 'Iteration: i, Feedback:' lines, so no timeline; the iterations of "
+                      f"newer runs are in their event log (events_<run>.jsonl) <==")
+            continue
+        if args.iteration is not None:
+            if args.iteration not in index.iterations:
+                print(f"{log_path}: no iteration {args.iteration}")
+                continue
+            print(f"==> {log_path} iteration {args.iteration} ({args.show}) <==")
+            for text in index.read(args.iteration, args.show):
+                print(text)
+            continue
+        rows = index.timeline()
+        parse_note = f", {parsed} new bytes parsed" if parsed is not None else ""
+        print(f"==> {log_path} ({len(rows)} iterations{parse_note}) <==")
+        print_timeline(rows)
+        all_rows.extend({"Log": log_path, **row} for row in rows)
+
+    if args.csv and all_rows:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(all_rows[0]))
+            writer.writeheader()
+            writer.writerows(all_rows)
+        print(f"Timeline written to {args.csv}")
@@ -0,0 +1,208 @@
+import argparse
+import importlib
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import opto.trace as trace
+from opto.trace import bundle
+
+from inference import inference_mode
+
+# name -> (agent module, traced env class, module providing the Policy workload or None)
+BENCHMARKS = {
+    "Pong": ("pong_ocatari_LLM_agent", "PongOCAtariTracedEnv", "best_policies.Pong"),
+    "Breakout": ("breakout_ocatari_LLM_agent", "TracedEnv", "best_policies.Breakout"),
+    "SpaceInvaders": ("space_invaders_ocatari_LLM_agent", "SpaceInvadersOCAtariTracedEnv", "best_policies.SpaceInvaders"),
+    # There is no optimized Riverraid policy yet, so the agent's initial policy is the workload.
+    "Riverraid": ("riverraid_ocatari_LLM_agent", "RiverraidOCAtariTracedEnv", "riverraid_ocatari_LLM_agent"),
+    "PongPixels": ("pong_LLM_agent", "PongTracedEnv", None),
+}
+
+# Each layer adds one cost on top of the previous one.
+LAYERS = ["raw", "extract", "bundle", "policy", "inference"]
+
+
+@bundle()
+def pixel_pong_policy(obs):
+    """
+    Move the paddle towards the ball's vertical position; NOOP when either is not visible.
+    """
+    ball_pos = obs.get('ball_pos', None)
+    paddle_pos = obs.get('paddle_pos', None)
+    if ball_pos is None or paddle_pos is None:
+        return 0
+    ball_y = ball_pos[1] + ball_pos[3] // 2
+    paddle_y = paddle_pos[1] + paddle_pos[3] // 2
+    if ball_y < paddle_y:
+        return 3
+    elif ball_y > paddle_y:
+        return 2
+    return 0
+
+
+def _plain(value):
+    return value.data if isinstance(value, trace.Node) else value
+
+
+class _Workload:
+    """A traced env, its policy and the per-layer step functions benchmarked on it."""
+
+    def __init__(self, name):
+        module_name, env_name, policy_module = BENCHMARKS[name]
+        module = importlib.import_module(module_name)
+        self.name = name
+        self.pixels = policy_module is None
+        if self.pixels:
+            self.env = getattr(module, env_name)(render_mode=None)
+            self.policy = pixel_pong_policy
+            self.extract = lambda frame, info: module.process_image(frame)
+        else:
+            self.env = getattr(module, env_name)(render_mode=None, frameskip=4, repeat_action_probability=0.0)
+            self.policy = importlib.import_module(policy_module).Policy()
+            if hasattr(self.env, "extract_game_state"):
+                self.extract = lambda frame, info: self.env.extract_game_state(self.env.env.objects, frame, info)
+            else:
+                self.extract = lambda frame, info: self.env.extract_obj_state(self.env.env.objects)
+        self.policy_errors = 0
+        self.obs = None
+
+    def close(self):
+        self.env.close()
+
+    def seed(self, seed):
+        random.seed(seed)
+        np.random.seed(seed)
+        if self.pixels:
+            self.env.env.reset(seed=seed)
+        else:
+            self.env.seed(seed)
+
+    def act(self, obs):
+        """Query the policy; a failing policy counts as an error and plays NOOP so the workload keeps going."""
+        try:
+            return self.policy(obs)
+        except Exception:
+            self.policy_errors += 1
+            return 0
+
+    def reset(self, layer):
+        if layer in ("raw", "extract"):
+            self.env.env.reset()
+        elif layer == "inference":
+            with inference_mode():
+                self.obs, _ = self.env.reset()
+        else:
+            self.obs, _ = self.env.reset()
+
+    def step(self, layer, action):
+        """Run one step of the given layer and return (action played, terminated or truncated)."""
+        if layer == "raw":
+            _, _, terminated, truncated, _ = self.env.env.step(action)
+        elif layer == "extract":
+            frame, _, terminated, truncated, info = self.env.env.step(action)
+            self.extract(frame, info)
+        elif layer == "bundle":
+            _, _, terminated, truncated, _ = self.env.step(action)
+        elif layer == "policy":
+            action = self.act(self.obs)
+            self.obs, _, terminated, truncated, _ = self.env.step(action)
+        else:
+            with inference_mode():
+                action = self.act(self.obs)
+                self.obs, _, terminated, truncated, _ = self.env.step(action)
+        return _plain(action), terminated or truncated
+
+
+def benchmark_env(name, num_steps=1000, seed=0, layers=None):
+    """
+    Measure the step throughput of one traced env, layer by layer.
+
+    Layers: "raw" steps OCAtari (or gym for PongPixels) directly, "extract" adds the observation extraction,
+    "bundle" uses the traced env's step() with its Trace bundle, "policy" adds a traced call of the policy
+    workload, and "inference" runs policy and env untraced (see inference.inference_mode). The raw, extract
+    and bundle layers replay the actions the policy played in the first policy layer run, so every layer
+    sees the same kind of game play.
+
+    Returns:
+        list: One dict per layer with steps/s and per-step latency percentiles in milliseconds.
+    """
+    layers = layers or LAYERS
+    workload = _Workload(name)
+    actions = []
+    results = []
+    try:
+        # Record the policy's actions first so that the replayed layers play comparable games.
+        order = sorted(layers, key=lambda layer: layer not in ("policy", "inference"))
+        for layer in order:
+            if layer == "inference" and workload.pixels:
+                continue  # The pixel-based env has no untraced mode.
+            workload.seed(seed)
+            workload.reset(layer)
+            workload.policy_errors = 0
+            record = layer in ("policy", "inference") and not actions
+            latencies = np.empty(num_steps)
+            for t in range(num_steps):
+                # Layers without a policy replay the recorded actions (NOOP if no policy layer ran).
+                action = actions[t % len(actions)] if actions and not record else 0
+                start = time.perf_counter()
+                played, done = workload.step(layer, action)
+                latencies[t] = time.perf_counter() - start
+                if record:
+                    actions.append(played)
+                if done:
+                    workload.reset(layer)
+            results.append({
+                "env": name,
+                "layer": layer,
+                "steps": num_steps,
+                "steps_per_s": num_steps / latencies.sum(),
+                "mean_ms": latencies.mean() * 1e3,
+                "p50_ms": np.percentile(latencies, 50) * 1e3,
+                "p90_ms": np.percentile(latencies, 90) * 1e3,
+                "p99_ms": np.percentile(latencies, 99) * 1e3,
+                "policy_errors": workload.policy_errors,
+            })
+    finally:
+        workload.close()
+    return sorted(results, key=lambda row: LAYERS.index(row["layer"]))
+
+
+def compare_to_baseline(df, baseline_csv, tolerance=0.2):
+    """Return the rows of df whose steps/s dropped by more than tolerance relative to baseline_csv."""
+    baseline = pd.read_csv(baseline_csv)
+    merged = df.merge(baseline[["env", "layer", "steps_per_s"]], on=["env", "layer"], suffixes=("", "_baseline"))
+    merged["change"] = merged["steps_per_s"] / merged["steps_per_s_baseline"] - 1
+    return merged[merged["change"] < -tolerance]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the step throughput of the traced Atari envs")
+    parser.add_argument("--envs", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Envs to benchmark")
+    parser.add_argument("--layers", nargs="+", choices=LAYERS, default=LAYERS, help="Layers to measure")
+    parser.add_argument("--steps", type=int, default=1000, help="Steps measured per env and layer")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the emulator and the policies")
+    parser.add_argument("--csv", type=str, default=None, help="Write the results to this CSV file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="CSV from an earlier run; exit with status 1 if any env/layer got slower")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative drop in steps/s before a result counts as a regression")
+    args = parser.parse_args()
+
+    rows = []
+    for name in args.envs:
+        rows.extend(benchmark_env(name, num_steps=args.steps, seed=args.seed, layers=args.layers))
+    df = pd.DataFrame(rows)
+    with pd.option_context("display.width", 200, "display.float_format", "{:.3f}".format):
+        print(df.to_string(index=False))
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+    if args.baseline:
+        regressions = compare_to_baseline(df, args.baseline, args.tolerance)
+        if len(regressions):
+            print("\nRegressions:")
+            print(regressions[["env", "layer", "steps_per_s", "steps_per_s_baseline", "change"]].to_string(index=False))
+            sys.exit(1)
@@ -1,5 +1,6 @@
 import opto.trace as trace
 from opto.trace import bundle, node, Module, GRAPH
+from inference import policy_method
 
 @trace.model
 class Policy(Module):
@@ -7,9 +8,9 @@ class Policy(Module):
         pass
 
     def __call__(self, obs):
-        pre_ball_x = self.predict_ball_trajectory(obs)
-        target_paddle_pos = self.generate_paddle_target(pre_ball_x, obs)
-        action = self.select_paddle_action(target_paddle_pos, obs)
+        pre_ball_x = policy_method(self, "predict_ball_trajectory")(obs)
+        target_paddle_pos = policy_method(self, "generate_paddle_target")(pre_ball_x, obs)
+        action = policy_method(self, "select_paddle_action")(target_paddle_pos, obs)
         return action
     @bundle(trainable=True)
     def predict_ball_trajectory(self, obs):
@@ -1,5 +1,6 @@
 import opto.trace as trace
 from opto.trace import bundle, Module
+from inference import policy_method
 
 @trace.model
 class Policy(Module):
@@ -7,8 +8,8 @@ class Policy(Module):
         pass
 
     def __call__(self, obs):
-        predicted_ball_y = self.predict_ball_trajectory(obs)
-        action = self.select_action(predicted_ball_y, obs)
+        predicted_ball_y = policy_method(self, "predict_ball_trajectory")(obs)
+        action = policy_method(self, "select_action")(predicted_ball_y, obs)
         return action
 
     @bundle(trainable=True)
@@ -1,5 +1,6 @@
 import opto.trace as trace
 from opto.trace import bundle, node, Module, GRAPH
+from inference import policy_method
 import random
 
 @trace.model
@@ -8,9 +9,9 @@ class Policy(Module):
         pass
 
     def __call__(self, obs):
-        shoot_decision = self.decide_shoot(obs)
-        move_decision = self.decide_movement(obs)
-        return self.combine_actions(shoot_decision, move_decision)
+        shoot_decision = policy_method(self, "decide_shoot")(obs)
+        move_decision = policy_method(self, "decide_movement")(obs)
+        return policy_method(self, "combine_actions")(shoot_decision, move_decision)
     
     @bundle(trainable=True)
     def decide_shoot(self, obs):
@@ -1,10 +1,10 @@
 import os
+import argparse
 import ale_py
 import logging
 import datetime
 from pathlib import Path
 import numpy as np
-import pandas as pd
 import io
 import contextlib
 import random
@@ -20,6 +20,24 @@ from opto.optimizers import OptoPrime
 from opto.trace.bundle import ExceptionNode
 from opto.trace.errors import ExecutionError
 from ocatari.core import OCAtari
+from vector_eval import run_episodes
+from parallel_eval import submit_episodes, collect_episodes, cancel_episodes
+from inference import inference_mode, is_inference_mode, policy_method
+from trace_window import windowed_rollout, describe_history
+from obs_state import build_object_state
+from env_snapshot import capture_snapshot, restore_snapshot
+from macro_actions import is_macro_action, step_many
+from shm_transport import SharedMemoryEnvPool
+from early_stopping import EarlyStopping
+from eval_cache import EvalCache, evaluation_key
+from population import propose_candidates, select_candidate
+from llm_cache import make_llm
+from summary_compression import install_summary_compression
+from instrumentation import PhaseTimer, PhaseProfiler, TokenCountingLLM, perf_columns
+from metrics_writer import MetricsWriter
+from event_log import EventLog
+from trajectory_store import TrajectoryStore, EpisodeRecorder
+from paired_eval import evaluate_paired
 
 load_dotenv(override=True)
 gym.register_envs(ale_py)
@@ -50,9 +68,24 @@ class TracedEnv:
         self.initial_policy = initial_policy
         self.initial_policy_steps = initial_policy_steps
         self.current_lives = None
+        self.needs_rebuild = False
+        self.start_snapshot = None
         self.init()
     
     def init(self):
+        """
+        Get the environment ready for a new episode. The existing OCAtari instance is reset in place
+        and only rebuilt when it is missing or failed its health check.
+        """
+        if not self.is_healthy():
+            self.rebuild()
+        self.obs, _ = self.env.reset()
+        self.current_lives = self.env._env.unwrapped.ale.lives()
+
+    def rebuild(self):
+        """
+        Tear down the current OCAtari instance (if any) and construct a fresh one.
+        """
         if self.env is not None:
             self.close()
         self.env = OCAtari(self.env_name, 
@@ -61,8 +94,42 @@ class TracedEnv:
                     hud=self.hud,
                     frameskip=self.frameskip,
                     repeat_action_probability=self.repeat_action_probability)
-        self.obs, _ = self.env.reset()
-        self.current_lives = self.env._env.unwrapped.ale.lives()
+        self.needs_rebuild = False
+
+    def is_healthy(self):
+        """
+        Check whether the underlying emulator can be reused without rebuilding it.
+        """
+        if self.env is None or self.needs_rebuild:
+            return False
+        try:
+            self.env._env.unwrapped.ale.lives()
+        except Exception:
+            return False
+        return True
+
+    def seed(self, seed):
+        """
+        Seed the emulator (including sticky actions) so that the next reset() starts a reproducible episode.
+        """
+        self.env.reset(seed=seed)
+
+    def snapshot(self, info=None):
+        """
+        Capture the current game state (see env_snapshot.capture_snapshot). Setting the result as
+        start_snapshot makes every following reset() start from this state instead of a new game.
+        """
+        obs = self.obs.data if isinstance(self.obs, trace.Node) else self.obs
+        return capture_snapshot(self.env, obs=obs, info=info, current_lives=self.current_lives)
+
+    def restore(self, snapshot):
+        """
+        Return to a state captured by snapshot() and return its info.
+        """
+        restore_snapshot(self.env, snapshot)
+        self.obs = snapshot.obs
+        self.current_lives = snapshot.extras["current_lives"]
+        return dict(snapshot.info)
 
     def close(self):
         if self.env is not None:
@@ -74,12 +141,10 @@ class TracedEnv:
     def __del__(self):
         self.close()
 
-    def extract_game_state(self, objects, rgb, info):
-        obs = dict()
-        color_blocks = {
-            "Red": [], "Orange": [], "Yellow": [],
-            "Green": [], "Aqua": [], "Blue": []
-        }
+    def extract_game_state(self, objects, rgb, info, reward=np.nan):
+        entries = []
+        block_groups = {f"{color[0]}B": ("x", "y", "w", "h")
+                        for color in ["Red", "Orange", "Yellow", "Green", "Aqua", "Blue"]}
         for object in objects:
             if object.category == "NoObject":
                 continue
@@ -93,75 +158,82 @@ class TracedEnv:
                 elif object.y == 87: color = "Blue"
                 else: continue  # Skip unknown y-positions
             
-                color_blocks[color].append({
-                    "x": object.x,
-                    "y": object.y,
-                    "w": object.w,
-                    "h": object.h,
-                })
+                entries.append((f"{color[0]}B", object))
             else:
-                obs[object.category] = {"x": object.x,
-                                        "y": object.y,
-                                        "w": object.w,
-                                        "h": object.h,
-                                        "dx": object.dx,
-                                        "dy": object.dy,}
-        for color, blocks in color_blocks.items():
-            if blocks:
-                obs[f"{color[0]}B"] = blocks
+                entries.append((object.category, object))
+        extras = dict()
         if info:
-            obs['lives'] = info.get('lives', None)
-        return obs
+            extras['lives'] = info.get('lives', None)
+        extras['reward'] = reward
+        return build_object_state(entries, groups=block_groups, extras=extras)
 
 
-    @bundle()
     def reset(self):
         """
         Reset the environment and return the initial observation and info.
+        With an initial_policy, the warm-start state it reaches is captured on the first reset and
+        restored by later resets.
         """
-        _, _ = self.env.reset()
-        obs, _, terminated, truncated, info = self.env.step(1)
-        self.current_lives = info.get('lives')
-        self.obs = self.extract_game_state(self.env.objects, obs, info)
-        self.obs['reward'] = np.nan
-        if self.initial_policy:
-            steps = 0
-            while (steps < self.initial_policy_steps):
-                action = self.initial_policy(self.obs)
-                next_obs, reward, terminated, truncated, info = self.policy_step(action)
-                self.obs = self.extract_game_state(self.env.objects, next_obs, info)
-                self.obs['reward'] = reward
-                if terminated or truncated:
-                    raise ValueError(f"Initial policy terminated the env in initial policy steps {self.initial_policy_steps}")
-                steps += 1
+        if self.start_snapshot is not None:
+            info = self.restore(self.start_snapshot)
+        else:
+            _, _ = self.env.reset()
+            obs, _, terminated, truncated, info = self.env.step(1)
+            self.current_lives = info.get('lives')
             self.obs = self.extract_game_state(self.env.objects, obs, info)
-            self.obs['reward'] =reward
+            if self.initial_policy:
+                steps = 0
+                while (steps < self.initial_policy_steps):
+                    action = self.initial_policy(self.obs)
+                    next_obs, reward, terminated, truncated, info = self.policy_step(action)
+                    self.obs = self.extract_game_state(self.env.objects, next_obs, info, reward=reward)
+                    if terminated or truncated:
+                        raise ValueError(f"Initial policy terminated the env in initial policy steps {self.initial_policy_steps}")
+                    steps += 1
+                self.obs = self.extract_game_state(self.env.objects, obs, info, reward=reward)
+                # Keep the warm-start state so that later resets restore it instead of replaying the initial policy.
+                self.start_snapshot = self.snapshot(info)
+        if is_inference_mode():
+            return self.obs, info
+
+        @bundle()
+        def reset():
+            """
+            Reset the environment and return the initial observation and info.
+            """
+            return self.obs, info
 
-        return self.obs, info
+        return reset()
     
-    def policy_step(self, action):
-        next_obs, reward, termination, truncation, info = self.env.step(action)
+    def emulator_step(self, control):
+        """Step the emulator, pressing FIRE after a lost life, without extracting the observation."""
+        next_obs, reward, termination, truncation, info = self.env.step(control)
         lives = info.get('lives')
         if self.current_lives and lives < self.current_lives:
             next_obs, reward, termination, truncation, info = self.env.step(1)
         self.current_lives = lives
-        self.obs = self.extract_game_state(self.env.objects, next_obs, info)
-        self.obs['rewrad'] = reward
+        return next_obs, reward, termination, truncation, info
+
+    def observe(self, next_obs, info, reward=np.nan):
+        return self.extract_game_state(self.env.objects, next_obs, info, reward=reward)
+
+    def policy_step(self, action):
+        next_obs, reward, termination, truncation, info = self.emulator_step(action)
+        self.obs = self.observe(next_obs, info, reward=reward)
         return self.obs, reward, termination, truncation, info
         
     
     def step(self, action):
+        if is_macro_action(action):
+            return step_many(self, action)
         try:
             control = action.data if isinstance(action, trace.Node) else action
-            next_obs, reward, termination, truncation, info = self.env.step(control)
-            lives = info.get('lives')
-            if self.current_lives and lives < self.current_lives:
-                next_obs, reward, termination, truncation, info = self.env.step(1)
-            self.current_lives = lives
-
-            self.obs = self.extract_game_state(self.env.objects, next_obs, info)
-            self.obs['reward'] = reward
+            next_obs, reward, termination, truncation, info = self.emulator_step(control)
+            self.obs = self.observe(next_obs, info, reward=reward)
         except Exception as e:
+            self.needs_rebuild = True
+            if is_inference_mode():
+                raise
             e_node = ExceptionNode(
                 e,
                 inputs={"action": action},
@@ -169,6 +241,9 @@ class TracedEnv:
                 name="exception_step",
             )
             raise ExecutionError(e_node)
+        if is_inference_mode():
+            return self.obs, reward, termination, truncation, info
+
         @bundle()
         def step(action):
             """
@@ -185,9 +260,9 @@ class Policy(Module):
         pass
 
     def __call__(self, obs):
-        pre_ball_x = self.predict_ball_trajectory(obs)
-        target_paddle_pos = self.generate_paddle_target(pre_ball_x, obs)
-        action = self.select_paddle_action(target_paddle_pos, obs)
+        pre_ball_x = policy_method(self, "predict_ball_trajectory")(obs)
+        target_paddle_pos = policy_method(self, "generate_paddle_target")(pre_ball_x, obs)
+        action = policy_method(self, "select_paddle_action")(target_paddle_pos, obs)
         return action
 
     @bundle(trainable=True)
@@ -293,67 +368,164 @@ class Policy(Module):
 
 
 
-def rollout(env, horizon, policy):
-    """Rollout a policy in an env for horizon steps."""
-    try:
-        obs, _ = env.reset()
-        trajectory = dict(observations=[], actions=[], rewards=[], terminations=[], truncations=[], infos=[], steps=0)
-        trajectory["observations"].append(obs)
-        
-        for i in range(horizon):
-            error = None
-            try:
-                action = policy(obs)
-                next_obs, reward, termination, truncation, info = env.step(action)
-            except trace.ExecutionError as e:
-                error = e
-                reward = np.nan
-                termination = True
-                truncation = False
-                info = {}
-            
-            if error is None:
-                trajectory["observations"].append(next_obs)
-                trajectory["actions"].append(action)
-                trajectory["rewards"].append(reward)
-                trajectory["terminations"].append(termination)
-                trajectory["truncations"].append(truncation)
-                trajectory["infos"].append(info)
-                trajectory["steps"] += 1
-                if termination or truncation:
-                    break
-                obs = next_obs
-    finally:
-        env.close()
+def rollout(env, horizon, policy, window=None):
+    """
+    Rollout a policy in an env for horizon steps. The env is left open so that it can be
+    reset in place by the next env.init() call; the caller is responsible for closing it.
+    If window is set, only the last window steps are traced (see trace_window.windowed_rollout).
+    """
+    if window is not None:
+        return windowed_rollout(env, horizon, policy, window)
+    obs, _ = env.reset()
+    trajectory = dict(observations=[], actions=[], rewards=[], terminations=[], truncations=[], infos=[], steps=0)
+    trajectory["observations"].append(obs)
+    
+    for i in range(horizon):
+        error = None
+        try:
+            action = policy(obs)
+            next_obs, reward, termination, truncation, info = env.step(action)
+        except trace.ExecutionError as e:
+            error = e
+            reward = np.nan
+            termination = True
+            truncation = False
+            info = {}
     
+        if error is None:
+            trajectory["observations"].append(next_obs)
+            trajectory["actions"].append(action)
+            trajectory["rewards"].append(reward)
+            trajectory["terminations"].append(termination)
+            trajectory["truncations"].append(truncation)
+            trajectory["infos"].append(info)
+            trajectory["steps"] += 1
+            if termination or truncation:
+                break
+            obs = next_obs
+
     return trajectory, error
 
+def test_cache_key(policy,
+                   num_episodes=1,
+                   steps_per_episode=4000,
+                   frameskip=1,
+                   repeat_action_probability=0.0,
+                   base_seed=None):
+    """
+    Key of the eval cache entry that test_policy reads and writes for these settings, so that callers
+    can look a policy up before starting any of its episodes.
+    """
+    return evaluation_key(policy,
+                          env=TracedEnv.__name__,
+                          frameskip=frameskip,
+                          repeat_action_probability=repeat_action_probability,
+                          num_episodes=num_episodes,
+                          steps_per_episode=steps_per_episode,
+                          base_seed=base_seed)
+
+def submit_test_episodes(policy,
+                         num_episodes=1,
+                         steps_per_episode=4000,
+                         frameskip=1,
+                         repeat_action_probability=0.0,
+                         num_workers=0,
+                         base_seed=None):
+    """
+    Start the evaluation episodes of test_policy in the worker pool without waiting for them.
+    Passing the returned futures to test_policy as pending collects them, so an evaluation can run
+    while the main process does something else with the same policy, e.g. the traced rollout.
+    """
+    return submit_episodes(policy,
+                           TracedEnv,
+                           dict(render_mode=None,
+                                frameskip=frameskip,
+                                repeat_action_probability=repeat_action_probability),
+                           num_episodes,
+                           steps_per_episode,
+                           num_workers=num_workers,
+                           base_seed=base_seed)
+
+@inference_mode()
 def test_policy(policy, 
                 num_episodes=1, 
                 steps_per_episode=4000,
                 frameskip=1,
                 repeat_action_probability=0.0,
-                logger=None):
+                logger=None,
+                env=None,
+                num_envs=1,
+                num_workers=0,
+                base_seed=None,
+                early_stop=None,
+                cache=None,
+                pending=None,
+                recorder=None):
+    """
+    Evaluate a policy on num_episodes episodes played across one or more envs stepping together.
+    env may be a caller-owned env or list of envs that is reused across calls; otherwise num_envs
+    fresh envs are built and closed afterwards. With num_workers > 1 the episodes are instead
+    played by a pool of worker processes. With base_seed set, episode i is seeded with base_seed + i
+    either way (see vector_eval.seed_episode); the default None plays unseeded episodes, which are
+    never cached.
+    early_stop (e.g. an early_stopping.EarlyStopping) is called with the rewards so far, in episode
+    order, as episodes finish and ends the evaluation when it returns True.
+    With an eval_cache.EvalCache as cache, a policy whose parameter code was already evaluated with the
+    same settings is not played again, and complete evaluations are added to the cache.
+    pending may hold the futures of submit_test_episodes, started earlier with the same settings; they
+    are collected instead of submitting the episodes again.
+    recorder (a trajectory_store.EpisodeRecorder) stores the episodes played in this process; episodes
+    played by worker processes are not recorded.
+    Returns (mean_reward, std_reward).
+    """
+    if base_seed is None:
+        cache = None  # Unseeded rewards are one random draw, not a result of the policy code
+    cache_key = None
+    if cache is not None:
+        cache_key = test_cache_key(policy, num_episodes, steps_per_episode, frameskip,
+                                   repeat_action_probability, base_seed)
+        rewards = cache.get(cache_key)
+        if rewards is not None:
+            if pending is not None:
+                cancel_episodes(pending)
+            logger.info("Policy code already evaluated, using the cached rewards")
+            # Apply the stopping rule to the cached rewards, as if the episodes had been played again.
+            for n in range(1, len(rewards) + 1):
+                if early_stop is not None and early_stop(rewards[:n]):
+                    rewards = rewards[:n]
+                    break
+            return np.mean(rewards), np.std(rewards)
     logger.info("Evaluating policy")
-    env = TracedEnv(render_mode=None,
-                    frameskip=frameskip,
-                    repeat_action_probability=repeat_action_probability)
-    rewards = []
-    
-    for episode in range(num_episodes):
-        obs, info = env.reset()
-        episode_reward = 0
-        
-        for _ in range(steps_per_episode):
-            action = policy(obs)
-            obs, reward, terminated, truncated, _ = env.step(action)
-            episode_reward += reward
-            
-            if terminated or truncated:
-                break
-        
-        rewards.append(episode_reward)
-    env.close()
+    if num_workers > 1 or pending is not None:
+        if pending is None:
+            pending = submit_test_episodes(policy, num_episodes, steps_per_episode, frameskip,
+                                           repeat_action_probability, num_workers, base_seed)
+        rewards = collect_episodes(pending, stop_when=early_stop)
+        # Early-stopped evaluations played fewer episodes and are not cached.
+        if cache is not None and len(rewards) == num_episodes:
+            cache.put(cache_key, rewards)
+        return np.mean(rewards), np.std(rewards)
+
+    # Reuse caller-owned envs across calls; only build (and later close) them when none are given.
+    own_env = env is None
+    if own_env:
+        envs = [TracedEnv(render_mode=None,
+                          frameskip=frameskip,
+                          repeat_action_probability=repeat_action_probability)
+                for _ in range(max(1, min(num_envs, num_episodes)))]
+    else:
+        envs = env if isinstance(env, (list, tuple)) else [env]
+        for e in envs:
+            e.init()
+    try:
+        rewards = run_episodes(envs, policy, num_episodes, steps_per_episode, stop_when=early_stop,
+                               record=recorder, base_seed=base_seed)
+    finally:
+        if own_env:
+            for e in envs:
+                e.close()
+    if cache is not None and len(rewards) == num_episodes:
+        cache.put(cache_key, rewards)
     
     mean_reward = np.mean(rewards)
     std_reward = np.std(rewards)
@@ -371,6 +543,25 @@ def optimize_policy(
     policy_ckpt=None,
     initial_policy=None,
     initial_policy_steps=None,
+    num_eval_envs=1,
+    num_eval_workers=0,
+    eval_env_processes=False,
+    trace_window=None,
+    num_eval_episodes=1,
+    early_stop_confidence=None,
+    eval_cache_dir=None,
+    concurrent_eval=False,
+    paired_eval=False,
+    paired_eval_episodes=10,
+    population_size=1,
+    population_eval_episodes=3,
+    llm_cache_dir=None,
+    offline_llm=False,
+    compress_trace=False,
+    summary_token_budget=None,
+    metrics_format="csv",
+    record_trajectories=False,
+    profile=None,
 ):
     if logger is None:
         logger = logging.getLogger(__name__)
@@ -385,59 +576,171 @@ def optimize_policy(
     if policy_ckpt:
         logger.info(f"Continuing training from ckpt: {policy_ckpt}")
         policy.load(policy_ckpt)
-    optimizer = OptoPrime(policy.parameters(), memory_size=memory_size)
+    # With llm_cache_dir, prompts seen before are answered from the cache; offline_llm replays them without any model.
+    llm = TokenCountingLLM(make_llm(llm_cache_dir, offline=offline_llm))
+    optimizer = OptoPrime(policy.parameters(), llm=llm, memory_size=memory_size)
+    if compress_trace:
+        install_summary_compression(optimizer, token_budget=summary_token_budget)
+    # Time spent per phase of each step, written to the perf CSV next to the LLM token counts.
+    timer = PhaseTimer()
+    timer.wrap(optimizer, "summarize", "summarize")
     env = TracedEnv(env_name=env_name,
                     frameskip=frame_skip,
                     repeat_action_probability=sticky_action_p,
                     initial_policy=initial_policy,
                     initial_policy_steps=initial_policy_steps)
-    perf_csv_filename = log_dir / f"perf_{env_name.replace("/", "_")}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}.csv"
-    trace_ckpt_dir = base_trace_ckpt_dir / f"{env_name.replace("/", "_")}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}"
+    if eval_env_processes:
+        eval_envs = SharedMemoryEnvPool(TracedEnv,
+                                        dict(render_mode=None,
+                                             frameskip=frame_skip,
+                                             repeat_action_probability=sticky_action_p),
+                                        num_eval_envs).envs
+    else:
+        eval_envs = [TracedEnv(render_mode=None,
+                               frameskip=frame_skip,
+                               repeat_action_probability=sticky_action_p)
+                     for _ in range(num_eval_envs)]
+    run_name = f"{env_name.replace("/", "_")}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}"
+    perf_filename = log_dir / f"perf_{run_name}.{metrics_format}"
+    # One row per optimization step, appended as soon as the step is done.
+    metrics = MetricsWriter(perf_filename)
+    # Typed events (feedback, prompts, LLM responses, evaluations); large payloads go to compressed blobs.
+    events = EventLog(log_dir / f"events_{run_name}.jsonl")
+    trace_ckpt_dir = base_trace_ckpt_dir / run_name
     trace_ckpt_dir.mkdir(exist_ok=True)
+    # Rollouts and evaluation episodes kept for offline analysis (see trajectory_store).
+    trajectories = TrajectoryStore(trace_ckpt_dir / "trajectories") if record_trajectories else None
+    # Per-iteration cProfile stats and allocation reports of every timed phase (see PhaseProfiler).
+    profiler = PhaseProfiler(trace_ckpt_dir / "profile", mode=profile) if profile else None
+    timer.profiler = profiler
+    # Evaluations of parameter code that was already tried are looked up instead of played again.
+    eval_cache = EvalCache(eval_cache_dir) if eval_cache_dir else None
+    # Only cached evaluations need fixed seeds; otherwise every iteration plays fresh episodes.
+    eval_seed = 0 if eval_cache is not None else None
     try:
         rewards = []
-        optimization_data = []
         logger.info("Optimization Starts")
         best_mean_reward = 0
         best_ckpt = None
         best_iter = None
         recent_mean_rewards = []
         for i in range(n_optimization_steps):
+            events.emit("iteration", iteration=i)
             mean_rewards = np.nan
             std_rewards = np.nan
             steps_used = np.nan
+            eval_episodes = np.nan
+            paired = None
             step_start_time = time.time()
-            env.init()
-            traj, error = rollout(env, horizon, policy)
+            timer.reset()
+            if profiler is not None:
+                profiler.start_iteration(i)
+            llm.reset()
+            with timer.phase("env_init"):
+                env.init()
+            steps_per_episode = 4000
+            pending_eval = None
+            # With paired_eval, candidates are compared with the best checkpoint on the same seeds once there is one.
+            compare_paired = paired_eval and best_ckpt is not None
+            if concurrent_eval and not compare_paired and (
+                    eval_cache is None or
+                    eval_cache.get(test_cache_key(policy,
+                                                  num_episodes=num_eval_episodes,
+                                                  steps_per_episode=steps_per_episode,
+                                                  frameskip=frame_skip,
+                                                  repeat_action_probability=sticky_action_p,
+                                                  base_seed=eval_seed)) is None):
+                # The rollout does not change the policy, so its evaluation episodes can play in the worker
+                # pool while the traced rollout runs here. Cached policies are not played at all.
+                pending_eval = submit_test_episodes(policy,
+                                                    num_episodes=num_eval_episodes,
+                                                    steps_per_episode=steps_per_episode,
+                                                    frameskip=frame_skip,
+                                                    repeat_action_probability=sticky_action_p,
+                                                    num_workers=num_eval_workers,
+                                                    base_seed=eval_seed)
+            with timer.phase("rollout"):
+                traj, error = rollout(env, horizon, policy, window=trace_window)
+            if trajectories is not None:
+                trajectories.write("rollout", i, 0, traj["observations"], traj["actions"], traj["rewards"],
+                                   traj["terminations"], traj["truncations"])
 
             if error is None:
                 feedback = f"Episode ends after {traj['steps']} steps with total score: {sum(traj['rewards']):.1f}"
-                num_episodes = 1
-                steps_per_episode = 4000
-                mean_rewards, std_rewards = test_policy(policy,
-                                                        num_episodes=num_episodes,
-                                                        steps_per_episode=steps_per_episode,
-                                                        frameskip=frame_skip,
-                                                        repeat_action_probability=sticky_action_p,
-                                                        logger=logger) # run the policy on 10 games of length 4000 steps each
-                steps_used = traj['steps']  
-                
+                history_summary = describe_history(traj.get("history"))
+                if history_summary:
+                    feedback += f"\n{history_summary}"
+                if compare_paired:
+                    # Play the candidate and the incumbent on identical seeds and sticky-action streams; the
+                    # paired differences are far less noisy than two independent evaluations. With
+                    # early_stop_confidence set, stop once the difference is confidently non-zero.
+                    incumbent = Policy()
+                    incumbent.load(best_ckpt)
+                    early_stop = EarlyStopping(0.0 if early_stop_confidence else None,
+                                               confidence=early_stop_confidence or 0.95)
+                    with timer.phase("evaluation"):
+                        paired = evaluate_paired(policy,
+                                                 incumbent,
+                                                 TracedEnv,
+                                                 dict(render_mode=None,
+                                                      frameskip=frame_skip,
+                                                      repeat_action_probability=sticky_action_p),
+                                                 paired_eval_episodes,
+                                                 steps_per_episode,
+                                                 env=eval_envs[0],
+                                                 num_workers=num_eval_workers,
+                                                 stop_when=early_stop,
+                                                 confidence=early_stop_confidence or 0.95)
+                    mean_rewards, std_rewards = np.mean(paired.candidate_rewards), np.std(paired.candidate_rewards)
+                    steps_used = traj['steps']
+                    num_episodes = eval_episodes = len(paired.differences)
+                    logger.info(f"Paired evaluation against {best_ckpt} over {eval_episodes} games: difference "
+                                f"{paired.mean_difference} with variance {paired.variance} (interval {paired.interval})")
+                else:
+                    # With early_stop_confidence set, stop evaluating once the candidate is confidently below
+                    # or above the best checkpoint so far.
+                    early_stop = EarlyStopping(best_mean_reward if early_stop_confidence and best_iter is not None else None,
+                                               confidence=early_stop_confidence or 0.95)
+                    with timer.phase("evaluation"):
+                        mean_rewards, std_rewards = test_policy(policy,
+                                                                num_episodes=num_eval_episodes,
+                                                                steps_per_episode=steps_per_episode,
+                                                                frameskip=frame_skip,
+                                                                repeat_action_probability=sticky_action_p,
+                                                                logger=logger,
+                                                                env=eval_envs,
+                                                                num_workers=num_eval_workers,
+                                                                early_stop=early_stop,
+                                                                base_seed=eval_seed,
+                                                                cache=eval_cache,
+                                                                recorder=EpisodeRecorder(trajectories, "eval", i) if trajectories is not None else None,
+                                                                pending=pending_eval) # run the policy on num_eval_episodes games of length 4000 steps each
+                    steps_used = traj['steps']  
+                    num_episodes = eval_episodes = early_stop.episodes_used
+                    if early_stop.decision is not None:
+                        logger.info(f"Evaluation stopped after {eval_episodes} games: {early_stop.decision} the "
+                                    f"best mean reward {best_mean_reward} (interval {early_stop.interval})")
+                events.emit("eval", iteration=i, mean_reward=mean_rewards, std_reward=std_rewards,
+                            episodes=eval_episodes, decision=early_stop.decision,
+                            paired_difference=paired.mean_difference if paired is not None else None)
                 recent_mean_rewards.append(mean_rewards)
                 if len(recent_mean_rewards) > 5:
                     recent_mean_rewards.pop(0)
                 if mean_rewards >= 350:
                     logger.info(f"Congratulations! You've achieved a perfect score of {mean_rewards} with std dev {std_rewards}. Ending optimization early.")
                     rewards.append(sum(traj['rewards']))
-                    optimization_data.append({
+                    metrics.append({
                         "Optimization Step": i,
                         "Mean Reward": mean_rewards,
                         "Std Dev Reward": std_rewards,
                         "Wall Clock Time (s)": time.time() - step_start_time,
                         "Training Steps": steps_used,
                         "Max Training Steps": horizon,
+                        "Eval Episodes": eval_episodes,
+                        "Paired Difference": paired.mean_difference if paired is not None else np.nan,
+                        "Paired Difference Var": paired.variance if paired is not None else np.nan,
+                        **perf_columns(timer, llm, steps_used),
                     })
-                    df = pd.DataFrame(optimization_data)
-                    df.to_csv(perf_csv_filename, index=False)
                     policy.save(os.path.join(trace_ckpt_dir, f"{i}.pkl"))
                     break
                 if mean_rewards >= 300:
@@ -452,25 +755,36 @@ def optimize_policy(
                 elif mean_rewards <= 0:
                     feedback += (f"\nYour score is {mean_rewards} points on average of {num_episodes} games with std dev {std_rewards}. "
                                  f"Try to improve paddle positioning to return the ball and avoid losing lives.")
+                if paired is not None and paired.differences:
+                    feedback += (f"\nOn the same {eval_episodes} games as the best policy so far, you score "
+                                 f"{abs(paired.mean_difference)} points {'more' if paired.mean_difference >= 0 else 'fewer'} "
+                                 f"per game on average than it.")
                 target = traj['observations'][-1]
                 
                 rewards.append(sum(traj['rewards']))
                 
                 # only save ckpt of policies without syntax/running error
                 policy.save(os.path.join(trace_ckpt_dir, f"{i}.pkl"))
-                # Update the best checkpoint if the current mean reward is higher
-                if mean_rewards > best_mean_reward:
-                    best_mean_reward = mean_rewards
+                # Update the best checkpoint if the current mean reward is higher (or, in a paired evaluation,
+                # if the candidate beat the best checkpoint on the same games)
+                improved = paired.mean_difference > 0 if paired is not None else mean_rewards > best_mean_reward
+                if improved:
+                    # best_mean_reward stays a full-evaluation mean: a paired win only covers the (possibly
+                    # early-stopped) paired games, and the incumbent's full-evaluation mean it beat is kept.
+                    if paired is None:
+                        best_mean_reward = mean_rewards
                     best_ckpt = os.path.join(trace_ckpt_dir, f"{i}.pkl")
                     best_iter = i
                     logger.info(f"New best checkpoint saved at {best_ckpt}")
             else:
+                if pending_eval is not None:
+                    cancel_episodes(pending_eval)
                 feedback = error.exception_node.create_feedback()
                 target = error.exception_node
                 
 
                 
-            logger.info(f"Iteration: {i}, Feedback: {feedback}, target: {target}")
+            events.emit("feedback", iteration=i, feedback=feedback, target=str(target))
             
 
             instruction = "In Breakout, you move the bottom paddle left and right to deflect the ball to a top block wall. "
@@ -484,28 +798,56 @@ def optimize_policy(
             instruction += "Analyze the trace to figure out the reason why you lose the game and optimize the code to score higher points by prioritizing hitting higher-value bricks when possible while maintaining ball control."
             optimizer.objective = optimizer.default_objective + instruction 
             
-            optimizer.zero_feedback()
-            optimizer.backward(target, feedback, visualize=True)
-            logger.info(optimizer.problem_instance(optimizer.summarize()))
+            with timer.phase("backward"):
+                optimizer.zero_feedback()
+                optimizer.backward(target, feedback, visualize=True)
+            events.emit("prompt", iteration=i, problem_instance=str(optimizer.problem_instance(optimizer.summarize())))
             
             stdout_buffer = io.StringIO()
-            with contextlib.redirect_stdout(stdout_buffer):
-                optimizer.step(verbose=verbose)
+            with contextlib.redirect_stdout(stdout_buffer), timer.phase("llm_step"):
+                if population_size > 1:
+                    # Request several updates from the same feedback at once, evaluate them in the worker
+                    # pool and keep the best.
+                    candidates = propose_candidates(optimizer, population_size)
+                    with timer.phase("evaluation"):
+                        best, scores = select_candidate(
+                            optimizer,
+                            [update_dict for update_dict, _ in candidates],
+                            submit=lambda: submit_test_episodes(policy,
+                                                                num_episodes=population_eval_episodes,
+                                                                frameskip=frame_skip,
+                                                                repeat_action_probability=sticky_action_p,
+                                                                num_workers=num_eval_workers,
+                                                                base_seed=0),  # Candidates are compared on the same episodes
+                            collect=lambda futures: np.mean(collect_episodes(futures)))
+                    if verbose:
+                        print(f"LLM response:\n {candidates[best][1]}")
+                    logger.info(f"Candidate scores: {scores}, keeping candidate {best}")
+                    for k, ((_, candidate_response), score) in enumerate(zip(candidates, scores)):
+                        events.emit("candidate", iteration=i, index=k, score=score, selected=k == best,
+                                    response=candidate_response)
+                    response = candidates[best][1]
+                else:
+                    optimizer.step(verbose=verbose)
+                    # optimizer.log holds the raw reply of the step.
+                    response = optimizer.log[-1]["response"] if optimizer.log else None
                 llm_output = stdout_buffer.getvalue()
-                if llm_output:
-                    logger.info(f"LLM response:\n {llm_output}")
+                # The printed (verbose) output comes along with the reply when there is any.
+                events.emit("response", iteration=i, response=response, output=llm_output)
             
             logger.info(f"Iteration: {i}, Feedback: {feedback}")
-            optimization_data.append({
+            metrics.append({
                     "Optimization Step": i,
                     "Mean Reward": mean_rewards,
                     "Std Dev Reward": std_rewards,
                     "Wall Clock Time (s)": time.time() - step_start_time,
                     "Training Steps": steps_used,
                     "Max Training Steps": horizon,
+                    "Eval Episodes": eval_episodes,
+                    "Paired Difference": paired.mean_difference if paired is not None else np.nan,
+                    "Paired Difference Var": paired.variance if paired is not None else np.nan,
+                    **perf_columns(timer, llm, steps_used),
                 })
-            df = pd.DataFrame(optimization_data)
-            df.to_csv(perf_csv_filename, index=False)
 
             if error:
                 # Load the latest policy checkpoint from the trace_ckpt_dir
@@ -519,13 +861,24 @@ def optimize_policy(
                 logger.info("Performance has dropped significantly in the recent 5 iterations. Loading the best checkpoint so far.")
                 policy.load(best_ckpt)
     finally:
+        events.close()
+        if profiler is not None:
+            profiler.close()
         if env is not None:
             env.close()
+        for eval_env in eval_envs:
+            eval_env.close()
     
     logger.info(f"Final Average Reward: {sum(rewards) / len(rewards)}")
     return rewards
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an AI agent to play Breakout")
+    parser.add_argument("--profile", nargs="?", const="all", choices=["cpu", "memory", "all"], default=None,
+                        help="Write per-iteration cProfile stats (cpu) and/or allocation reports (memory) of every phase "
+                             "to trace_ckpt/<run>/profile; --profile alone enables both")
+    args = parser.parse_args()
+
     frame_skip = 4
     sticky_action_p = 0.0
     env_name = "BreakoutNoFrameskip-v4"
@@ -564,6 +917,7 @@ if __name__ == "__main__":
         policy_ckpt=policy_ckpt,
         initial_policy=initial_policy,
         initial_policy_steps=initial_policy_steps,
+        profile=args.profile,
 
     )
     logger.info("Training completed.")
@@ -0,0 +1,67 @@
+import math
+from statistics import NormalDist
+
+
+def t_quantile(p, df):
+    """
+    Approximate quantile of Student's t distribution with df degrees of freedom.
+
+    Uses the Cornish-Fisher expansion around the normal quantile, which is within a few percent of the
+    exact value for df >= 2 and avoids depending on scipy.
+    """
+    z = NormalDist().inv_cdf(p)
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def confidence_interval(rewards, confidence=0.95):
+    """Two-sided t confidence interval on the mean of rewards; unbounded with fewer than two rewards."""
+    n = len(rewards)
+    if n < 2:
+        return -math.inf, math.inf
+    mean = sum(rewards) / n
+    std = math.sqrt(sum((r - mean) ** 2 for r in rewards) / (n - 1))
+    half_width = t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+    return mean - half_width, mean + half_width
+
+
+class EarlyStopping:
+    """
+    Stop an evaluation once the confidence interval on the mean reward excludes a threshold.
+
+    Pass it as early_stop to test_policy, which calls it with the rewards collected so far after every
+    finished episode. A candidate is settled as soon as it is confidently below (or above) the threshold,
+    typically the incumbent's mean reward, instead of playing the full evaluation budget.
+
+    Args:
+        threshold (float): Score to separate from, e.g. the best mean reward so far. None never stops early.
+        confidence (float): Confidence level of the interval.
+        min_episodes (int): Episodes to play before stopping is considered.
+
+    Attributes:
+        episodes_used (int): Number of episodes seen by the last evaluation.
+        decision (str): "below" or "above" if the evaluation stopped early, else None.
+        interval (tuple): Last confidence interval (low, high).
+    """
+
+    def __init__(self, threshold, confidence=0.95, min_episodes=3):
+        self.threshold = threshold
+        self.confidence = confidence
+        self.min_episodes = max(2, min_episodes)
+        self.episodes_used = 0
+        self.decision = None
+        self.interval = (-math.inf, math.inf)
+
+    def __call__(self, rewards):
+        self.episodes_used = len(rewards)
+        self.decision = None
+        if self.threshold is None or len(rewards) < self.min_episodes:
+            return False
+        self.interval = confidence_interval(rewards, self.confidence)
+        if self.interval[1] < self.threshold:
+            self.decision = "below"
+        elif self.interval[0] > self.threshold:
+            self.decision = "above"
+        return self.decision is not None
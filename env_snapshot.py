@@ -0,0 +1,36 @@
+import copy
+from collections import namedtuple
+
+# OCAtari frame buffers that feed its "dqn"/"obj"/rgb observation stacks.
+_BUFFERS = ("_state_buffer_rgb", "_state_buffer_ns", "_state_buffer_dqn")
+
+EnvSnapshot = namedtuple("EnvSnapshot", ["ale_state", "objects", "buffers", "obs", "info", "extras"])
+
+
+def capture_snapshot(env, obs=None, info=None, **extras):
+    """
+    Capture the state of an OCAtari env so that it can be restored in constant time.
+
+    The emulator state comes from the ALE's cloneState(); the random number generator is not included,
+    so episodes branched from the same snapshot still differ under sticky actions after env.reset(seed=...).
+
+    Args:
+        env (OCAtari): The env to capture.
+        obs: Observation of the traced env at this state, returned again after restoring.
+        info (dict): Step info at this state.
+        **extras: Other traced env fields to restore, e.g. current_lives.
+    Returns:
+        EnvSnapshot: The captured state.
+    """
+    buffers = {name: copy.copy(getattr(env, name)) for name in _BUFFERS if hasattr(env, name)}
+    return EnvSnapshot(env._env.unwrapped.ale.cloneState(), copy.deepcopy(env.objects), buffers,
+                       obs, dict(info or {}), extras)
+
+
+def restore_snapshot(env, snapshot):
+    """Restore an OCAtari env (possibly a rebuilt one for the same game) to a captured snapshot."""
+    env._env.unwrapped.ale.restoreState(snapshot.ale_state)
+    # OCAtari updates its objects in place when stepping, so the snapshot keeps its own copy.
+    env.objects = copy.deepcopy(snapshot.objects)
+    for name, buffer in snapshot.buffers.items():
+        setattr(env, name, copy.copy(buffer))
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from parallel_eval import policy_spec
+
+
+def evaluation_key(policy, **settings):
+    """
+    Hash the trainable parameter source of a policy together with the evaluation settings.
+
+    Args:
+        policy: A trace Policy module.
+        **settings: Everything else the rewards depend on, e.g. env name, frameskip, sticky action
+            probability, seed, number of episodes and steps per episode.
+    Returns:
+        str: Hex digest identifying the evaluation.
+    """
+    spec = policy_spec(policy)
+    key = {"policy": spec, "settings": settings}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class EvalCache:
+    """
+    On-disk cache of evaluation results, one JSON file per evaluation_key.
+
+    The optimizer often proposes parameter code it already tried, and evaluating the same code with
+    the same settings again only reproduces the rewards on file.
+
+    Args:
+        cache_dir (str): Directory holding the cached results; created on first write.
+    """
+
+    def __init__(self, cache_dir="eval_cache"):
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """Return the cached per-episode rewards for key, or None if it was never evaluated."""
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)["rewards"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def put(self, key, rewards, **settings):
+        """Store the per-episode rewards of key; settings are saved alongside for inspection only."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        record = {"rewards": [float(r) for r in rewards], "settings": settings}
+        # Write to a temporary file first so that concurrent readers never see a partial result.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f, default=repr)
+        os.replace(tmp_path, self._path(key))
@@ -1,20 +1,66 @@
 import gymnasium as gym
 import ale_py
 import numpy as np
+import pandas as pd
 import argparse
 import os
+import traceback
+from concurrent.futures import as_completed
+from pathlib import Path
 
 from dotenv import load_dotenv
 from pong_ocatari_LLM_agent import PongOCAtariTracedEnv as PongEnv, Policy as PongPolicy
 from breakout_ocatari_LLM_agent import TracedEnv as BreakoutEnv, Policy as BreakoutPolicy
-from space_invaders_ocatari_LLM_agent import TracedEnv as SpaceInvadersEnv, Policy as SpaceInvadersPolicy
+from space_invaders_ocatari_LLM_agent import SpaceInvadersOCAtariTracedEnv as SpaceInvadersEnv, Policy as SpaceInvadersPolicy
 from best_policies.Pong import Policy as PongBestPolicy
 from best_policies.Breakout import Policy as BreakoutBestPolicy
 from best_policies.SpaceInvaders import Policy as SpaceInvadersBestPolicy
+from inference import inference_mode
+from eval_cache import EvalCache, evaluation_key
+from parallel_eval import get_pool
+from vector_eval import seed_episode
 load_dotenv()
 gym.register_envs(ale_py)
 
-def test_policy(env, policy, steps_per_episode=4000):
+POLICIES = {
+    "Pong": PongPolicy,
+    "Breakout": BreakoutPolicy,
+    "SpaceInvaders": SpaceInvadersPolicy,
+}
+
+# Per-worker envs reused across the checkpoints and seeds of a sweep, keyed by (game, frameskip, sticky action p).
+_worker_envs = {}
+
+def make_env(game, render_mode=None, frameskip=4, repeat_action_probability=0.00):
+    obs_mode = "obj"
+    hud = False
+    if game == "Pong":
+        return PongEnv(render_mode=render_mode,
+                       env_name="PongNoFrameskip-v4",
+                       obs_mode=obs_mode,
+                       hud=hud,
+                       frameskip=frameskip,
+                       repeat_action_probability=repeat_action_probability)
+    elif game == "Breakout":
+        return BreakoutEnv(env_name="BreakoutNoFrameskip-v4",
+                           render_mode=render_mode,
+                           obs_mode=obs_mode,
+                           hud=hud,
+                           frameskip=frameskip,
+                           repeat_action_probability=repeat_action_probability,
+                           initial_policy=None,
+                           initial_policy_steps=None)
+    elif game == "SpaceInvaders":
+        return SpaceInvadersEnv(env_name="SpaceInvadersNoFrameskip-v4",
+                                render_mode=render_mode,
+                                frameskip=frameskip,
+                                repeat_action_probability=repeat_action_probability)
+    else:
+        raise ValueError(f"Invalid game name {game}")
+
+@inference_mode()
+def play_episode(env, policy, steps_per_episode=4000):
+    """Play one episode and return (episode_reward, steps)."""
     obs, info = env.reset()
     episode_reward = 0
     steps = 0
@@ -26,23 +72,136 @@ def test_policy(env, policy, steps_per_episode=4000):
         steps += 1
         if terminated or truncated:
             break
- 
+    return episode_reward, steps
+
+def test_policy(env, policy, steps_per_episode=4000):
+    episode_reward, steps = play_episode(env, policy, steps_per_episode)
     # print(f"\nResults over {num_episodes} episodes:")
     print(f"Episode reward: {episode_reward} over {steps} steps")
     return episode_reward
 
+def list_checkpoints(ckpt_dir, ckpt_range=None):
+    """
+    Find the N.pkl checkpoints of a trace_ckpt/<run>/ directory.
+
+    Args:
+        ckpt_dir (str): Directory written by optimize_policy.
+        ckpt_range (tuple): Optional (first, last) iteration, both included.
+    Returns:
+        list: (iteration, path) pairs sorted by iteration.
+    """
+    checkpoints = []
+    for path in Path(ckpt_dir).glob("*.pkl"):
+        if not path.stem.isdigit():
+            continue
+        iteration = int(path.stem)
+        if ckpt_range is None or ckpt_range[0] <= iteration <= ckpt_range[1]:
+            checkpoints.append((iteration, str(path)))
+    return sorted(checkpoints)
+
+def _evaluate_checkpoint(game, ckpt_path, seed, steps_per_episode, frameskip, repeat_action_probability):
+    """Worker entry point: play one seeded episode of a checkpoint and return (path, seed, reward, steps, error)."""
+    key = (game, frameskip, repeat_action_probability)
+    try:
+        if key not in _worker_envs:
+            _worker_envs[key] = make_env(game, frameskip=frameskip, repeat_action_probability=repeat_action_probability)
+        env = _worker_envs[key]
+        policy = POLICIES[game]()
+        policy.load(ckpt_path)
+        # Every checkpoint plays the same seeds, so they are ranked on the same games.
+        seed_episode(env, seed)
+        episode_reward, steps = play_episode(env, policy, steps_per_episode)
+    except Exception:
+        # Do not reuse an env left in an unknown state.
+        env = _worker_envs.pop(key, None)
+        if env is not None:
+            env.close()
+        return ckpt_path, seed, np.nan, np.nan, traceback.format_exc()
+    return ckpt_path, seed, float(episode_reward), steps, None
+
+def sweep_checkpoints(game, ckpt_dir, ckpt_range=None, num_seeds=3, base_seed=0, num_workers=None,
+                      steps_per_episode=4000, frameskip=4, repeat_action_probability=0.00):
+    """
+    Evaluate every checkpoint of a run on num_seeds seeded episodes spread over a process pool.
+
+    Returns:
+        pd.DataFrame: Leaderboard with one row per checkpoint, best mean reward first.
+    """
+    checkpoints = list_checkpoints(ckpt_dir, ckpt_range)
+    if not checkpoints:
+        raise FileNotFoundError(f"No checkpoints found in {ckpt_dir}")
+    pool = get_pool(num_workers or os.cpu_count())
+    futures = [pool.submit(_evaluate_checkpoint, game, path, base_seed + k, steps_per_episode,
+                           frameskip, repeat_action_probability)
+               for _, path in checkpoints for k in range(num_seeds)]
+    results = {path: [] for _, path in checkpoints}
+    for done, future in enumerate(as_completed(futures), 1):
+        path, seed, episode_reward, steps, error = future.result()
+        results[path].append((episode_reward, steps))
+        if error:
+            print(f"{path} failed on seed {seed}:\n{error}")
+        print(f"[{done}/{len(futures)}] {path} seed {seed}: reward {episode_reward} over {steps} steps")
+
+    rows = []
+    for iteration, path in checkpoints:
+        episode_rewards = np.array([r for r, _ in results[path]], dtype=np.float64)
+        steps = np.array([s for _, s in results[path]], dtype=np.float64)
+        played = ~np.isnan(episode_rewards)
+        rows.append({
+            "Checkpoint": iteration,
+            "Path": path,
+            "Mean Reward": episode_rewards[played].mean() if played.any() else np.nan,
+            "Std Dev Reward": episode_rewards[played].std() if played.any() else np.nan,
+            "Mean Steps": steps[played].mean() if played.any() else np.nan,
+            "Episodes": int(played.sum()),
+            "Errors": int((~played).sum()),
+        })
+    leaderboard = pd.DataFrame(rows).sort_values(["Mean Reward", "Checkpoint"], ascending=[False, True],
+                                                 na_position="last", ignore_index=True)
+    leaderboard.insert(0, "Rank", range(1, len(leaderboard) + 1))
+    return leaderboard
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Evaluate Policy Given Checkpoints')
     parser.add_argument('--game', type=str, choices=['Pong', 'Breakout', 'SpaceInvaders'], 
                     default='Pong', help='Atari game to evaluate, ["Pong", "Breakout", "SpaceInvaders"]')
     parser.add_argument('--policy_ckpt_dir', type=str, required=True,
                         help='Directory pointing to policy checkpoints')
-    parser.add_argument('--ckpt_iter', type=int, required=True,
-                        help='Checkpoint iteration number to load')
+    parser.add_argument('--ckpt_iter', type=int, default=None,
+                        help='Checkpoint iteration number to load (required unless --sweep)')
     parser.add_argument('--render', action='store_true', help='Enable rendering')
+    parser.add_argument('--seed', type=int, default=None, help='Seed the emulator before the episode')
+    parser.add_argument('--eval_cache_dir', type=str, default=None,
+                        help='Directory of cached evaluations; a checkpoint whose policy code was already '
+                             'evaluated with the same settings and --seed is not played again. Unseeded '
+                             'episodes are never cached')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Evaluate every N.pkl in --policy_ckpt_dir and write a ranked leaderboard')
+    parser.add_argument('--ckpt_range', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='Only sweep checkpoints FIRST..LAST (inclusive)')
+    parser.add_argument('--num_seeds', type=int, default=3, help='Seeded episodes per checkpoint in a sweep')
+    parser.add_argument('--base_seed', type=int, default=0, help='Seed of the first episode of every checkpoint in a sweep')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='Worker processes for a sweep (default: number of CPU cores)')
+    parser.add_argument('--leaderboard', type=str, default=None,
+                        help='Leaderboard CSV of a sweep (default: <policy_ckpt_dir>/leaderboard.csv)')
 
     args = parser.parse_args()
+    if not args.sweep and args.ckpt_iter is None:
+        parser.error("--ckpt_iter is required unless --sweep is given")
 
+    if args.sweep:
+        leaderboard = sweep_checkpoints(args.game,
+                                        args.policy_ckpt_dir,
+                                        ckpt_range=args.ckpt_range,
+                                        num_seeds=args.num_seeds,
+                                        base_seed=args.base_seed,
+                                        num_workers=args.num_workers)
+        leaderboard_csv = args.leaderboard or os.path.join(args.policy_ckpt_dir, "leaderboard.csv")
+        leaderboard.to_csv(leaderboard_csv, index=False)
+        print(leaderboard.drop(columns="Path").to_string(index=False))
+        print(f"Leaderboard written to {leaderboard_csv}")
+        raise SystemExit(0)
 
 
     policy_ckpt = os.path.join(args.policy_ckpt_dir, f"{args.ckpt_iter}.pkl")
@@ -52,44 +211,35 @@ if __name__ == "__main__":
     if args.render:
         render_mode = "human"
 
-    obs_mode = "obj"
-    hud = False
     frameskip = 4
     repeat_action_probability = 0.00
-    if args.game == "Pong":
-        env = PongEnv(render_mode=render_mode,
-                                env_name="PongNoFrameskip-v4",
-                                obs_mode=obs_mode,
-                                hud=hud,
-                                frameskip=frameskip,
-                                repeat_action_probability=repeat_action_probability)
-        policy = PongPolicy()
-        policy.load(policy_ckpt)
-    elif args.game == "Breakout":
-        env = BreakoutEnv(env_name="BreakoutNoFrameskip-v4",
-                          render_mode=render_mode,
-                          obs_mode=obs_mode,
-                          hud=hud,
-                          frameskip=frameskip,
-                          repeat_action_probability=repeat_action_probability,
-                          initial_policy=None,
-                          initial_policy_steps=None)
-        policy = BreakoutPolicy()
-        policy.load(policy_ckpt)
-    elif args.game == "SpaceInvaders":
-        env = SpaceInvadersEnv(env_name="SpaceInvadersNoFrameskip-v4",
-                               render_mode=render_mode,
-                               frameskip=frameskip,
-                               repeat_action_probability=repeat_action_probability)
-        policy = SpaceInvadersPolicy()
-        policy.load(policy_ckpt)
-        
-    else:
-        raise ValueError(f"Invalid game name {args.game}")
+    env = make_env(args.game, render_mode=render_mode, frameskip=frameskip,
+                   repeat_action_probability=repeat_action_probability)
+    policy = POLICIES[args.game]()
+    policy.load(policy_ckpt)
     
     for p in policy.parameters():
         print(p.name, p.data)
+    steps_per_episode = 4000
+    # Rendering is for watching the policy play, so it always plays the episode. An unseeded episode is one
+    # random draw, so it is neither looked up nor stored.
+    use_cache = args.eval_cache_dir and args.seed is not None and not args.render
+    cache = EvalCache(args.eval_cache_dir) if use_cache else None
+    cache_key = evaluation_key(policy,
+                               env=env.env_name,
+                               frameskip=frameskip,
+                               repeat_action_probability=repeat_action_probability,
+                               steps_per_episode=steps_per_episode,
+                               seed=args.seed)
+    cached_rewards = cache.get(cache_key) if cache is not None else None
     try:
-        test_policy(env, policy)
+        if cached_rewards is not None:
+            print(f"Episode reward: {cached_rewards[0]} (cached)")
+        else:
+            if args.seed is not None:
+                seed_episode(env, args.seed)
+            episode_reward = test_policy(env, policy, steps_per_episode=steps_per_episode)
+            if cache is not None:
+                cache.put(cache_key, [episode_reward])
     finally:
         env.close()
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Event types written by the agents.
+EVENT_TYPES = ("iteration", "feedback", "prompt", "candidate", "response", "eval")
+
+
+def _jsonable(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+
+class EventLog:
+    """
+    Size-bounded structured log of an optimization run: one typed JSON event per line.
+
+    String fields longer than blob_threshold (prompts, LLM responses, tracebacks) are not written
+    inline: they are stored once as a gzip-compressed blob named after their sha256 in blob_dir and
+    the event holds {"blob": <sha256>, "bytes": <length>} instead. Identical payloads (e.g. the same
+    prompt in consecutive steps) share one blob.
+
+    When the log file would exceed max_bytes it is rotated: it is compressed to <name>.1.gz, older
+    rotations move up by one and those beyond backup_count are deleted. At each rotation the oldest
+    blobs are deleted until the blobs take at most max_blob_bytes. Disk use therefore stays below
+    roughly max_bytes * (1 + backup_count) + max_blob_bytes however long the run is.
+
+    Args:
+        path (str): Event log file, e.g. logs/events_<run>.jsonl.
+        blob_dir (str): Directory of the payload blobs; defaults to <path's directory>/blobs.
+        max_bytes (int): Size at which the log file is rotated.
+        backup_count (int): Number of rotated (compressed) files to keep.
+        blob_threshold (int): Length above which a string field is moved to a blob.
+        max_blob_bytes (int): Total size of the blobs to keep.
+    """
+
+    def __init__(self, path, blob_dir=None, max_bytes=8 * 1024 * 1024, backup_count=5, blob_threshold=1024,
+                 max_blob_bytes=256 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.blob_dir = Path(blob_dir) if blob_dir is not None else self.path.parent / "blobs"
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.blob_threshold = blob_threshold
+        self.max_blob_bytes = max_blob_bytes
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a")
+        self._size = self._file.tell()
+
+    def _store_blob(self, text):
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.blob_dir / f"{digest}.gz"
+        if blob_path.exists():
+            os.utime(blob_path)  # Keep blobs still referenced by recent events
+        else:
+            self.blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_suffix(".tmp")
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+        return {"blob": digest, "bytes": len(data)}
+
+    def _rotate(self):
+        self._file.close()
+        for k in range(self.backup_count, 0, -1):
+            rotated = Path(f"{self.path}.{k}.gz")
+            if not rotated.exists():
+                continue
+            if k == self.backup_count:
+                rotated.unlink()
+            else:
+                os.replace(rotated, f"{self.path}.{k + 1}.gz")
+        if self.backup_count > 0:
+            with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        self._file = open(self.path, "w")
+        self._size = 0
+        self._prune_blobs()
+
+    def _prune_blobs(self):
+        if not self.blob_dir.is_dir():
+            return
+        blobs = sorted(self.blob_dir.glob("*.gz"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in blobs)
+        for path in blobs:
+            if total <= self.max_blob_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+
+    def emit(self, event_type, **fields):
+        """Write an event of event_type (see EVENT_TYPES) with the given JSON-serializable fields."""
+        with self._lock:
+            for key, value in fields.items():
+                if isinstance(value, str) and len(value) > self.blob_threshold:
+                    fields[key] = self._store_blob(value)
+            line = json.dumps({"time": time.time(), "type": event_type, **fields}, default=_jsonable) + "\n"
+            if self._size > 0 and self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_blob(blob_dir, ref):
+    """Return the payload of a {"blob": ..., "bytes": ...} field, or None if the blob was pruned."""
+    try:
+        with gzip.open(Path(blob_dir) / f"{ref['blob']}.gz", "rb") as f:
+            return f.read().decode()
+    except FileNotFoundError:
+        return None
+
+
+def read_events(path, include_rotated=False):
+    """
+    Yield the events of an event log in order, oldest first.
+
+    Args:
+        path (str): Event log file.
+        include_rotated (bool): Also read the compressed rotations (<path>.N.gz), oldest first.
+    """
+    paths = []
+    if include_rotated:
+        rotated = sorted(Path(path).parent.glob(f"{Path(path).name}.*.gz"),
+                         key=lambda p: int(p.name[len(Path(path).name) + 1:-3]), reverse=True)
+        paths.extend(rotated)
+    paths.append(Path(path))
+    for file_path in paths:
+        opener = gzip.open if file_path.suffix == ".gz" else open
+        with opener(file_path, "rt") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:  # Last line still being written
+                    break
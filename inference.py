@@ -0,0 +1,47 @@
+import contextlib
+import contextvars
+import functools
+import weakref
+
+_inference_mode = contextvars.ContextVar("inference_mode", default=False)
+
+# module -> {method name: (parameter code, plain function)}
+_compiled = weakref.WeakKeyDictionary()
+
+
+@contextlib.contextmanager
+def inference_mode(enabled=True):
+    """
+    Run Policy modules and traced envs without building a Trace graph.
+
+    Inside this context, methods looked up with policy_method() execute the current parameter code as
+    plain Python functions, and traced envs return plain observations instead of MessageNodes. Use it
+    wherever no feedback is propagated, e.g. evaluation. Can also be used as a decorator.
+    """
+    token = _inference_mode.set(enabled)
+    try:
+        yield
+    finally:
+        _inference_mode.reset(token)
+
+
+def is_inference_mode():
+    return _inference_mode.get()
+
+
+def policy_method(module, name):
+    """
+    Look up a @bundle method of a trace Module.
+
+    Outside inference mode this is the traced bundle itself. In inference mode it is the plain function
+    compiled from the bundle's current parameter code, bound to module. Compiled functions are cached
+    until the parameter code changes (e.g. after an optimizer step or policy.load).
+    """
+    fun_module = getattr(module, name)
+    if not is_inference_mode():
+        return fun_module
+    code = fun_module.parameter.data if fun_module.parameter is not None else None
+    cache = _compiled.setdefault(module, {})
+    if name not in cache or cache[name][0] != code:
+        cache[name] = (code, fun_module.fun)
+    return functools.partial(cache[name][1], module)
@@ -0,0 +1,245 @@
+import contextlib
+import cProfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from summary_compression import estimate_tokens
+
+# Phases of an optimization step and their perf CSV columns.
+PHASE_COLUMNS = {
+    "env_init": "Env Init Time (s)",
+    "rollout": "Rollout Time (s)",
+    "evaluation": "Evaluation Time (s)",
+    "backward": "Backward Time (s)",
+    "summarize": "Summarize Time (s)",
+    "llm_step": "LLM Step Time (s)",
+}
+
+
+class PhaseTimer:
+    """
+    Accumulate wall clock time per phase of an optimization step.
+
+    Phases nest exclusively: while an inner phase runs (e.g. summarize inside llm_step) its time is
+    charged to the inner phase only, so the phase columns add up to the time spent in all of them.
+    Phases must be entered from the thread that owns the timer. With a profiler (see PhaseProfiler)
+    every phase is also profiled, with the same exclusive nesting.
+    """
+
+    def __init__(self, profiler=None):
+        self.totals = dict.fromkeys(PHASE_COLUMNS, 0.0)
+        self.profiler = profiler
+        self._stack = []
+
+    def reset(self):
+        self.totals = dict.fromkeys(PHASE_COLUMNS, 0.0)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            outer, started = self._stack[-1]
+            self.totals[outer] += now - started
+            if self.profiler is not None:
+                self.profiler.pause(outer)
+        self._stack.append([name, now])
+        if self.profiler is not None:
+            self.profiler.resume(name)
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.pause(name)
+            now = time.perf_counter()
+            name, started = self._stack.pop()
+            self.totals[name] = self.totals.get(name, 0.0) + now - started
+            if self._stack:
+                self._stack[-1][1] = now
+                if self.profiler is not None:
+                    self.profiler.resume(self._stack[-1][0])
+
+    def wrap(self, obj, method, name):
+        """Time every call of obj.method as phase name (e.g. an optimizer's summarize)."""
+        original = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return original(*args, **kwargs)
+
+        setattr(obj, method, timed)
+        return obj
+
+    def columns(self):
+        return {PHASE_COLUMNS.get(name, f"{name} Time (s)"): total for name, total in self.totals.items()}
+
+
+class PhaseProfiler:
+    """
+    Profile the phases of a PhaseTimer per optimization step: cProfile for CPU time and tracemalloc
+    for allocations.
+
+    For every step i (see start_iteration) the profiler writes to out_dir:
+      - iter_<i>_<phase>.pstats: the cProfile stats of each phase that ran, for pstats or snakeviz;
+      - iter_<i>_memory.txt: the memory each phase allocated and kept and its peak, followed by the
+        source lines whose allocations grew the most during the step.
+
+    Like the timer, phases nest exclusively: summarize is profiled on its own, not as part of
+    llm_step. Only the calling thread is profiled; episodes played in worker processes or threads
+    show up as waiting. tracemalloc slows allocation-heavy code noticeably, so mode="cpu" keeps CPU
+    profiles comparable with unprofiled runs.
+
+    Args:
+        out_dir (str): Directory of the reports, e.g. <run dir>/profile.
+        mode (str): "cpu", "memory" or "all".
+        top (int): Number of source lines in the allocation report.
+    """
+
+    def __init__(self, out_dir, mode="all", top=25):
+        if mode not in ("cpu", "memory", "all"):
+            raise ValueError(f"Invalid profile mode {mode}")
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.cpu = mode in ("cpu", "all")
+        self.memory = mode in ("memory", "all")
+        self.top = top
+        self.iteration = None
+        self._profiles = {}
+        self._memory = {}
+        self._resumed = {}
+        self._snapshot = None
+        self._started_tracemalloc = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def resume(self, name):
+        if self.iteration is None:
+            return
+        if self.cpu:
+            self._profiles.setdefault(name, cProfile.Profile()).enable()
+        if self.memory:
+            tracemalloc.reset_peak()
+            self._resumed[name] = tracemalloc.get_traced_memory()[0]
+
+    def pause(self, name):
+        if self.iteration is None:
+            return
+        if self.cpu and name in self._profiles:
+            self._profiles[name].disable()
+        if self.memory and name in self._resumed:
+            current, peak = tracemalloc.get_traced_memory()
+            kept, highest = self._memory.get(name, (0, 0))
+            started = self._resumed.pop(name)
+            self._memory[name] = (kept + current - started, max(highest, peak - started))
+
+    def start_iteration(self, iteration):
+        """Write the reports of the previous step, if any, and start profiling step iteration."""
+        self._write_reports()
+        self.iteration = iteration
+        if self.memory:
+            self._snapshot = self._take_snapshot()
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def _write_reports(self):
+        if self.iteration is None:
+            return
+        prefix = self.out_dir / f"iter_{self.iteration:04d}"
+        if self.memory:
+            differences = self._take_snapshot().compare_to(self._snapshot, "lineno")
+            current, peak = tracemalloc.get_traced_memory()
+            with open(f"{prefix}_memory.txt", "w") as f:
+                f.write(f"Iteration {self.iteration}: {current / 2**20:.1f} MiB traced\n\n")
+                f.write(f"{'Phase':<12} {'Kept (KiB)':>12} {'Peak (KiB)':>12}\n")
+                for name, (kept, highest) in self._memory.items():
+                    f.write(f"{name:<12} {kept / 1024:>12.1f} {highest / 1024:>12.1f}\n")
+                f.write(f"\nTop {self.top} allocation sites by growth during the iteration:\n")
+                for difference in differences[:self.top]:
+                    f.write(f"{difference}\n")
+        # After the memory report, so that dumping the stats is not counted as an allocation of the step.
+        for name, profile in self._profiles.items():
+            profile.dump_stats(f"{prefix}_{name}.pstats")
+        self.iteration = None
+        self._profiles = {}
+        self._memory = {}
+        self._resumed = {}
+        self._snapshot = None
+
+    def close(self):
+        """Write the reports of the last step and stop tracemalloc if this profiler started it."""
+        self._write_reports()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+def _usage_value(usage, field):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(field)
+    return getattr(usage, field, None)
+
+
+class TokenCountingLLM:
+    """
+    Wrap a Trace LLM backend and count the prompt and response tokens of every call.
+
+    Counts come from the response's usage when the backend reports it (cached responses carry the
+    usage of the original call) and are estimated from the text otherwise.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.model_name = getattr(llm, "model_name", None)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+
+    def __call__(self, messages, **kwargs):
+        response = self.llm(messages=messages, **kwargs)
+        usage = getattr(response, "usage", None)
+        prompt_tokens = _usage_value(usage, "prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens("".join(str(m.get("content", "")) for m in messages))
+        response_tokens = _usage_value(usage, "completion_tokens")
+        if response_tokens is None:
+            response_tokens = estimate_tokens(response.choices[0].message.content or "")
+        with self._lock:  # Population steps call the backend from several threads
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.response_tokens += response_tokens
+        return response
+
+    def columns(self):
+        return {
+            "LLM Calls": self.calls,
+            "Prompt Tokens": self.prompt_tokens,
+            "Response Tokens": self.response_tokens,
+        }
+
+
+def perf_columns(timer, llm, env_steps):
+    """
+    Perf CSV columns of one optimization step: time per phase, LLM token counts (when llm is a
+    TokenCountingLLM) and the env steps per second of the traced rollout.
+    """
+    columns = timer.columns()
+    if isinstance(llm, TokenCountingLLM):
+        columns.update(llm.columns())
+    rollout_time = timer.totals["rollout"]
+    columns["Rollout Steps/s"] = env_steps / rollout_time if rollout_time > 0 else float("nan")
+    return columns
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+from opto.utils.llm import LLM, CustomLLM
+
+logger = logging.getLogger(__name__)
+
+# Reply of StubLLM when it has nothing cached: OptoPrime parses it as "keep every parameter as it is".
+NO_UPDATE_RESPONSE = json.dumps({"reasoning": "Offline stub backend: no cached response for this prompt.",
+                                 "suggestion": {}})
+
+
+def default_model_name():
+    """
+    Model that opto's default backend uses, read from the same settings as the backend itself: opto.utils.llm.LLM
+    is chosen by TRACE_DEFAULT_LLM_BACKEND, and CustomLLM and LiteLLM take their model from their own variables.
+    """
+    if LLM is CustomLLM:
+        return os.environ.get("TRACE_CUSTOMLLM_MODEL", "gpt-4o")
+    return os.environ.get("TRACE_LITELLM_MODEL") or os.environ.get("DEFAULT_LITELLM_MODEL", "gpt-4o")
+
+
+def model_name(llm):
+    """Name of the model behind a Trace LLM backend, used as part of the cache key."""
+    return getattr(llm, "model_name", None) or default_model_name()
+
+
+def prompt_key(model, messages, **kwargs):
+    """Hash of the model, the full prompt and the request options (temperature, max_tokens, ...)."""
+    request = {"model": model, "messages": messages, "kwargs": kwargs}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def make_response(content, usage=None):
+    """Build an object shaped like a completion (response.choices[0].message.content) around content."""
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class LLMCache:
+    """
+    On-disk store of LLM responses, one JSON file per prompt_key, with size-bounded LRU eviction.
+
+    Reading a response refreshes its file's modification time, so the least recently used responses
+    are the first to be deleted once the files exceed max_bytes.
+
+    Args:
+        cache_dir (str): Directory holding the responses; created on first write.
+        max_bytes (int): Total size of the cached responses to keep.
+    """
+
+    def __init__(self, cache_dir="llm_cache", max_bytes=256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> file size, least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        if self.cache_dir.is_dir():
+            files = sorted(self.cache_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+            for path in files:
+                self._entries[path.stem] = path.stat().st_size
+                self._total_bytes += self._entries[path.stem]
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Return the cached record ({"content": ..., "usage": ...}) of key, or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(self._path(key)) as f:
+                    record = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            os.utime(self._path(key))
+            return record
+
+    def put(self, key, content, usage=None, **metadata):
+        """Store a response; metadata (e.g. the model) is saved alongside for inspection only."""
+        record = {"content": content, "usage": usage, **metadata}
+        with self._lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so that concurrent readers never see a partial response.
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f, default=repr)
+            os.replace(tmp_path, self._path(key))
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = self._path(key).stat().st_size
+            self._total_bytes += self._entries[key]
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self._path(old_key).unlink(missing_ok=True)
+
+
+def _usage_dict(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    return dict(usage) if not isinstance(usage, dict) else usage
+
+
+class CachedLLM:
+    """
+    Wrap a Trace LLM backend (e.g. opto.utils.llm.LLM()) so that repeated prompts are answered from an LLMCache.
+
+    It is called like the backend, llm(messages=..., **kwargs), and can be passed to OptoPrime as llm.
+    """
+
+    def __init__(self, llm, cache):
+        self.llm = llm
+        self.cache = cache
+        self.model_name = model_name(llm)
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, messages, **kwargs):
+        key = prompt_key(self.model_name, messages, **kwargs)
+        record = self.cache.get(key)
+        if record is not None:
+            self.hits += 1
+            return make_response(record["content"], record.get("usage"))
+        self.misses += 1
+        response = self.llm(messages=messages, **kwargs)
+        self.cache.put(key, response.choices[0].message.content, _usage_dict(response), model=self.model_name)
+        return response
+
+
+class StubLLM:
+    """
+    Deterministic offline backend: replays responses cached by CachedLLM and never calls a model.
+
+    Prompts missing from the cache are answered with the canned responses in turn (cycling through
+    them), or with NO_UPDATE_RESPONSE, which leaves the parameters unchanged.
+
+    Args:
+        cache (LLMCache): Responses recorded by an earlier online run; may be None.
+        canned_responses (list): Response strings, e.g. JSON with a "suggestion" of parameter code.
+        model (str): Model name the cached responses were recorded with; defaults to default_model_name(),
+            the model of the backend make_llm builds when online.
+    """
+
+    def __init__(self, cache=None, canned_responses=None, model=None):
+        self.cache = cache
+        self.canned_responses = list(canned_responses or [])
+        self.model_name = model or default_model_name()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, messages, **kwargs):
+        record = None
+        if self.cache is not None:
+            record = self.cache.get(prompt_key(self.model_name, messages, **kwargs))
+        with self._lock:
+            if record is not None:
+                self.hits += 1
+                return make_response(record["content"], record.get("usage"))
+            if self.canned_responses:
+                content = self.canned_responses[self.misses % len(self.canned_responses)]
+            else:
+                content = NO_UPDATE_RESPONSE
+            self.misses += 1
+        if self.cache is not None:
+            logger.warning(f"Offline LLM: no response cached for this prompt with model {self.model_name!r} in "
+                           f"{self.cache.cache_dir}; answering with "
+                           f"{'a canned response' if self.canned_responses else 'no parameter update'}")
+        return make_response(content)
+
+
+def make_llm(cache_dir=None, offline=False, canned_responses=None, max_bytes=256 * 1024 * 1024):
+    """
+    Build the LLM backend for OptoPrime.
+
+    Args:
+        cache_dir (str): LLMCache directory; None (the default) disables caching.
+        offline (bool): Use StubLLM instead of a model. The TRACE_LLM_OFFLINE=1 environment variable
+            also turns it on, so whole runs can be replayed on a machine without network access.
+        canned_responses (list): Passed to StubLLM.
+        max_bytes (int): Size bound of the cache.
+    """
+    cache = LLMCache(cache_dir, max_bytes=max_bytes) if cache_dir else None
+    if offline or os.environ.get("TRACE_LLM_OFFLINE") == "1":
+        # Look the responses up under the model the online backend would have recorded them with.
+        model = default_model_name()
+        logger.info(f"Using the offline stub LLM backend (replaying responses of {model})")
+        if cache is None:
+            logger.warning("Offline LLM without a cache directory: no recorded responses can be replayed")
+        return StubLLM(cache, canned_responses, model=model)
+    llm = LLM()
+    return CachedLLM(llm, cache) if cache is not None else llm
@@ -0,0 +1,100 @@
+import opto.trace as trace
+from opto.trace import bundle
+from opto.trace.bundle import ExceptionNode
+from opto.trace.errors import ExecutionError
+
+from inference import is_inference_mode
+
+
+def is_macro_action(action):
+    """True if a policy returned a sequence of actions (or a Node holding one) instead of a single action."""
+    control = action.data if isinstance(action, trace.Node) else action
+    return isinstance(control, (list, tuple))
+
+
+def action_controls(actions):
+    """Plain actions of a macro action given either as a Node holding a list or as a sequence of actions/Nodes."""
+    if isinstance(actions, trace.Node):
+        return list(actions.data)
+    return [action.data if isinstance(action, trace.Node) else action for action in actions]
+
+
+def _action_nodes(actions):
+    """The Nodes a macro action depends on: the Node itself, or each distinct Node of the sequence."""
+    if isinstance(actions, trace.Node):
+        return [actions]
+    nodes = []
+    for action in actions:
+        if isinstance(action, trace.Node) and not any(action is n for n in nodes):
+            nodes.append(action)
+    return nodes
+
+
+def traced_step_many(actions, obs):
+    """Record an already-executed macro action in the Trace graph."""
+    @bundle()
+    def step_many(*actions):
+        """
+        Take the actions in the environment one after another and return the final observation
+        """
+        return obs
+
+    return step_many(*_action_nodes(actions))
+
+
+def step_many_error(e, actions):
+    """Wrap an exception raised while executing a macro action into a traceable ExecutionError."""
+    e_node = ExceptionNode(
+        e,
+        inputs={f"action{i}": n for i, n in enumerate(_action_nodes(actions))},
+        description="[exception] The operator step_many raises an exception.",
+        name="exception_step_many",
+    )
+    return ExecutionError(e_node)
+
+
+def step_many(env, actions, checkpoint_every=None):
+    """
+    Take a macro action on a traced env: a sequence of actions executed in one call, stopping early if
+    the episode ends. The envs' step() calls this when the policy returns a list of actions.
+
+    The observation is only extracted after the last action (and every checkpoint_every actions if set),
+    and a single step_many operator is added to the Trace graph for the whole sequence. The env provides
+    emulator_step(control), an untraced emulator step returning (obs, reward, termination, truncation,
+    info), and observe(obs, info, reward), which extracts the observation of the current frame.
+
+    Args:
+        env: A traced env.
+        actions: Sequence of actions (or action Nodes), or a Node holding a list of actions.
+        checkpoint_every (int): If set, also extract the observation every checkpoint_every actions.
+    Returns:
+        tuple: (obs, total reward, termination, truncation, info) like step(). info["steps"] is the number
+            of actions taken and, with checkpoint_every, info["checkpoints"] lists (steps, obs) pairs.
+    """
+    controls = action_controls(actions)
+    if not controls:
+        raise ValueError("step_many needs at least one action")
+    total_reward = 0
+    checkpoints = []
+    try:
+        for steps, control in enumerate(controls, start=1):
+            next_obs, reward, termination, truncation, info = env.emulator_step(control)
+            total_reward += reward
+            if termination or truncation:
+                break
+            if checkpoint_every and steps % checkpoint_every == 0 and steps < len(controls):
+                checkpoints.append((steps, env.observe(next_obs, info, reward=reward)))
+        env.obs = env.observe(next_obs, info, reward=total_reward)
+    except Exception as e:
+        env.needs_rebuild = True
+        if is_inference_mode():
+            raise
+        raise step_many_error(e, actions)
+    info = dict(info, steps=steps)
+    if checkpoint_every:
+        info["checkpoints"] = checkpoints
+    if is_inference_mode():
+        return env.obs, total_reward, termination, truncation, info
+
+    env.obs = traced_step_many(actions, env.obs)
+    return env.obs, total_reward, termination, truncation, info
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import math
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+
+def _plain(value):
+    """Convert numpy scalars to Python ones and NaN to None."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class MetricsWriter:
+    """
+    Append-only writer of per-iteration metrics (one row per optimization step).
+
+    Every append writes a single row, flushes and fsyncs it, so the file can be read (e.g. with
+    pd.read_csv or read_metrics) while the run is still going and a crash loses at most the row
+    being written.
+
+    JSONL files simply get one object per line. In CSV files a row with columns that were not seen
+    before extends the header: the file is rewritten once with the wider header (atomically, so
+    readers never see a partial file) and later rows are appended again. Columns missing from a row
+    are left empty, as are NaN values.
+
+    Args:
+        path (str): Metrics file; ".jsonl" selects JSONL, anything else CSV. Rows are appended to an
+            existing file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.format = "jsonl" if self.path.suffix == ".jsonl" else "csv"
+        self.columns = []
+        if self.format == "csv" and self.path.exists():
+            with open(self.path, newline="") as f:
+                self.columns = next(csv.reader(f), [])
+
+    def _fsync_append(self, text):
+        with open(self.path, "a", newline="") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _csv_line(self, row):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(["" if row.get(c) is None else row.get(c) for c in self.columns])
+        return buffer.getvalue()
+
+    def _rewrite_csv(self):
+        rows = []
+        if self.path.exists():
+            with open(self.path, newline="") as f:
+                rows = list(csv.DictReader(f))
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, restval="")
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def append(self, row):
+        """Write one row (a dict of column name to value)."""
+        row = {key: _plain(value) for key, value in row.items()}
+        if self.format == "jsonl":
+            self._fsync_append(json.dumps(row) + "\n")
+            return
+        new_columns = [key for key in row if key not in self.columns]
+        if new_columns:
+            self.columns.extend(new_columns)
+            self._rewrite_csv()
+        self._fsync_append(self._csv_line(row))
+
+
+def read_metrics(path):
+    """Read the rows written by MetricsWriter as a pandas DataFrame (also while the run is in progress)."""
+    import pandas as pd
+
+    if Path(path).suffix == ".jsonl":
+        with open(path) as f:
+            # The last line may still be incomplete if a row is being written right now.
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return pd.DataFrame(rows)
+    return pd.read_csv(path)
@@ -0,0 +1,163 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+# One row per OCAtari object. category indexes into the categories tuple of the owning ObjectState.
+OBJECT_DTYPE = np.dtype([
+    ("category", np.int16),
+    ("x", np.int16),
+    ("y", np.int16),
+    ("w", np.int16),
+    ("h", np.int16),
+    ("dx", np.int16),
+    ("dy", np.int16),
+])
+OBJECT_FIELDS = ("x", "y", "w", "h", "dx", "dy")
+
+
+class ObjectView(Mapping):
+    """Read-only dict-like view of one object row, e.g. obs['Ball'] -> {'x': ..., 'y': ..., ...}."""
+    __slots__ = ("_state", "_row", "_fields")
+
+    def __init__(self, state, row, fields=OBJECT_FIELDS):
+        self._state = state
+        self._row = row
+        self._fields = fields
+
+    def __getitem__(self, field):
+        if field not in self._fields:
+            raise KeyError(field)
+        return self._state.objects[field][self._row].item()
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, field):
+        return field in self._fields
+
+    @property
+    def category(self):
+        return self._state.categories[self._state.objects["category"][self._row]]
+
+    def to_dict(self):
+        row = self._state.objects[self._row]
+        return {field: row[field].item() for field in self._fields}
+
+    def copy(self):
+        return self.to_dict()
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class ObjectState(Mapping):
+    """
+    Compact observation of an OCAtari frame.
+
+    The objects live in a single read-only structured array (see OBJECT_DTYPE) and are exposed through a
+    mapping, so policies keep using obs['Ball']['x'], 'Player' in obs or obs.items() as with the former
+    dict of dicts. Keys map either to one object (an ObjectView) or to a group of objects (a list of
+    ObjectViews, e.g. Breakout's bricks of one color). Scalar entries such as the reward are kept in
+    extras and come after the objects when iterating.
+    """
+    __slots__ = ("objects", "categories", "_index", "_extras")
+
+    def __init__(self, objects, categories, index, extras=None):
+        self.objects = objects
+        self.categories = categories
+        self._index = index
+        self._extras = extras if extras is not None else {}
+
+    def __getitem__(self, key):
+        rows = self._index.get(key)
+        if rows is None:
+            return self._extras[key]
+        if isinstance(rows, tuple):
+            rows, fields = rows
+            return [ObjectView(self, row, fields) for row in rows]
+        return ObjectView(self, rows)
+
+    def __iter__(self):
+        yield from self._index
+        yield from self._extras
+
+    def __len__(self):
+        return len(self._index) + len(self._extras)
+
+    def __contains__(self, key):
+        return key in self._index or key in self._extras
+
+    @property
+    def layout(self):
+        """(categories, index): how keys map to rows. Usually unchanged between consecutive frames."""
+        return self.categories, self._index
+
+    @property
+    def extras(self):
+        return self._extras
+
+    def to_dict(self):
+        """Convert to the plain dict of dicts (lists of dicts for groups) used before ObjectState."""
+        obs = dict()
+        for key, value in self.items():
+            if isinstance(value, list):
+                obs[key] = [item.to_dict() for item in value]
+            elif isinstance(value, ObjectView):
+                obs[key] = value.to_dict()
+            else:
+                obs[key] = value
+        return obs
+
+    def copy(self):
+        return self.to_dict()
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __reduce__(self):
+        # Ship the raw rows instead of a pickled ndarray, whose dtype description dominates for small frames.
+        return _restore_object_state, (self.objects.tobytes(), self.categories, self._index, self._extras)
+
+
+def _restore_object_state(data, categories, index, extras):
+    return ObjectState(np.frombuffer(data, dtype=OBJECT_DTYPE), categories, index, extras)
+
+
+def build_object_state(entries, groups=None, extras=None):
+    """
+    Build an ObjectState from OCAtari objects.
+
+    Args:
+        entries: Iterable of (key, object) pairs, where object is an OCAtari GameObject. A repeated key
+            keeps its first position and its last object, as assigning into a dict would.
+        groups (dict): Keys whose objects are collected into a list, mapped to the fields exposed for
+            each object of the group. Non-empty groups come after the single objects, in this order.
+        extras (dict): Scalar entries such as the reward, placed after the objects.
+    Returns:
+        ObjectState: The compact observation.
+    """
+    values = []
+    categories = {}
+    index = {}
+    grouped = {key: [] for key in groups} if groups else {}
+    row = 0
+    for key, object in entries:
+        if key in grouped:
+            grouped[key].append(row)
+        else:
+            index[key] = row
+        category = categories.setdefault(object.category, len(categories))
+        # xywh and prev_xy read the object's attributes once instead of going through six properties.
+        x, y, w, h = object.xywh
+        prev_x, prev_y = object.prev_xy
+        values.extend((category, x, y, w, h, x - prev_x, y - prev_y))
+        row += 1
+    for key, rows in grouped.items():
+        if rows:
+            index[key] = (rows, groups[key])
+    objects = np.fromiter(values, dtype=np.int16, count=len(values)).view(OBJECT_DTYPE)
+    objects.flags.writeable = False
+    return ObjectState(objects, tuple(categories), index, extras)
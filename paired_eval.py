@@ -0,0 +1,112 @@
+from collections import namedtuple
+
+import numpy as np
+
+from early_stopping import confidence_interval
+from inference import inference_mode
+from parallel_eval import cancel_episodes, submit_episodes
+from vector_eval import run_episodes
+
+# Rewards of the episodes both policies finished, in episode order, and statistics of their difference.
+PairedResult = namedtuple("PairedResult", [
+    "candidate_rewards",
+    "incumbent_rewards",
+    "differences",
+    "mean_difference",
+    "variance",
+    "interval",
+])
+
+
+def play_seeded_episode(env, policy, seed, steps_per_episode, catch_errors=False):
+    """
+    Play one episode on env after seeding the emulator, its sticky actions and the random modules.
+
+    Returns:
+        float: Total reward, or None when catch_errors is True and the episode could not be started.
+    """
+    # Same seeding as parallel_eval's workers, so in-process and worker episodes with the same seed match.
+    with inference_mode():
+        rewards = run_episodes([env], policy, 1, steps_per_episode, catch_errors=catch_errors, base_seed=seed)
+    return rewards[0] if rewards else None
+
+
+def summarize_pairs(candidate_rewards, incumbent_rewards, confidence=0.95):
+    """Build a PairedResult from rewards of the same episodes; pairs missing either reward are dropped."""
+    pairs = [(c, i) for c, i in zip(candidate_rewards, incumbent_rewards) if c is not None and i is not None]
+    candidate = [c for c, _ in pairs]
+    incumbent = [i for _, i in pairs]
+    differences = [c - i for c, i in pairs]
+    mean_difference = float(np.mean(differences)) if differences else np.nan
+    variance = float(np.var(differences, ddof=1)) if len(differences) > 1 else np.nan
+    return PairedResult(candidate, incumbent, differences, mean_difference, variance,
+                        confidence_interval(differences, confidence))
+
+
+def evaluate_paired(candidate, incumbent, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                    env=None, num_workers=0, base_seed=0, catch_errors=False, stop_when=None,
+                    confidence=0.95):
+    """
+    Evaluate a candidate policy against an incumbent with common random numbers.
+
+    Episode i of both policies starts from the same seed (base_seed + i), so they face the same
+    emulator and sticky-action streams, and the per-episode reward difference cancels most of the
+    game's randomness. The variance of the paired difference is typically far smaller than that of
+    either policy's reward, so fewer episodes separate the two.
+
+    Args:
+        candidate: Policy to evaluate.
+        incumbent: Policy to compare against, e.g. the best checkpoint so far.
+        env_cls: Traced env class (must provide seed(seed)).
+        env_kwargs (dict): Constructor arguments for env_cls.
+        num_episodes (int): Maximum number of episode pairs.
+        steps_per_episode (int): Maximum number of steps per episode.
+        env: Optional caller-owned env to play on in this process; otherwise one is built and closed.
+        num_workers (int): If > 1, play the episodes in parallel_eval's worker pool instead.
+        base_seed (int): Pair i is seeded with base_seed + i.
+        catch_errors (bool): See vector_eval.run_episodes; pairs missing a reward are dropped.
+        stop_when (callable): Called with the reward differences so far after every pair, e.g.
+            early_stopping.EarlyStopping(0.0); the evaluation ends when it returns True.
+        confidence (float): Confidence level of the reported interval on the mean difference.
+    Returns:
+        PairedResult: Rewards of both policies, their differences, the mean difference, its
+            sample variance and confidence interval.
+    """
+    candidate_rewards = []
+    incumbent_rewards = []
+
+    def record(candidate_reward, incumbent_reward):
+        candidate_rewards.append(candidate_reward)
+        incumbent_rewards.append(incumbent_reward)
+        if stop_when is None or candidate_reward is None or incumbent_reward is None:
+            return False
+        return stop_when(summarize_pairs(candidate_rewards, incumbent_rewards).differences)
+
+    if num_workers > 1:
+        candidate_futures = submit_episodes(candidate, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                                            num_workers=num_workers, base_seed=base_seed,
+                                            catch_errors=catch_errors)
+        incumbent_futures = submit_episodes(incumbent, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                                            num_workers=num_workers, base_seed=base_seed,
+                                            catch_errors=catch_errors)
+        for candidate_future, incumbent_future in zip(candidate_futures, incumbent_futures):
+            if record(candidate_future.result()[1], incumbent_future.result()[1]):
+                cancel_episodes(candidate_futures + incumbent_futures)
+                break
+        return summarize_pairs(candidate_rewards, incumbent_rewards, confidence)
+
+    own_env = env is None
+    if own_env:
+        env = env_cls(**env_kwargs)
+    else:
+        env.init()
+    try:
+        for episode in range(num_episodes):
+            seed = base_seed + episode
+            if record(play_seeded_episode(env, candidate, seed, steps_per_episode, catch_errors),
+                      play_seeded_episode(env, incumbent, seed, steps_per_episode, catch_errors)):
+                break
+    finally:
+        if own_env:
+            env.close()
+    return summarize_pairs(candidate_rewards, incumbent_rewards, confidence)
@@ -0,0 +1,227 @@
+import atexit
+import hashlib
+import importlib
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from inference import inference_mode
+from vector_eval import run_episodes
+
+_pools = {}
+
+# Per-worker caches so that consecutive tasks reuse the same emulator and compiled policy.
+_worker_env = None
+_worker_env_key = None
+_worker_policy = None
+_worker_policy_key = None
+
+
+def _importable_module_name(module_name):
+    """Map __main__ back to the script's module name so that worker processes can import it."""
+    if module_name in ("__main__", "__mp_main__"):
+        main_file = getattr(sys.modules["__main__"], "__file__", None)
+        if main_file:
+            return Path(main_file).stem
+    return module_name
+
+
+def _user_class(obj):
+    """Return the class defined in this repo, skipping wrappers such as the one added by @trace.model."""
+    for cls in type(obj).__mro__:
+        if not cls.__module__.startswith("opto."):
+            return cls
+    return type(obj)
+
+
+def policy_spec(policy):
+    """
+    Describe a trace Policy so that it can be rebuilt in another process.
+
+    Args:
+        policy: A trace Module whose trainable parameters are @bundle(trainable=True) methods.
+    Returns:
+        dict: The importable module and class name of the policy, and the current source code of
+            each trainable bundle keyed by parameter name (e.g. "predict_ball_trajectory").
+    """
+    cls = _user_class(policy)
+    return {
+        "module": _importable_module_name(cls.__module__),
+        "name": cls.__name__,
+        "parameters": {name: p.data for name, p in policy.parameters_dict().items()},
+    }
+
+
+def env_spec(env_cls, **env_kwargs):
+    """Describe a traced env class and its constructor arguments so that workers can build it."""
+    return {
+        "module": _importable_module_name(env_cls.__module__),
+        "name": env_cls.__name__,
+        "kwargs": env_kwargs,
+    }
+
+
+def load_parameters(policy, parameters):
+    """Overwrite the trainable bundle source of policy with the code strings in parameters."""
+    policy_parameters = policy.parameters_dict()
+    for name, code in parameters.items():
+        policy_parameters[name]._set(code)
+
+
+def build_policy(spec):
+    """Import the policy class named in spec and load its trainable parameters."""
+    module = importlib.import_module(spec["module"])
+    policy = getattr(module, spec["name"])()
+    load_parameters(policy, spec["parameters"])
+    return policy
+
+
+def spec_key(spec):
+    """Stable hash of a policy or env spec."""
+    return hashlib.sha256(repr(sorted(spec.items())).encode()).hexdigest()
+
+
+def build_env(spec):
+    """Import the env class named in spec and construct it."""
+    module = importlib.import_module(spec["module"])
+    return getattr(module, spec["name"])(**spec["kwargs"])
+
+
+def _get_worker_env(spec):
+    global _worker_env, _worker_env_key
+    key = spec_key(spec)
+    if _worker_env is None or _worker_env_key != key:
+        if _worker_env is not None:
+            _worker_env.close()
+        _worker_env = build_env(spec)
+        _worker_env_key = key
+    elif not _worker_env.is_healthy():
+        _worker_env.rebuild()
+    return _worker_env
+
+
+def _get_worker_policy(spec):
+    global _worker_policy, _worker_policy_key
+    key = spec_key(spec)
+    if _worker_policy is None or _worker_policy_key != key:
+        _worker_policy = build_policy(spec)
+        _worker_policy_key = key
+    return _worker_policy
+
+
+def _play_episode(policy_spec, env_spec, episode, seed, steps_per_episode, catch_errors):
+    """Worker entry point: play a single episode (seeded unless seed is None) and return (episode, reward or None)."""
+    try:
+        env = _get_worker_env(env_spec)
+        policy = _get_worker_policy(policy_spec)
+        # Policies may draw from random/np.random (e.g. random.choice), so those are seeded with the emulator.
+        with inference_mode():
+            rewards = run_episodes([env], policy, 1, steps_per_episode, catch_errors=catch_errors, base_seed=seed)
+    except Exception:
+        # Trace exceptions carry graph nodes that do not pickle well; send the traceback text instead.
+        raise RuntimeError(f"Evaluation episode {episode} failed in worker {os.getpid()}:\n"
+                           f"{traceback.format_exc()}") from None
+    return episode, (rewards[0] if rewards else None)
+
+
+def get_pool(num_workers):
+    """Return a process pool with num_workers workers, creating it on first use."""
+    if num_workers not in _pools:
+        _pools[num_workers] = ProcessPoolExecutor(max_workers=num_workers)
+    return _pools[num_workers]
+
+
+@atexit.register
+def shutdown_pools():
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
+
+
+def submit_episodes(policy, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                    num_workers=None, base_seed=0, catch_errors=False):
+    """
+    Submit num_episodes evaluation episodes of policy to a process pool without waiting for them.
+
+    Episode i is played on a fresh reset seeded with base_seed + i, so results do not depend on
+    which worker plays which episode. base_seed=None plays unseeded episodes.
+
+    Returns:
+        list: One future per episode, each resolving to (episode, reward). reward is None when
+            catch_errors is True and the episode could not be started.
+    """
+    num_workers = num_workers or os.cpu_count()
+    pool = get_pool(num_workers)
+    p_spec = policy_spec(policy)
+    e_spec = env_spec(env_cls, **env_kwargs)
+    return [pool.submit(_play_episode, p_spec, e_spec, episode, None if base_seed is None else base_seed + episode,
+                        steps_per_episode, catch_errors)
+            for episode in range(num_episodes)]
+
+
+def collect_episodes(futures, stop_when=None):
+    """
+    Wait for futures returned by submit_episodes and return the rewards in episode order.
+
+    stop_when is called with the rewards collected so far in episode order, each time that list grows
+    by one: an episode is only passed on once every episode before it has finished, so short episodes
+    finishing first on other workers do not bias the rule. If it returns True, episodes that have not
+    started yet are cancelled and the rewards passed to stop_when are returned.
+    """
+    if stop_when is None:
+        results = sorted(future.result() for future in futures)
+        return [reward for _, reward in results if reward is not None]
+    results = {}
+    rewards = []  # Rewards of episodes 0..reported-1 in order, as passed to stop_when
+    reported = 0
+    for future in as_completed(futures):
+        episode, reward = future.result()
+        results[episode] = reward
+        while reported in results:
+            reward = results[reported]
+            reported += 1
+            if reward is not None:
+                rewards.append(reward)
+                if stop_when(rewards):
+                    cancel_episodes(futures)
+                    return rewards
+    return rewards
+
+
+def cancel_episodes(futures):
+    """
+    Drop episodes submitted with submit_episodes whose results are no longer needed.
+
+    Episodes that have not started are cancelled; those already running in a worker finish and their
+    results are discarded.
+    """
+    for future in futures:
+        future.cancel()
+
+
+def evaluate_parallel(policy, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                      num_workers=None, base_seed=0, catch_errors=False, stop_when=None):
+    """
+    Evaluate a policy with its episodes spread over a pool of worker processes.
+
+    The current source of the policy's trainable bundles is shipped to the workers, which rebuild
+    the policy and run their own envs; the caller only aggregates rewards.
+
+    Args:
+        policy: A trace Policy module.
+        env_cls: Traced env class to build in each worker (must provide seed(seed)).
+        env_kwargs (dict): Constructor arguments for env_cls.
+        num_episodes (int): Number of episodes to play.
+        steps_per_episode (int): Maximum number of steps per episode.
+        num_workers (int): Pool size; defaults to the number of CPU cores.
+        base_seed (int): Episode i is seeded with base_seed + i; None plays unseeded episodes.
+        catch_errors (bool): Passed to vector_eval.run_episodes in the workers.
+        stop_when (callable): Early-stopping rule, see collect_episodes.
+    Returns:
+        list: Total reward of every played episode, in episode order.
+    """
+    futures = submit_episodes(policy, env_cls, env_kwargs, num_episodes, steps_per_episode,
+                              num_workers=num_workers, base_seed=base_seed, catch_errors=catch_errors)
+    return collect_episodes(futures, stop_when=stop_when)
@@ -0,0 +1,113 @@
+import copy
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def default_temperatures(population_size):
+    """Sampling temperatures spread over [0.2, 1.0], one per candidate."""
+    if population_size == 1:
+        return [None]
+    return [round(t, 2) for t in np.linspace(0.2, 1.0, population_size)]
+
+
+class _TemperatureLLM:
+    """An LLM backend that adds a sampling temperature to every request."""
+
+    def __init__(self, llm, temperature):
+        self.llm = llm
+        self.temperature = temperature
+
+    def __call__(self, *args, **kwargs):
+        kwargs.setdefault("temperature", self.temperature)
+        return self.llm(*args, **kwargs)
+
+
+def _call_llm(optimizer, system_prompt, user_prompt, temperature):
+    """optimizer.call_llm with a sampling temperature (None keeps the backend's default)."""
+    if temperature is not None:
+        # A shallow copy gives each concurrent request its own backend without touching the shared optimizer.
+        optimizer = copy.copy(optimizer)
+        optimizer.llm = _TemperatureLLM(optimizer.llm, temperature)
+    return optimizer.call_llm(system_prompt, user_prompt, max_tokens=optimizer.max_tokens)
+
+
+def propose_candidates(optimizer, population_size, temperatures=None):
+    """
+    Ask an OptoPrime optimizer for several parameter updates from the same backward feedback.
+
+    The prompt is built once (so the optimizer's memory records this feedback once, as in a regular
+    step) and sent population_size times concurrently, each request with its own sampling temperature.
+
+    Args:
+        optimizer: OptoPrime optimizer on which backward() was called.
+        population_size (int): Number of candidate updates to request.
+        temperatures (list): Sampling temperature of each request; defaults to default_temperatures.
+    Returns:
+        list: (update_dict, response) per request, in request order. update_dict maps parameter nodes
+            to their proposed data and is empty when the LLM answered TERMINATE or proposed nothing usable.
+    """
+    temperatures = temperatures or default_temperatures(population_size)
+    summary = optimizer.summarize()
+    system_prompt, user_prompt = optimizer.construct_prompt(summary)
+    system_prompt = optimizer.replace_symbols(system_prompt, optimizer.prompt_symbols)
+    user_prompt = optimizer.replace_symbols(user_prompt, optimizer.prompt_symbols)
+
+    # The requests are I/O bound, so threads overlap their round trips.
+    with ThreadPoolExecutor(max_workers=population_size) as executor:
+        responses = list(executor.map(lambda t: _call_llm(optimizer, system_prompt, user_prompt, t),
+                                      temperatures[:population_size]))
+
+    candidates = []
+    for response in responses:
+        update_dict = {}
+        if "TERMINATE" not in response:
+            update_dict = optimizer.construct_update_dict(optimizer.extract_llm_suggestion(response))
+        if optimizer.log is not None:
+            optimizer.log.append({"system_prompt": system_prompt, "user_prompt": user_prompt, "response": response})
+        candidates.append((update_dict, response))
+    if optimizer.summary_log is not None:
+        optimizer.summary_log.append({"problem_instance": optimizer.problem_instance(summary), "summary": summary})
+    return candidates
+
+
+def select_candidate(optimizer, candidates, submit, collect):
+    """
+    Evaluate candidate updates in parallel and commit the best one to the optimizer's parameters.
+
+    Each candidate is applied in turn and submit() is called while it is in place; submit must capture
+    the policy code right away (e.g. parallel_eval.submit_episodes, which ships the current source to
+    the workers) and return a handle that collect(handle) later turns into a score. All candidates are
+    therefore evaluated concurrently. A candidate whose evaluation raises scores NaN.
+
+    Args:
+        optimizer: Optimizer whose parameters the candidate update dicts refer to.
+        candidates (list): Update dicts, e.g. from propose_candidates.
+        submit (callable): Starts evaluating the current parameters and returns a handle.
+        collect (callable): Waits for a handle and returns its score (higher is better).
+    Returns:
+        tuple: (index of the committed candidate, list of scores).
+    """
+    original = {p: p.data for p in optimizer.parameters}
+    handles = []
+    try:
+        for update_dict in candidates:
+            optimizer.update(original)
+            optimizer.update(update_dict)
+            handles.append(submit())
+    finally:
+        optimizer.update(original)
+
+    scores = []
+    for index, handle in enumerate(handles):
+        try:
+            scores.append(float(collect(handle)))
+        except Exception as e:
+            logger.warning(f"Evaluation of candidate {index} failed: {e}")
+            scores.append(np.nan)
+    best = int(np.nanargmax(scores)) if not np.all(np.isnan(scores)) else 0
+    optimizer.update(candidates[best])
+    return best, scores
@@ -0,0 +1,211 @@
+import argparse
+import random
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from evaluate_policy import POLICIES
+from inference import inference_mode
+from parallel_eval import policy_spec
+from trajectory_store import TrajectoryStore
+
+
+def replay_observations(store, entry):
+    """
+    Rebuild the observations of a stored episode as plain dicts (dicts of fields for single objects,
+    lists of them for groups), in the order the episode was played.
+
+    Returns:
+        list: (step, observation, recorded action) triples. step counts env steps from the start of the
+            episode; the recorded action is the one played on the observation (None for the last one), a
+            list of actions for a macro action of more than one action.
+    """
+    if entry["first_observation_step"] is None:
+        return []
+    columns = store.load(entry, mmap_mode=None)
+    first_step = entry["first_observation_step"]
+    steps = entry["steps"] + 1 - first_step
+    # tolist() once per column gives Python ints, as ObjectView does, and avoids numpy scalar lookups per field.
+    singles = {}
+    groups = {}
+    numbered = {}
+    extras = {}
+    for column, values in columns.items():
+        kind, _, key = column.partition("/")
+        if kind == "obj" and not key.endswith("/present"):
+            singles[key] = (values.tolist(), columns[f"{column}/present"].tolist())
+        elif kind == "grp" and not key.endswith("/offsets"):
+            groups[key] = (values.tolist(), columns[f"{column}/offsets"].tolist())
+        elif kind == "cat" and not key.endswith(("/offsets", "/numbers")):
+            numbered[key] = (values.tolist(), columns[f"{column}/offsets"].tolist(),
+                             columns[f"{column}/numbers"].tolist())
+        elif kind == "extra":
+            extras[key] = values.tolist()
+    actions = columns["actions"].tolist()
+    if "actions/offsets" in columns:
+        offsets = columns["actions/offsets"].tolist()
+        actions = [actions[start] if end - start == 1 else actions[start:end]
+                   for start, end in zip(offsets, offsets[1:])]
+    # Windowed rollouts store only the last actions of the episode. Older entries without first_action_step
+    # also hold the last ones (all of them for full episodes).
+    first_action = entry.get("first_action_step")
+    if first_action is None:
+        first_action = max(0, entry["steps"] - len(actions))
+
+    observations = []
+    for t in range(steps):
+        obs = {}
+        for key, (rows, present) in singles.items():
+            if present[t]:
+                obs[key] = dict(zip(entry["fields"][key], rows[t]))
+        for key, (rows, offsets) in groups.items():
+            if offsets[t + 1] > offsets[t]:
+                obs[key] = [dict(zip(entry["fields"][key], row)) for row in rows[offsets[t]:offsets[t + 1]]]
+        for category, (rows, offsets, numbers) in numbered.items():
+            for row in range(offsets[t], offsets[t + 1]):
+                obs[f"{category}{numbers[row]}"] = dict(zip(entry["fields"][category], rows[row]))
+        for key, values in extras.items():
+            if not np.isnan(values[t]):
+                obs[key] = values[t]
+        step = first_step + t
+        action_index = step - first_action
+        observations.append((step, obs, actions[action_index] if 0 <= action_index < len(actions) else None))
+    return observations
+
+
+def load_states(trajectory_dir, kind=None, iterations=None, max_states=None):
+    """
+    Collect recorded observations to replay.
+
+    Args:
+        trajectory_dir (str): A TrajectoryStore directory, e.g. trace_ckpt/<run>/trajectories.
+        kind (str): Only "rollout" or "eval" episodes.
+        iterations (tuple): Optional (first, last) iteration, both included.
+        max_states (int): Stop after this many states.
+    Returns:
+        list: One dict per state with the episode's kind, iteration and episode, the step, the
+            observation and the recorded action.
+    """
+    store = TrajectoryStore(trajectory_dir)
+    states = []
+    for entry in store.index(kind=kind):
+        if iterations is not None and not iterations[0] <= entry["iteration"] <= iterations[1]:
+            continue
+        for step, obs, recorded_action in replay_observations(store, entry):
+            states.append({"Kind": entry["kind"], "Iteration": entry["iteration"], "Episode": entry["episode"],
+                           "Step": step, "obs": obs, "Recorded Action": recorded_action})
+            if max_states is not None and len(states) >= max_states:
+                return states
+    return states
+
+
+def load_policy(game, ckpt_path):
+    policy = POLICIES[game]()
+    policy.load(ckpt_path)
+    return policy
+
+
+def _act(policy, obs, seed):
+    # Both policies draw the same random numbers on a state, so random tie-breaking is not a divergence.
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        return policy(obs)
+    except Exception as e:
+        return f"({type(e).__name__}) {e}"
+
+
+@inference_mode()
+def diff_policies(policy_a, policy_b, states, seed=0):
+    """
+    Replay states through two policies and compare their actions. No emulator is involved: only the
+    policies' decision functions run, in inference mode.
+
+    The random modules are seeded with seed + state number before each policy call. A policy that
+    raises on a state gets "(<exception type>) <message>" as its action.
+
+    Returns:
+        tuple: (summary, divergent), where summary is a dict of counts and divergent a DataFrame with
+            one row per state on which the actions differ.
+    """
+    rows = []
+    pairs = Counter()
+    per_episode = Counter()
+    start = time.perf_counter()
+    for k, state in enumerate(states):
+        action_a = _act(policy_a, state["obs"], seed + k)
+        action_b = _act(policy_b, state["obs"], seed + k)
+        if action_a != action_b:
+            rows.append({key: value for key, value in state.items() if key != "obs"} |
+                        {"Action A": action_a, "Action B": action_b})
+            pairs[(action_a, action_b)] += 1
+            per_episode[(state["Kind"], state["Iteration"], state["Episode"])] += 1
+    elapsed = time.perf_counter() - start
+
+    parameters_a = policy_spec(policy_a)["parameters"]
+    parameters_b = policy_spec(policy_b)["parameters"]
+    summary = {
+        "States": len(states),
+        "Divergent States": len(rows),
+        "Divergence Rate": len(rows) / len(states) if states else float("nan"),
+        "Episodes": len({(s["Kind"], s["Iteration"], s["Episode"]) for s in states}),
+        "Divergent Episodes": len(per_episode),
+        "States/s": len(states) / elapsed if elapsed > 0 else float("nan"),
+        "Action Pairs": dict(pairs.most_common()),
+        "Changed Parameters": [name for name, code in parameters_a.items() if parameters_b.get(name) != code],
+    }
+    divergent = pd.DataFrame(rows, columns=["Kind", "Iteration", "Episode", "Step", "Recorded Action",
+                                            "Action A", "Action B"])
+    # The last observation of an episode has no recorded action; keep the column integer anyway
+    # (unless macro actions were recorded).
+    if not any(isinstance(action, list) for action in divergent["Recorded Action"]):
+        divergent["Recorded Action"] = divergent["Recorded Action"].astype("Int64")
+    return summary, divergent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay recorded observations through two policy checkpoints '
+                                                 'and report where their actions diverge (no emulator)')
+    parser.add_argument('ckpt_a', type=str, help='First checkpoint, e.g. trace_ckpt/<run>/5.pkl')
+    parser.add_argument('ckpt_b', type=str, help='Second checkpoint, e.g. trace_ckpt/<run>/6.pkl')
+    parser.add_argument('--game', type=str, choices=list(POLICIES), default='Pong', help='Game of the checkpoints')
+    parser.add_argument('--trajectories', type=str, default=None,
+                        help='Trajectory store to replay (default: the trajectories directory next to ckpt_a)')
+    parser.add_argument('--kind', type=str, choices=['rollout', 'eval'], default=None,
+                        help='Only replay rollout or evaluation episodes')
+    parser.add_argument('--iterations', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='Only replay episodes recorded in iterations FIRST..LAST (inclusive)')
+    parser.add_argument('--max_states', type=int, default=None, help='Replay at most this many states')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random modules on the first state')
+    parser.add_argument('--csv', type=str, default=None, help='Write the divergent states to this CSV')
+    parser.add_argument('--show', type=int, default=10, help='Number of divergent states to print')
+    args = parser.parse_args()
+
+    trajectory_dir = args.trajectories or str(Path(args.ckpt_a).parent / "trajectories")
+    states = load_states(trajectory_dir, kind=args.kind, iterations=args.iterations, max_states=args.max_states)
+    if not states:
+        parser.error(f"No recorded states in {trajectory_dir} (run optimize_policy with record_trajectories=True)")
+    try:
+        policy_a = load_policy(args.game, args.ckpt_a)
+        policy_b = load_policy(args.game, args.ckpt_b)
+    except Exception:
+        parser.error(f"Could not load the checkpoints:\n{traceback.format_exc()}")
+
+    summary, divergent = diff_policies(policy_a, policy_b, states, seed=args.seed)
+    print(f"Changed parameters: {', '.join(summary['Changed Parameters']) or 'none'}")
+    print(f"{summary['Divergent States']}/{summary['States']} states diverge ({summary['Divergence Rate']:.2%}) "
+          f"in {summary['Divergent Episodes']}/{summary['Episodes']} episodes, "
+          f"replayed at {summary['States/s']:.0f} states/s")
+    for (action_a, action_b), count in summary["Action Pairs"].items():
+        print(f"  {action_a!s:>10} -> {action_b!s:<10} {count}")
+    if not divergent.empty and args.show > 0:
+        print(divergent.head(args.show).to_string(index=False))
+    if args.csv:
+        divergent.to_csv(args.csv, index=False)
+        print(f"Divergent states written to {args.csv}")
+    # A non-zero exit status lets scripts skip the full evaluation of behaviourally identical checkpoints.
+    raise SystemExit(1 if summary["Divergent States"] else 0)
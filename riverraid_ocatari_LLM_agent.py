@@ -2,12 +2,13 @@ import os
 import ale_py
 import logging
 import datetime
+import time
 from pathlib import Path
+from collections.abc import Mapping
 import numpy as np
 import io
 import contextlib
 import cv2
-import pandas as pd
 import warnings
 import argparse
 import sys
@@ -24,6 +25,23 @@ from opto.optimizers import OptoPrime
 from opto.trace.bundle import ExceptionNode
 from opto.trace.errors import ExecutionError
 from ocatari.core import OCAtari
+from vector_eval import preserved_random_state, run_episodes, seed_episode
+from parallel_eval import submit_episodes, collect_episodes, cancel_episodes
+from inference import inference_mode, is_inference_mode, policy_method
+from trace_window import windowed_rollout, describe_history
+from obs_state import build_object_state
+from env_snapshot import capture_snapshot, restore_snapshot
+from macro_actions import is_macro_action, step_many
+from shm_transport import SharedMemoryEnvPool
+from early_stopping import EarlyStopping
+from eval_cache import EvalCache, evaluation_key
+from population import propose_candidates, select_candidate
+from llm_cache import make_llm
+from summary_compression import install_summary_compression
+from instrumentation import PhaseTimer, PhaseProfiler, TokenCountingLLM, perf_columns
+from metrics_writer import MetricsWriter
+from event_log import EventLog
+from trajectory_store import TrajectoryStore, EpisodeRecorder
 
 gym.register_envs(ale_py)
 timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -49,9 +67,23 @@ class RiverraidOCAtariTracedEnv:
         self.frameskip = frameskip
         self.repeat_action_probability = repeat_action_probability
         self.env = None
+        self.needs_rebuild = False
+        self.start_snapshot = None
         self.init()
     
     def init(self):
+        """
+        Get the environment ready for a new episode. The existing OCAtari instance is reset in place
+        and only rebuilt when it is missing or failed its health check.
+        """
+        if not self.is_healthy():
+            self.rebuild()
+        self.obs, _ = self.env.reset()
+
+    def rebuild(self):
+        """
+        Tear down the current OCAtari instance (if any) and construct a fresh one.
+        """
         if self.env is not None:
             self.close()
         self.env = OCAtari(self.env_name, 
@@ -60,7 +92,41 @@ class RiverraidOCAtariTracedEnv:
                            hud=self.hud,
                            frameskip=self.frameskip,
                            repeat_action_probability=self.repeat_action_probability)
-        self.obs, _ = self.env.reset()
+        self.needs_rebuild = False
+
+    def is_healthy(self):
+        """
+        Check whether the underlying emulator can be reused without rebuilding it.
+        """
+        if self.env is None or self.needs_rebuild:
+            return False
+        try:
+            self.env._env.unwrapped.ale.lives()
+        except Exception:
+            return False
+        return True
+
+    def seed(self, seed):
+        """
+        Seed the emulator (including sticky actions) so that the next reset() starts a reproducible episode.
+        """
+        self.env.reset(seed=seed)
+
+    def snapshot(self, info=None):
+        """
+        Capture the current game state (see env_snapshot.capture_snapshot). Setting the result as
+        start_snapshot makes every following reset() start from this state instead of a new game.
+        """
+        obs = self.obs.data if isinstance(self.obs, trace.Node) else self.obs
+        return capture_snapshot(self.env, obs=obs, info=info)
+
+    def restore(self, snapshot):
+        """
+        Return to a state captured by snapshot() and return its info.
+        """
+        restore_snapshot(self.env, snapshot)
+        self.obs = snapshot.obs
+        return dict(snapshot.info)
     
     def close(self):
         if self.env is not None:
@@ -71,8 +137,8 @@ class RiverraidOCAtariTracedEnv:
     def __del__(self):
         self.close()
 
-    def extract_obj_state(self, objects):
-        obs = dict()
+    def extract_obj_state(self, objects, reward=np.nan):
+        entries = []
         # Count objects by category to create unique keys
         category_counts = {}
         
@@ -94,35 +160,52 @@ class RiverraidOCAtariTracedEnv:
             else:
                 key = category
                 
-            obs[key] = {"x": object.x,
-                        "y": object.y,
-                        "w": object.w,
-                        "h": object.h,
-                        "dx": object.dx,
-                        "dy": object.dy,}
-        return obs
+            entries.append((key, object))
+        return build_object_state(entries, extras={"reward": reward})
 
-    @bundle()
     def reset(self):
         """
         Reset the environment and return the initial observation and info.
         """
-        _, info = self.env.reset()
-        self.obs = self.extract_obj_state(self.env.objects)
-        self.obs['reward'] = np.nan
-        return self.obs, info
+        if self.start_snapshot is not None:
+            info = self.restore(self.start_snapshot)
+        else:
+            _, info = self.env.reset()
+            self.obs = self.extract_obj_state(self.env.objects)
+        if is_inference_mode():
+            return self.obs, info
+
+        @bundle()
+        def reset():
+            """
+            Reset the environment and return the initial observation and info.
+            """
+            return self.obs, info
+
+        return reset()
     
+    def emulator_step(self, control):
+        """Step the emulator without extracting the observation (see macro_actions.step_many)."""
+        return self.env.step(control)
+
+    def observe(self, next_obs, info, reward=np.nan):
+        return self.extract_obj_state(self.env.objects, reward=reward)
+
     def step(self, action):
         """
-        Step the environment with the given action.
+        Step the environment with the given action, or take a macro action if it is a list of actions.
         """
+        if is_macro_action(action):
+            return step_many(self, action)
         try:
             control = action.data if isinstance(action, trace.Node) else action
-            next_obs, reward, termination, truncation, info = self.env.step(control)
+            next_obs, reward, termination, truncation, info = self.emulator_step(control)
 
-            self.obs = self.extract_obj_state(self.env.objects)
-            self.obs['reward'] = reward
+            self.obs = self.observe(next_obs, info, reward=reward)
         except Exception as e:
+            self.needs_rebuild = True
+            if is_inference_mode():
+                raise
             e_node = ExceptionNode(
                 e,
                 inputs={"action": action},
@@ -130,7 +213,9 @@ class RiverraidOCAtariTracedEnv:
                 name="exception_step",
             )
             raise ExecutionError(e_node)
-            
+        if is_inference_mode():
+            return self.obs, reward, termination, truncation, info
+
         @bundle()
         def step(action):
             """
@@ -147,9 +232,9 @@ class Policy(Module):
         pass
 
     def __call__(self, obs):
-        shoot_decision = self.decide_shoot(obs)
-        move_decision = self.decide_movement(obs)
-        return self.combine_actions(shoot_decision, move_decision)
+        shoot_decision = policy_method(self, "decide_shoot")(obs)
+        move_decision = policy_method(self, "decide_movement")(obs)
+        return policy_method(self, "combine_actions")(shoot_decision, move_decision)
     
     @bundle(trainable=True)
     def decide_shoot(self, obs):
@@ -314,8 +399,14 @@ def display_terminal_debug(obs, step_num=None):
     print(debug_info)
     print("="*50 + "\n")
 
-def rollout(env, horizon, policy, visualize=False, debug=False, vis_dir=None, terminal_debug=False, vis_frequency=20, create_gif=True, gif_fps=10):
-    """Rollout a policy in an env for horizon steps."""
+def rollout(env, horizon, policy, visualize=False, debug=False, vis_dir=None, terminal_debug=False, vis_frequency=20, create_gif=True, gif_fps=10, window=None):
+    """
+    Rollout a policy in an env for horizon steps.
+    If window is set, only the last window steps are traced (see trace_window.windowed_rollout);
+    visualization and debug output are not produced in that mode.
+    """
+    if window is not None:
+        return windowed_rollout(env, horizon, policy, window)
     try:
         obs, _ = env.reset()
         trajectory = dict(observations=[], actions=[], rewards=[], terminations=[], truncations=[], infos=[], steps=0)
@@ -434,6 +525,48 @@ def rollout(env, horizon, policy, visualize=False, debug=False, vis_dir=None, te
     
     return trajectory, error
 
+def test_cache_key(policy,
+                   num_episodes=10,
+                   steps_per_episode=4000,
+                   frameskip=1,
+                   repeat_action_probability=0.0,
+                   base_seed=None):
+    """
+    Key of the eval cache entry that test_policy reads and writes for these settings, so that callers
+    can look a policy up before starting any of its episodes.
+    """
+    return evaluation_key(policy,
+                          env=RiverraidOCAtariTracedEnv.__name__,
+                          frameskip=frameskip,
+                          repeat_action_probability=repeat_action_probability,
+                          num_episodes=num_episodes,
+                          steps_per_episode=steps_per_episode,
+                          base_seed=base_seed)
+
+def submit_test_episodes(policy,
+                         num_episodes=10,
+                         steps_per_episode=4000,
+                         frameskip=1,
+                         repeat_action_probability=0.0,
+                         num_workers=0,
+                         base_seed=None):
+    """
+    Start the evaluation episodes of test_policy in the worker pool without waiting for them.
+    Passing the returned futures to test_policy as pending collects them, so an evaluation can run
+    while the main process does something else with the same policy, e.g. the traced rollout.
+    """
+    return submit_episodes(policy,
+                           RiverraidOCAtariTracedEnv,
+                           dict(render_mode=None,
+                                frameskip=frameskip,
+                                repeat_action_probability=repeat_action_probability),
+                           num_episodes,
+                           steps_per_episode,
+                           num_workers=num_workers,
+                           base_seed=base_seed,
+                           catch_errors=True)
+
+@inference_mode()
 def test_policy(policy, 
                 num_episodes=10, 
                 steps_per_episode=4000,
@@ -445,7 +578,15 @@ def test_policy(policy,
                 terminal_debug=False,
                 vis_frequency=20,
                 create_gif=True,
-                gif_fps=10):
+                gif_fps=10,
+                env=None,
+                num_envs=1,
+                num_workers=0,
+                base_seed=None,
+                early_stop=None,
+                cache=None,
+                pending=None,
+                recorder=None):
     """
     Test a policy over multiple episodes and return the mean and standard deviation of rewards.
     
@@ -462,91 +603,154 @@ def test_policy(policy,
         vis_frequency: Save visualization every N steps
         create_gif: Whether to create a GIF instead of individual frames
         gif_fps: Frames per second for GIF
+        env: Optional env (or list of envs) to reuse across calls; they are reset in place and left open.
+            If None, fresh envs are created and closed.
+        num_envs: Number of envs stepping together when env is None. Episodes are only played in lockstep
+            when visualize is False; the visualized first episode needs a single env.
+        num_workers: If > 1 (and visualize is False), play the episodes in a pool of worker processes instead.
+        base_seed: Seed of the first episode; episode i uses base_seed + i (see vector_eval.seed_episode) whether
+            it is played here or in a worker process. None (the default) plays unseeded episodes, which are
+            never cached.
+        early_stop: Optional callable (e.g. an early_stopping.EarlyStopping) given the rewards so far, in episode
+            order, as episodes finish; the evaluation ends when it returns True.
+        cache: Optional eval_cache.EvalCache. Policy code already evaluated with the same settings is not played
+            again (nothing is visualized then), and complete evaluations are added to the cache.
+        pending: Futures from submit_test_episodes with the same settings; they are collected (in place of
+            playing the episodes here) and nothing is visualized.
+        recorder: Optional trajectory_store.EpisodeRecorder that stores the episodes played in this process
+            (episodes played in worker processes or visualized are not recorded).
         
     Returns:
         tuple: (mean_reward, std_reward)
     """
+    if base_seed is None:
+        cache = None  # Unseeded rewards are one random draw, not a result of the policy code
+    cache_key = None
+    if cache is not None:
+        cache_key = test_cache_key(policy, num_episodes, steps_per_episode, frameskip,
+                                   repeat_action_probability, base_seed)
+        rewards = cache.get(cache_key)
+        if rewards is not None:
+            if pending is not None:
+                cancel_episodes(pending)
+            # Apply the stopping rule to the cached rewards, as if the episodes had been played again.
+            for n in range(1, len(rewards) + 1):
+                if early_stop is not None and early_stop(rewards[:n]):
+                    rewards = rewards[:n]
+                    break
+            print(f"  Policy code already evaluated. Mean: {np.mean(rewards):.1f}, StdDev: {np.std(rewards):.1f} (cached)")
+            return np.mean(rewards), np.std(rewards)
+
     print(f"  Testing policy over {num_episodes} episodes...", end="", flush=True)
     
-    env = None
+    # Reuse caller-owned envs across calls; only build (and later close) them when none are given.
+    own_env = env is None
+    envs = []
     rewards = []
     
+    use_workers = pending is not None or (num_workers > 1 and not visualize)
     try:
-        env = RiverraidOCAtariTracedEnv(render_mode=None,
-                                           frameskip=frameskip,
-                                           repeat_action_probability=repeat_action_probability)
+        if use_workers:
+            env = None
+        elif own_env:
+            envs = [RiverraidOCAtariTracedEnv(render_mode=None,
+                                             frameskip=frameskip,
+                                             repeat_action_probability=repeat_action_probability)
+                    for _ in range(1 if visualize else max(1, min(num_envs, num_episodes)))]
+            env = envs[0]
+        else:
+            envs = env if isinstance(env, (list, tuple)) else [env]
+            for e in envs:
+                e.init()
+            env = envs[0]
         
-        for episode in range(num_episodes):
-            episode_reward = 0
-            frames = [] if visualize and episode == 0 and create_gif else None
-            
-            try:
-                obs, _ = env.reset()
+        if use_workers:
+            if pending is None:
+                pending = submit_test_episodes(policy, num_episodes, steps_per_episode, frameskip,
+                                               repeat_action_probability, num_workers, base_seed)
+            rewards = collect_episodes(pending, stop_when=early_stop)
+        elif not visualize:
+            rewards = run_episodes(envs, policy, num_episodes, steps_per_episode, catch_errors=True,
+                                   stop_when=early_stop, record=recorder, base_seed=base_seed)
+        else:
+            # seed_episode reseeds the random modules; the caller's state is put back afterwards.
+            with preserved_random_state() if base_seed is not None else contextlib.nullcontext():
+                for episode in range(num_episodes):
+                    episode_reward = 0
+                    frames = [] if visualize and episode == 0 and create_gif else None
                 
-                for step in range(steps_per_episode):
                     try:
-                        # Visualize the first episode if requested
-                        if visualize and episode == 0:
-                            # Display debug info in terminal if requested
-                            if terminal_debug and step % 10 == 0:
-                                display_terminal_debug(obs, step)
-                            
-                            # Create visualization frame
-                            if create_gif or (step % vis_frequency == 0 or step < 5 or step > steps_per_episode - 5):
-                                frame = visualize_game_state(obs, step)
+                        if base_seed is not None:
+                            seed_episode(env, base_seed + episode)
+                        obs, _ = env.reset()
+                    
+                        for step in range(steps_per_episode):
+                            try:
+                                # Visualize the first episode if requested
+                                if visualize and episode == 0:
+                                    # Display debug info in terminal if requested
+                                    if terminal_debug and step % 10 == 0:
+                                        display_terminal_debug(obs, step)
                                 
-                                if create_gif:
-                                    # Store frame for GIF
-                                    frames.append(frame)
+                                    # Create visualization frame
+                                    if create_gif or (step % vis_frequency == 0 or step < 5 or step > steps_per_episode - 5):
+                                        frame = visualize_game_state(obs, step)
+                                    
+                                        if create_gif:
+                                            # Store frame for GIF
+                                            frames.append(frame)
+                                    
+                                        # Save individual frame if requested and at the right frequency
+                                        if vis_dir and not create_gif and (step % vis_frequency == 0 or step < 5):
+                                            eval_vis_path = os.path.join(vis_dir, f"eval_step_{step:04d}.png")
+                                            cv2.imwrite(eval_vis_path, frame)
                                 
-                                # Save individual frame if requested and at the right frequency
-                                if vis_dir and not create_gif and (step % vis_frequency == 0 or step < 5):
-                                    eval_vis_path = os.path.join(vis_dir, f"eval_step_{step:04d}.png")
-                                    cv2.imwrite(eval_vis_path, frame)
+                                    # Print debug info if requested
+                                    if debug and vis_dir:
+                                        try:
+                                            debug_info = print_debug_info(obs, step)
+                                            with open(os.path.join(vis_dir, "eval_debug_log.txt"), "a") as f:
+                                                f.write(debug_info + "\n\n")
+                                        except Exception as e:
+                                            # Log debug error but continue with evaluation
+                                            with open(os.path.join(vis_dir, "eval_errors.txt"), "a") as f:
+                                                f.write(f"Debug error at step {step}: {str(e)}\n")
                             
-                            # Print debug info if requested
-                            if debug and vis_dir:
-                                try:
-                                    debug_info = print_debug_info(obs, step)
-                                    with open(os.path.join(vis_dir, "eval_debug_log.txt"), "a") as f:
-                                        f.write(debug_info + "\n\n")
-                                except Exception as e:
-                                    # Log debug error but continue with evaluation
+                                action = policy(obs)
+                                obs, reward, terminated, truncated, _ = env.step(action)
+                                episode_reward += reward
+                            
+                                if terminated or truncated:
+                                    break
+                            except Exception as e:
+                                # Log error but continue with next episode
+                                logging.warning(f"Error during test episode {episode} step: {str(e)}")
+                                break
+                    
+                        # Create GIF for the first episode if requested
+                        if visualize and episode == 0 and create_gif and frames and vis_dir:
+                            try:
+                                # Save GIF
+                                gif_path = os.path.join(vis_dir, "eval_animation.gif")
+                                print(f"\n  Creating evaluation GIF with {len(frames)} frames...")
+                                imageio.mimsave(gif_path, frames, fps=gif_fps)
+                                print(f"  Evaluation GIF created: {gif_path}")
+                            except Exception as e:
+                                # Log GIF creation error
+                                if vis_dir:
                                     with open(os.path.join(vis_dir, "eval_errors.txt"), "a") as f:
-                                        f.write(f"Debug error at step {step}: {str(e)}\n")
-                        
-                        action = policy(obs)
-                        obs, reward, terminated, truncated, _ = env.step(action)
-                        episode_reward += reward
-                        
-                        if terminated or truncated:
+                                        f.write(f"GIF creation error: {str(e)}\n")
+                    
+                        rewards.append(episode_reward)
+                        if early_stop is not None and early_stop(rewards):
                             break
                     except Exception as e:
                         # Log error but continue with next episode
-                        logging.warning(f"Error during test episode {episode} step: {str(e)}")
-                        break
-                
-                # Create GIF for the first episode if requested
-                if visualize and episode == 0 and create_gif and frames and vis_dir:
-                    try:
-                        # Save GIF
-                        gif_path = os.path.join(vis_dir, "eval_animation.gif")
-                        print(f"\n  Creating evaluation GIF with {len(frames)} frames...")
-                        imageio.mimsave(gif_path, frames, fps=gif_fps)
-                        print(f"  Evaluation GIF created: {gif_path}")
-                    except Exception as e:
-                        # Log GIF creation error
-                        if vis_dir:
-                            with open(os.path.join(vis_dir, "eval_errors.txt"), "a") as f:
-                                f.write(f"GIF creation error: {str(e)}\n")
-                
-                rewards.append(episode_reward)
-            except Exception as e:
-                # Log error but continue with next episode
-                logging.warning(f"Error during test episode {episode}: {str(e)}")
-                continue
+                        logging.warning(f"Error during test episode {episode}: {str(e)}")
+                        continue
     except Exception as e:
         logging.error(f"Error during policy testing: {str(e)}")
+        cache = None  # The fallback rewards below are not an evaluation worth keeping
         # Return default values if testing fails completely
         if not rewards and env is not None:
             # Try to get a single episode reward as fallback
@@ -563,11 +767,14 @@ def test_policy(policy,
             except:
                 rewards = [0.0]  # Last resort
     finally:
-        if env is not None:
-            try:
-                env.close()
-            except:
-                pass  # Ignore errors during environment closing
+        if own_env:
+            for e in envs:
+                try:
+                    e.close()
+                except:
+                    pass  # Ignore errors during environment closing
+    if cache is not None and len(rewards) == num_episodes:
+        cache.put(cache_key, rewards)
     
     # Calculate statistics
     if rewards:
@@ -589,13 +796,15 @@ def visualize_game_state(obs, step_num=None, save_path=None):
         step_num (int, optional): Current step number for labeling
         save_path (str, optional): Path to save visualization image
     """
+    obs = obs.data if isinstance(obs, trace.Node) else obs
+
     # Create a blank canvas (black background)
     canvas = np.zeros((210, 160, 3), dtype=np.uint8)
     
     # Draw objects
     for key, obj in obs.items():
         # Skip reward or non-dict objects
-        if key == 'reward' or not isinstance(obj, dict) and not hasattr(obj, 'data'):
+        if key == 'reward' or not isinstance(obj, Mapping) and not hasattr(obj, 'data'):
             continue
         
         # Handle MessageNode objects for keys
@@ -608,7 +817,7 @@ def visualize_game_state(obs, step_num=None, save_path=None):
             obj_data = obj
             
         # Skip if obj_data is not a dict
-        if not isinstance(obj_data, dict):
+        if not isinstance(obj_data, Mapping):
             continue
             
         # Extract coordinates safely
@@ -680,6 +889,8 @@ def print_debug_info(obs, step_num=None):
         obs (dict): Game state observation
         step_num (int, optional): Current step number
     """
+    obs = obs.data if isinstance(obs, trace.Node) else obs
+
     # Count objects by type
     object_counts = {}
     for key in obs.keys():
@@ -727,8 +938,8 @@ def print_debug_info(obs, step_num=None):
                 enemy_data = enemy
                 
             # Extract x and y coordinates safely
-            x = enemy_data.get('x', 'unknown') if isinstance(enemy_data, dict) else 'unknown'
-            y = enemy_data.get('y', 'unknown') if isinstance(enemy_data, dict) else 'unknown'
+            x = enemy_data.get('x', 'unknown') if isinstance(enemy_data, Mapping) else 'unknown'
+            y = enemy_data.get('y', 'unknown') if isinstance(enemy_data, Mapping) else 'unknown'
             
             debug_str.append(f"  {key}: x={x}, y={y}")
     
@@ -751,8 +962,8 @@ def print_debug_info(obs, step_num=None):
                 fuel_data = fuel
                 
             # Extract x and y coordinates safely
-            x = fuel_data.get('x', 'unknown') if isinstance(fuel_data, dict) else 'unknown'
-            y = fuel_data.get('y', 'unknown') if isinstance(fuel_data, dict) else 'unknown'
+            x = fuel_data.get('x', 'unknown') if isinstance(fuel_data, Mapping) else 'unknown'
+            y = fuel_data.get('y', 'unknown') if isinstance(fuel_data, Mapping) else 'unknown'
             
             debug_str.append(f"  {key}: x={x}, y={y}")
     
@@ -773,6 +984,23 @@ def optimize_policy(
     vis_frequency=20,  # Save visualization every N steps
     create_gif=True,  # Create GIF instead of individual PNG files
     gif_fps=10,  # Frames per second for GIF
+    num_eval_envs=1,  # Number of envs stepping together during evaluation
+    num_eval_workers=0,  # Number of worker processes for evaluation (0 evaluates in-process)
+    eval_env_processes=False,  # Host the eval envs in worker processes, returning observations via shared memory
+    trace_window=None,  # Keep only the last N rollout steps in the trace graph (None traces every step)
+    early_stop_confidence=None,  # Stop evaluations once confidently below/above the best mean reward (e.g. 0.95)
+    early_stop_threshold=None,  # Score to compare against before any evaluation has finished
+    eval_cache_dir=None,  # Directory caching seeded evaluations by policy code (None plays every evaluation)
+    concurrent_eval=False,  # Play the evaluation episodes in the worker pool while the traced rollout runs
+    population_size=1,  # Candidate updates requested from the LLM per step; the best one is kept
+    population_eval_episodes=3,  # Evaluation episodes per candidate when population_size > 1
+    llm_cache_dir=None,  # Directory caching LLM responses by prompt (None calls the model for every prompt)
+    offline_llm=False,  # Replay cached LLM responses with a stub backend instead of calling a model
+    compress_trace=False,  # Deduplicate repeated observations and collapse runs of identical actions in the LLM prompt
+    summary_token_budget=None,  # Approximate token budget of the compressed trace; keeps only decisive steps beyond it
+    metrics_format="csv",  # Perf metrics file format, "csv" or "jsonl"
+    record_trajectories=False,  # Store rollout and in-process eval episodes as columnar arrays under the run directory
+    profile=None,  # "cpu", "memory" or "all": write per-iteration cProfile/tracemalloc reports of each phase
 ):
     if logger is None:
         logger = logging.getLogger(__name__)
@@ -812,8 +1040,18 @@ def optimize_policy(
     base_trace_ckpt_dir.mkdir(exist_ok=True)
     
     policy = Policy()
-    optimizer = OptoPrime(policy.parameters(), memory_size=memory_size)
+    llm = TokenCountingLLM(make_llm(llm_cache_dir, offline=offline_llm))
+    optimizer = OptoPrime(policy.parameters(), llm=llm, memory_size=memory_size)
+    if compress_trace:
+        install_summary_compression(optimizer, token_budget=summary_token_budget)
+    # Time spent per phase of each step, written to the perf CSV next to the LLM token counts.
+    timer = PhaseTimer()
+    timer.wrap(optimizer, "summarize", "summarize")
     env = None
+    eval_envs = []
+    eval_cache = EvalCache(eval_cache_dir) if eval_cache_dir else None
+    # Only cached evaluations need fixed seeds; otherwise every iteration plays fresh episodes.
+    eval_seed = 0 if eval_cache is not None else None
     
     # Print a clean header to the console
     print("\n" + "="*50)
@@ -834,9 +1072,21 @@ def optimize_policy(
         print(f"Visualization frequency: Every {vis_frequency} steps")
     print("="*50 + "\n")
     
-    perf_csv_filename = log_dir / f"perf_{env_name.replace('/', '_')}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}.csv"
-    trace_ckpt_dir = base_trace_ckpt_dir / f"{env_name.replace('/', '_')}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}"
+    run_name = f"{env_name.replace('/', '_')}_{timestamp}_skip{frame_skip}_sticky{sticky_action_p}_horizon{horizon}_optimSteps{n_optimization_steps}_mem{memory_size}"
+    perf_filename = log_dir / f"perf_{run_name}.{metrics_format}"
+    # One row per optimization step, appended as soon as the step is done.
+    metrics = MetricsWriter(perf_filename)
+    # Typed events (feedback, prompts, LLM responses, evaluations); large payloads go to compressed blobs.
+    events = EventLog(log_dir / f"events_{run_name}.jsonl")
+    trace_ckpt_dir = base_trace_ckpt_dir / run_name
     trace_ckpt_dir.mkdir(exist_ok=True)
+    # Rollouts and evaluation episodes kept for offline analysis (see trajectory_store).
+    trajectories = TrajectoryStore(trace_ckpt_dir / "trajectories") if record_trajectories else None
+    # Per-iteration cProfile stats and allocation reports of every timed phase (see PhaseProfiler).
+    profiler = PhaseProfiler(trace_ckpt_dir / "profile", mode=profile) if profile else None
+    timer.profiler = profiler
+    if profiler is not None:
+        logger.info(f"Writing {profile} profiles to {trace_ckpt_dir / 'profile'}")
     
     # Create visualization directory for this run
     vis_run_dir = vis_base_dir / f"{env_name.replace('/', '_')}_{timestamp}"
@@ -845,7 +1095,7 @@ def optimize_policy(
     
     try:
         rewards = []
-        optimization_data = []
+        incumbent_reward = early_stop_threshold  # Best mean evaluation reward so far
         logger.info("Optimization Starts")
         print("Starting optimization...")
         
@@ -854,9 +1104,27 @@ def optimize_policy(
                                            render_mode="human" if visualize else None,
                                            frameskip=frame_skip,
                                            repeat_action_probability=sticky_action_p)
+        if eval_env_processes:
+            eval_envs = SharedMemoryEnvPool(RiverraidOCAtariTracedEnv,
+                                            dict(render_mode=None,
+                                                 frameskip=frame_skip,
+                                                 repeat_action_probability=sticky_action_p),
+                                            num_eval_envs).envs
+        else:
+            eval_envs = [RiverraidOCAtariTracedEnv(render_mode=None,
+                                                   frameskip=frame_skip,
+                                                   repeat_action_probability=sticky_action_p)
+                         for _ in range(num_eval_envs)]
         
         for i in range(n_optimization_steps):
+            events.emit("iteration", iteration=i)
             print(f"\nIteration {i+1}/{n_optimization_steps}:")
+            step_start_time = time.time()
+            timer.reset()
+            if profiler is not None:
+                profiler.start_iteration(i)
+            llm.reset()
+            perf_row = None
             
             # Maximum number of retry attempts for this iteration
             max_retries = 3
@@ -864,8 +1132,23 @@ def optimize_policy(
             rollout_success = False
             
             while not rollout_success and retry_count < max_retries:
+                pending_eval = None
                 try:
-                    env.init()
+                    with timer.phase("env_init"):
+                        env.init()
+                    if concurrent_eval and not visualize and (
+                            eval_cache is None or
+                            eval_cache.get(test_cache_key(policy,
+                                                          frameskip=frame_skip,
+                                                          repeat_action_probability=sticky_action_p,
+                                                          base_seed=eval_seed)) is None):
+                        # The rollout does not change the policy, so its evaluation can already start
+                        # (unless the policy code is cached and will not be played at all).
+                        pending_eval = submit_test_episodes(policy,
+                                                            frameskip=frame_skip,
+                                                            repeat_action_probability=sticky_action_p,
+                                                            num_workers=num_eval_workers,
+                                                            base_seed=eval_seed)
                     
                     # Create visualization directory for this iteration
                     if visualize:
@@ -877,49 +1160,77 @@ def optimize_policy(
                         iter_vis_dir = None
                     
                     # Run rollout with visualization if enabled
-                    traj, error = rollout(env, horizon, policy, 
-                                         visualize=False,  # Disable visualization for training rollout
-                                         debug=debug,
-                                         vis_dir=iter_vis_dir,
-                                         terminal_debug=terminal_debug,
-                                         vis_frequency=vis_frequency,
-                                         create_gif=False,  # Disable GIF creation for training rollout
-                                         gif_fps=gif_fps)
+                    with timer.phase("rollout"):
+                        traj, error = rollout(env, horizon, policy, 
+                                             visualize=False,  # Disable visualization for training rollout
+                                             debug=debug,
+                                             vis_dir=iter_vis_dir,
+                                             terminal_debug=terminal_debug,
+                                             vis_frequency=vis_frequency,
+                                             create_gif=False,  # Disable GIF creation for training rollout
+                                             gif_fps=gif_fps,
+                                             window=trace_window)
+                    if trajectories is not None:
+                        trajectories.write("rollout", i, retry_count, traj["observations"], traj["actions"],
+                                           traj["rewards"], traj["terminations"], traj["truncations"])
 
                     if error is None:
                         rollout_success = True
                         episode_score = sum(traj['rewards'])
                         feedback = f"Episode ends after {traj['steps']} steps with total score: {episode_score:.1f}"
+                        history_summary = describe_history(traj.get("history"))
+                        if history_summary:
+                            feedback += f"\n{history_summary}"
                         
                         # Test policy performance
+                        early_stop = EarlyStopping(incumbent_reward if early_stop_confidence else None,
+                                                   confidence=early_stop_confidence or 0.95)
                         try:
-                            mean_rewards, std_rewards = test_policy(policy,
-                                                                frameskip=frame_skip,
-                                                                repeat_action_probability=sticky_action_p,
-                                                                visualize=visualize,
-                                                                debug=debug,
-                                                                vis_dir=iter_vis_dir,
-                                                                terminal_debug=terminal_debug,
-                                                                vis_frequency=vis_frequency,
-                                                                create_gif=create_gif,
-                                                                gif_fps=gif_fps)
+                            with timer.phase("evaluation"):
+                                mean_rewards, std_rewards = test_policy(policy,
+                                                                    frameskip=frame_skip,
+                                                                    repeat_action_probability=sticky_action_p,
+                                                                    visualize=visualize,
+                                                                    debug=debug,
+                                                                    vis_dir=iter_vis_dir,
+                                                                    terminal_debug=terminal_debug,
+                                                                    vis_frequency=vis_frequency,
+                                                                    create_gif=create_gif,
+                                                                    gif_fps=gif_fps,
+                                                                    env=eval_envs,
+                                                                    num_workers=num_eval_workers,
+                                                                    early_stop=early_stop,
+                                                                    base_seed=eval_seed,
+                                                                    cache=eval_cache,
+                                                                    recorder=EpisodeRecorder(trajectories, "eval", i) if trajectories is not None else None,
+                                                                    pending=pending_eval)
                         except Exception as e:
                             logger.error(f"Error during policy testing: {e}")
                             mean_rewards = episode_score
                             std_rewards = 0.0
+                        eval_episodes = early_stop.episodes_used
+                        events.emit("eval", iteration=i, mean_reward=mean_rewards, std_reward=std_rewards,
+                                    episodes=eval_episodes, decision=early_stop.decision)
+                        if early_stop.decision is not None:
+                            logger.info(f"Evaluation stopped after {eval_episodes} episodes: {early_stop.decision} the "
+                                        f"incumbent {incumbent_reward} (interval {early_stop.interval})")
+                        if incumbent_reward is None or mean_rewards > incumbent_reward:
+                            incumbent_reward = mean_rewards
                         
                         # Provide feedback based on performance
                         if mean_rewards >= 5000:
                             logger.info(f"Excellent performance! Average score: {mean_rewards} with std dev {std_rewards}. Ending optimization early.")
                             print(f"Excellent performance! Average score: {mean_rewards:.1f}")
                             rewards.append(episode_score)
-                            optimization_data.append({
+                            metrics.append({
                                 "Optimization Step": i,
                                 "Mean Reward": mean_rewards,
-                                "Std Dev Reward": std_rewards
+                                "Std Dev Reward": std_rewards,
+                                "Wall Clock Time (s)": time.time() - step_start_time,
+                                "Training Steps": traj['steps'],
+                                "Eval Episodes": eval_episodes,
+                                **perf_columns(timer, llm, traj['steps']),
                             })
-                            df = pd.DataFrame(optimization_data)
-                            df.to_csv(perf_csv_filename, index=False)
                             policy.save(os.path.join(trace_ckpt_dir, f"{i}.pkl"))
                             break
                             
@@ -936,13 +1247,14 @@ def optimize_policy(
                         target = traj['observations'][-1]
                         
                         rewards.append(episode_score)
-                        optimization_data.append({
+                        # Written once the backward pass and LLM step of this iteration are timed as well.
+                        perf_row = {
                             "Optimization Step": i,
                             "Mean Reward": mean_rewards,
-                            "Std Dev Reward": std_rewards
-                        })
-                        df = pd.DataFrame(optimization_data)
-                        df.to_csv(perf_csv_filename, index=False)
+                            "Std Dev Reward": std_rewards,
+                            "Training Steps": traj['steps'],
+                            "Eval Episodes": eval_episodes,
+                        }
                         
                         # Print a clean summary to console
                         print(f"  Episode Score: {episode_score:.1f}")
@@ -950,11 +1262,13 @@ def optimize_policy(
                         print(f"  Steps Completed: {traj['steps']}")
                         
                         # Save detailed info to log file
-                        logger.info(f"Iteration: {i}, Feedback: {feedback}, target: {target}")
+                        events.emit("feedback", iteration=i, feedback=feedback, target=str(target))
                     else:
+                        if pending_eval is not None:
+                            cancel_episodes(pending_eval)
                         feedback = error.exception_node.create_feedback()
                         target = error.exception_node
-                        logger.info(f"Iteration: {i}, Error: {feedback}, target: {target}")
+                        events.emit("feedback", iteration=i, feedback=feedback, target=str(target), error=True)
                         print(f"  Error occurred during rollout")
                         
                         # Try to roll back to previous iteration's policy if available
@@ -967,7 +1281,10 @@ def optimize_policy(
                                     policy = Policy()
                                     policy.load(prev_policy_path)
                                     # Recreate optimizer with the loaded policy
-                                    optimizer = OptoPrime(policy.parameters(), memory_size=memory_size)
+                                    optimizer = OptoPrime(policy.parameters(), llm=llm, memory_size=memory_size)
+                                    if compress_trace:
+                                        install_summary_compression(optimizer, token_budget=summary_token_budget)
+                                    timer.wrap(optimizer, "summarize", "summarize")
                                     logger.info(f"Successfully rolled back to policy from iteration {i-1}")
                                     print(f"  Successfully rolled back to policy from iteration {i-1}")
                                     retry_count += 1
@@ -980,6 +1297,8 @@ def optimize_policy(
                         rollout_success = True  # Mark as success to move on to next iteration
                 
                 except Exception as e:
+                    if pending_eval is not None:
+                        cancel_episodes(pending_eval)
                     logger.exception(f"Error during iteration {i}, retry {retry_count}: {e}")
                     print(f"  Error during iteration {i}, retry {retry_count}: {str(e)[:100]}...")
                     
@@ -993,7 +1312,10 @@ def optimize_policy(
                                 policy = Policy()
                                 policy.load(prev_policy_path)
                                 # Recreate optimizer with the loaded policy
-                                optimizer = OptoPrime(policy.parameters(), memory_size=memory_size)
+                                optimizer = OptoPrime(policy.parameters(), llm=llm, memory_size=memory_size)
+                                if compress_trace:
+                                    install_summary_compression(optimizer, token_budget=summary_token_budget)
+                                timer.wrap(optimizer, "summarize", "summarize")
                                 logger.info(f"Successfully rolled back to policy from iteration {i-1}")
                                 print(f"  Successfully rolled back to policy from iteration {i-1}")
                                 retry_count += 1
@@ -1024,16 +1346,48 @@ def optimize_policy(
             
             optimizer.objective = optimizer.default_objective + instruction 
             
-            optimizer.zero_feedback()
-            optimizer.backward(target, feedback, visualize=True)
-            logger.info(optimizer.problem_instance(optimizer.summarize()))
+            with timer.phase("backward"):
+                optimizer.zero_feedback()
+                optimizer.backward(target, feedback, visualize=True)
+            events.emit("prompt", iteration=i, problem_instance=str(optimizer.problem_instance(optimizer.summarize())))
             
             stdout_buffer = io.StringIO()
-            with contextlib.redirect_stdout(stdout_buffer):
-                optimizer.step(verbose=verbose)
+            with contextlib.redirect_stdout(stdout_buffer), timer.phase("llm_step"):
+                if population_size > 1:
+                    # Request several updates from the same feedback at once, evaluate them in the worker
+                    # pool and keep the best.
+                    candidates = propose_candidates(optimizer, population_size)
+                    with timer.phase("evaluation"):
+                        best, scores = select_candidate(
+                            optimizer,
+                            [update_dict for update_dict, _ in candidates],
+                            submit=lambda: submit_test_episodes(policy,
+                                                                num_episodes=population_eval_episodes,
+                                                                frameskip=frame_skip,
+                                                                repeat_action_probability=sticky_action_p,
+                                                                num_workers=num_eval_workers,
+                                                                base_seed=0),  # Candidates are compared on the same episodes
+                            collect=lambda futures: np.mean(collect_episodes(futures)))
+                    if verbose:
+                        print(f"LLM response:\n {candidates[best][1]}")
+                    logger.info(f"Candidate scores: {scores}, keeping candidate {best}")
+                    for k, ((_, candidate_response), score) in enumerate(zip(candidates, scores)):
+                        events.emit("candidate", iteration=i, index=k, score=score, selected=k == best,
+                                    response=candidate_response)
+                    response = candidates[best][1]
+                else:
+                    optimizer.step(verbose=verbose)
+                    # optimizer.log holds the raw reply of the step.
+                    response = optimizer.log[-1]["response"] if optimizer.log else None
                 llm_output = stdout_buffer.getvalue()
-                if llm_output:
-                    logger.info(f"LLM response:\n {llm_output}")
+                # The printed (verbose) output comes along with the reply when there is any.
+                events.emit("response", iteration=i, response=response, output=llm_output)
+            if perf_row is not None:
+                perf_row.update({
+                    "Wall Clock Time (s)": time.time() - step_start_time,
+                    **perf_columns(timer, llm, perf_row["Training Steps"]),
+                })
+                metrics.append(perf_row)
             
             # Create a summary visualization of this iteration if enabled
             if visualize and iter_vis_dir:
@@ -1056,8 +1410,13 @@ def optimize_policy(
         logger.exception(f"Error during optimization: {e}")
         print(f"Error during optimization: {str(e)[:100]}...")
     finally:
+        events.close()
+        if profiler is not None:
+            profiler.close()
         if env is not None:
             env.close()
+        for eval_env in eval_envs:
+            eval_env.close()
     
     # Print final summary
     if rewards:
@@ -1092,6 +1451,9 @@ if __name__ == "__main__":
     parser.add_argument("--vis-frequency", type=int, default=1, help="Save visualization every N steps")
     parser.add_argument("--no-gif", action="store_true", help="Disable GIF creation (save individual PNGs instead)")
     parser.add_argument("--gif-fps", type=int, default=10, help="Frames per second for GIF")
+    parser.add_argument("--profile", nargs="?", const="all", choices=["cpu", "memory", "all"], default=None,
+                        help="Write per-iteration cProfile stats (cpu) and/or allocation reports (memory) of every phase "
+                             "to results/checkpoints/<run>/profile; --profile alone enables both")
     
     args = parser.parse_args()
     
@@ -1130,6 +1492,7 @@ if __name__ == "__main__":
             vis_frequency=args.vis_frequency,
             create_gif=not args.no_gif,
             gif_fps=args.gif_fps,
+            profile=args.profile,
         )
         
         # Show paths to debug files if requested
@@ -0,0 +1,205 @@
+import multiprocessing as mp
+import os
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import inference_mode
+from obs_state import OBJECT_DTYPE, ObjectState
+from parallel_eval import build_env, env_spec
+
+
+class ObservationRing:
+    """
+    Preallocated shared-memory ring buffer of object records (see obs_state.OBJECT_DTYPE).
+
+    Each env owns `slots` frames of up to max_objects rows, so a frame is written once by the worker
+    hosting the env and read by the main process without pickling.
+    """
+
+    def __init__(self, num_envs, slots, max_objects, name=None):
+        self.shape = (num_envs, slots, max_objects)
+        size = int(np.prod(self.shape)) * OBJECT_DTYPE.itemsize
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.frames = np.ndarray(self.shape, dtype=OBJECT_DTYPE, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, env_index, slot, objects):
+        """Copy the rows of an ObjectState into a frame and return the number of rows written."""
+        if len(objects) > self.shape[2]:
+            raise ValueError(f"Frame has {len(objects)} objects but the ring holds at most {self.shape[2]}")
+        self.frames[env_index, slot, :len(objects)] = objects
+        return len(objects)
+
+    def read(self, env_index, slot, num_objects):
+        """Copy num_objects rows out of a frame, so that the slot can be reused."""
+        objects = self.frames[env_index, slot, :num_objects].copy()
+        objects.flags.writeable = False
+        return objects
+
+    def close(self):
+        # Workers are children of the owner and share its resource tracker, so only the owner unlinks.
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _send_frame(conn, ring, env_index, slot, obs, layout, result):
+    num_objects = ring.write(env_index, slot, obs.objects)
+    # The key layout rarely changes between frames, so it is only sent when it does.
+    changed = obs.layout if obs.layout != layout else None
+    conn.send(("ok", (slot, num_objects, changed, obs.extras, result)))
+    return obs.layout
+
+
+def _env_worker(conn, spec, ring_name, ring_shape, env_index):
+    """Worker process hosting one traced env and answering reset/step/seed/init commands."""
+    ring = ObservationRing(*ring_shape, name=ring_name)
+    env = None
+    layout = None
+    slot = 0
+    try:
+        while True:
+            command, arg = conn.recv()
+            if command == "close":
+                break
+            try:
+                if env is None:
+                    env = build_env(spec)
+                with inference_mode():
+                    if command == "init":
+                        env.init()
+                        conn.send(("ok", None))
+                    elif command == "seed":
+                        env.seed(arg)
+                        conn.send(("ok", None))
+                    elif command == "reset":
+                        obs, info = env.reset()
+                        slot = (slot + 1) % ring_shape[1]
+                        layout = _send_frame(conn, ring, env_index, slot, obs, layout, (info,))
+                    elif command == "step":
+                        obs, reward, termination, truncation, info = env.step(arg)
+                        slot = (slot + 1) % ring_shape[1]
+                        layout = _send_frame(conn, ring, env_index, slot, obs, layout,
+                                             (reward, termination, truncation, info))
+                    else:
+                        raise ValueError(f"Unknown command {command}")
+            except Exception:
+                conn.send(("error", f"Env worker {os.getpid()} failed on {command}:\n{traceback.format_exc()}"))
+    finally:
+        if env is not None:
+            env.close()
+        ring.close()
+        conn.close()
+
+
+class RemoteEnv:
+    """
+    Proxy for a traced env running in a worker process of a SharedMemoryEnvPool.
+
+    It offers the reset/step/seed/init/close interface of the traced envs (untraced, as in inference mode),
+    plus step_async/step_wait so that vector_eval.run_episodes can step several workers at once.
+    """
+
+    def __init__(self, pool, env_index, conn, process):
+        self.pool = pool
+        self.env_index = env_index
+        self.conn = conn
+        self.process = process
+        self.layout = None
+
+    def _call(self, command, arg=None):
+        self.conn.send((command, arg))
+        return self._receive()
+
+    def _receive(self):
+        status, payload = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def _frame(self, payload):
+        slot, num_objects, layout, extras, result = payload
+        if layout is not None:
+            self.layout = layout
+        categories, index = self.layout
+        objects = self.pool.ring.read(self.env_index, slot, num_objects)
+        return ObjectState(objects, categories, index, extras), result
+
+    def init(self):
+        self._call("init")
+
+    def seed(self, seed):
+        self._call("seed", seed)
+
+    def reset(self):
+        obs, (info,) = self._frame(self._call("reset"))
+        return obs, info
+
+    def step_async(self, action):
+        self.conn.send(("step", action))
+
+    def step_wait(self):
+        obs, (reward, termination, truncation, info) = self._frame(self._receive())
+        return obs, reward, termination, truncation, info
+
+    def step(self, action):
+        self.step_async(action)
+        return self.step_wait()
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(("close", None))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.pool._env_closed()
+
+
+class SharedMemoryEnvPool:
+    """
+    Host num_envs traced envs in worker processes, returning observations through an ObservationRing.
+
+    Only small messages (rewards, flags, info and the occasional key layout) go through pipes; the object
+    records of every frame are written to shared memory and rebuilt into ObjectStates in this process.
+
+    Args:
+        env_cls: Traced env class (its extractor must return obs_state.ObjectState observations).
+        env_kwargs (dict): Constructor arguments for env_cls.
+        num_envs (int): Number of worker processes / envs.
+        max_objects (int): Maximum number of objects in one frame.
+        slots (int): Frames kept per env in the ring.
+    """
+
+    def __init__(self, env_cls, env_kwargs, num_envs, max_objects=256, slots=2):
+        spec = env_spec(env_cls, **env_kwargs)
+        self.ring = ObservationRing(num_envs, slots, max_objects)
+        self.envs = []
+        self._open = num_envs
+        for env_index in range(num_envs):
+            parent_conn, child_conn = mp.Pipe()
+            process = mp.Process(target=_env_worker,
+                                 args=(child_conn, spec, self.ring.name, self.ring.shape, env_index),
+                                 daemon=True)
+            process.start()
+            child_conn.close()
+            self.envs.append(RemoteEnv(self, env_index, parent_conn, process))
+
+    def _env_closed(self):
+        self._open -= 1
+        if self._open == 0:
+            self.ring.close()
+
+    def close(self):
+        for env in self.envs:
+            env.close()
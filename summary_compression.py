@@ -0,0 +1,238 @@
+import math
+import re
+from collections.abc import Mapping
+
+# "out = fn(arg=value, ...)" lines of a FunctionFeedback graph.
+CALL_PATTERN = re.compile(r"^(?P<out>\S+) = (?P<fn>\S+?)\((?P<args>.*)\)$")
+ARG_PATTERN = re.compile(r"(\w+)=([^,\s)]+)")
+
+# Values whose repr is shorter than this are cheaper to repeat than to reference.
+MIN_DEDUP_LENGTH = 40
+
+
+class RepeatedValue:
+    """Stand-in for an intermediate value identical to an earlier one; shown as '(RepeatedValue) x=same as y'."""
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"same as {self.name}"
+
+    __str__ = __repr__
+
+
+class OmittedValue:
+    """Stand-in for a node whose step was omitted but is still used by a kept line; shown as '(OmittedValue) x=value omitted'."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "value omitted"
+
+    __str__ = __repr__
+
+
+def estimate_tokens(text):
+    """Rough token count of text (about four characters per token)."""
+    return math.ceil(len(text) / 4)
+
+
+def _is_env_step(fn):
+    # Env step bundles are nested functions named step (or step_many for macro actions).
+    return fn.rsplit(".", 1)[-1] in ("step", "step_many")
+
+
+def _value(summary, name):
+    for nodes in (summary.others, summary.roots):
+        if name in nodes:
+            return nodes[name][0]
+    return name
+
+
+def _reward(value):
+    if isinstance(value, Mapping) and "reward" in value:
+        reward = value["reward"]
+        if isinstance(reward, (int, float)) and not math.isnan(reward):
+            return reward
+    return 0
+
+
+def _arguments(line):
+    """Names of the nodes a graph line passes as arguments."""
+    match = CALL_PATTERN.match(line)
+    return [name for _, name in ARG_PATTERN.findall(match.group("args"))] if match else []
+
+
+def _entry_text(name, value):
+    return f"({type(value).__name__}) {name}={value}"
+
+
+class _Segment:
+    """Graph lines of one env step: the policy calls producing the action and the step call itself."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.outputs = []
+        self.action = None
+        self.reward = 0
+        self.keep = True
+
+    def cost(self, others):
+        text = "\n".join(line for _, line in self.lines)
+        text += "".join(_entry_text(name, others[name][0]) for name in self.outputs if name in others)
+        return estimate_tokens(text)
+
+
+def _split_segments(summary):
+    segments = []
+    lines = []
+    for level, line in sorted(summary.graph):
+        lines.append((level, line))
+        match = CALL_PATTERN.match(line)
+        if match and _is_env_step(match.group("fn")):
+            segment = _Segment(lines)
+            args = ARG_PATTERN.findall(match.group("args"))
+            segment.action = ", ".join(f"{key}={_value(summary, name)!r}" for key, name in args)
+            segment.reward = _reward(_value(summary, match.group("out")))
+            segments.append(segment)
+            lines = []
+    tail = _Segment(lines)  # Lines after the last env step (e.g. the policy call on the final observation)
+    for segment in segments + [tail]:
+        for _, line in segment.lines:
+            match = CALL_PATTERN.match(line)
+            if match:
+                segment.outputs.append(match.group("out"))
+    return segments, tail
+
+
+def _deduplicate(others):
+    """Replace values repeated from an earlier node with a RepeatedValue reference to that node."""
+    first_seen = {}
+    deduplicated = {}
+    for name, (value, description) in others.items():
+        text = repr(value)
+        if len(text) >= MIN_DEDUP_LENGTH and "__code" not in name:
+            if text in first_seen:
+                value = RepeatedValue(first_seen[text])
+            else:
+                first_seen[text] = name
+        deduplicated[name] = (value, description)
+    return deduplicated
+
+
+def _marker(run):
+    level = run[0].lines[0][0]
+    total_reward = sum(segment.reward for segment in run)
+    steps = f"{len(run)} step" + ("s" if len(run) > 1 else "")
+    if all(segment.action == run[0].action for segment in run) and total_reward == 0:
+        return level, f"# ... {steps} with the same action ({run[0].action}) and no reward omitted ..."
+    return level, f"# ... {steps} omitted (total reward {total_reward}) ..."
+
+
+def compress_summary(summary, token_budget=None, keep_last_steps=5, min_run=3):
+    """
+    Shrink an OptoPrime FunctionFeedback summary of a rollout before it is turned into a prompt.
+
+    1. Runs of at least min_run env steps playing the same action without reward keep only their
+       first and last step; the steps in between become a single comment line in #Code. A rewarded
+       step is never part of a run, and a run is only collapsed when at least two steps are omitted.
+    2. If token_budget is set and the summary is still larger, steps are dropped until it fits:
+       ordinary steps first (oldest first), then steps where the action changed, then rewarded steps.
+       The last keep_last_steps steps, which lead to the feedback, are always kept.
+    3. Intermediate values of the kept steps identical to an earlier kept one (e.g. unchanged
+       observations) are replaced by a RepeatedValue reference to the first node holding them. Nodes of
+       omitted steps that kept lines still use (e.g. the observation the step after an omitted run acts on)
+       stay in #Others as an OmittedValue, so #Code never refers to an undefined variable.
+
+    Args:
+        summary: FunctionFeedback returned by OptoPrime.summarize().
+        token_budget (int): Approximate token budget of #Code, #Inputs and #Others together.
+        keep_last_steps (int): Number of final env steps never dropped.
+        min_run (int): Minimum length of a run of identical unrewarded steps to collapse.
+    Returns:
+        The compressed summary (the input summary is modified and returned).
+    """
+    segments, tail = _split_segments(summary)
+    protected = set(range(max(0, len(segments) - keep_last_steps), len(segments)))
+
+    def kept_others():
+        # Only nodes that stay in the summary can be the target of a RepeatedValue reference.
+        dropped = {name for segment in segments if not segment.keep for name in segment.outputs}
+        used = {name for segment in segments + [tail] if segment.keep for _, line in segment.lines
+                for name in _arguments(line)}
+        others = {}
+        for name, (value, description) in summary.others.items():
+            if name not in dropped:
+                others[name] = (value, description)
+            elif name in used:
+                others[name] = (OmittedValue(), description)
+        return _deduplicate(others)
+
+    start = 0
+    while start < len(segments):
+        if segments[start].reward != 0:
+            start += 1
+            continue
+        end = start
+        while (end + 1 < len(segments) and segments[end + 1].action == segments[start].action
+               and segments[end + 1].reward == 0):
+            end += 1
+        omitted = [index for index in range(start + 1, end) if index not in protected]
+        # A marker standing in for a single step saves nothing.
+        if end - start + 1 >= min_run and len(omitted) >= 2:
+            for index in omitted:
+                segments[index].keep = False
+        start = end + 1
+
+    if token_budget is not None:
+        # Costs are estimated on the values deduplicated before the drops below.
+        others = kept_others()
+        tokens = estimate_tokens("\n".join(_entry_text(name, value) for name, (value, _) in summary.inputs.items()))
+        tokens += sum(segment.cost(others) for segment in segments + [tail] if segment.keep)
+
+        def priority(index):
+            segment = segments[index]
+            if segment.reward != 0:
+                return 2
+            if index > 0 and segment.action != segments[index - 1].action:
+                return 1
+            return 0
+
+        candidates = sorted((index for index, segment in enumerate(segments) if segment.keep and index not in protected),
+                            key=lambda index: (priority(index), index))
+        for index in candidates:
+            if tokens <= token_budget:
+                break
+            segments[index].keep = False
+            tokens -= segments[index].cost(others)
+
+    graph = []
+    run = []
+    for segment in segments + [tail]:
+        if segment.keep:
+            if run:
+                graph.append(_marker(run))
+                run = []
+            graph.extend(segment.lines)
+        else:
+            run.append(segment)
+    summary.graph = graph
+    summary.others = kept_others()
+    return summary
+
+
+def install_summary_compression(optimizer, token_budget=None, keep_last_steps=5):
+    """
+    Make optimizer.summarize() return compressed summaries (see compress_summary).
+
+    OptoPrime builds its prompt from summarize(), so every following step (and any logging of
+    optimizer.problem_instance(optimizer.summarize())) sees the compressed trace.
+    """
+    summarize = optimizer.summarize
+
+    def compressed_summarize():
+        return compress_summary(summarize(), token_budget=token_budget, keep_last_steps=keep_last_steps)
+
+    optimizer.summarize = compressed_summarize
+    return optimizer
@@ -0,0 +1,146 @@
+import random
+from collections import deque, namedtuple
+
+import numpy as np
+from opto.trace import bundle, node
+from opto.trace.bundle import ExceptionNode
+from opto.trace.errors import ExecutionError
+
+from inference import inference_mode
+from macro_actions import action_controls, is_macro_action, step_many_error, traced_step_many
+
+# One untraced step kept in the window. exception is set (and next_obs is None) when env.step failed.
+Step = namedtuple("Step", ["obs", "action", "next_obs", "reward", "termination", "truncation", "info",
+                           "rng_state", "exception"])
+
+
+def traced_step(action, next_obs):
+    """Record an already-executed env step in the Trace graph as the env's step operator."""
+    @bundle()
+    def step(action):
+        """
+        Take action in the environment and return the next observation
+        """
+        return next_obs
+
+    return step(action)
+
+
+def _detach(summary, record):
+    """Fold a step that leaves the traced window into the compact history summary."""
+    summary["detached_steps"] += 1
+    summary["detached_reward"] += record.reward
+    if record.reward > 0:
+        summary["positive_rewards"] += 1
+    elif record.reward < 0:
+        summary["negative_rewards"] += 1
+    # A macro action counts each of its actions.
+    controls = action_controls(record.action) if is_macro_action(record.action) else [record.action]
+    for control in controls:
+        action = int(control)
+        summary["action_counts"][action] = summary["action_counts"].get(action, 0) + 1
+
+
+def describe_history(history):
+    """Render the summary of detached steps as a feedback sentence ("" if nothing was detached)."""
+    if not history or history["detached_steps"] == 0:
+        return ""
+    actions = ", ".join(f"{action}: {count}" for action, count in sorted(history["action_counts"].items()))
+    return (f"The first {history['detached_steps']} steps are not shown in the trace; during them the policy "
+            f"collected {history['detached_reward']:.1f} reward ({history['positive_rewards']} positive and "
+            f"{history['negative_rewards']} negative reward events) with action counts {{{actions}}}.")
+
+
+def windowed_rollout(env, horizon, policy, window):
+    """
+    Rollout a policy in an env for horizon steps, keeping only the last `window` steps in the Trace graph.
+
+    The episode is first played untraced (see inference.inference_mode), holding only the last `window`
+    steps in memory; older steps are folded into a compact summary. The kept steps are then replayed
+    through the traced policy, with the random/np.random state restored before every step so that the
+    replayed actions match the ones that were played. Memory and the size of the graph walked by
+    optimizer.backward therefore stay constant as the horizon grows.
+
+    Returns:
+        tuple: (trajectory, error) like rollout(). trajectory["observations"] and trajectory["actions"]
+            hold the traced nodes of the window, with the first observation a root node standing in for
+            the detached history. rewards/terminations/truncations/infos cover every step, and
+            trajectory["history"] summarizes the detached steps (see describe_history).
+    """
+    trajectory = dict(observations=[], actions=[], rewards=[], terminations=[], truncations=[], infos=[], steps=0)
+    history = dict(detached_steps=0, detached_reward=0.0, positive_rewards=0, negative_rewards=0, action_counts={})
+    trajectory["history"] = history
+    records = deque()
+
+    with inference_mode():
+        obs, _ = env.reset()
+        for _ in range(horizon):
+            rng_state = (random.getstate(), np.random.get_state())
+            try:
+                action = policy(obs)
+            except Exception:
+                # The traced replay below re-raises this as an ExecutionError with the proper graph.
+                records.append(Step(obs, None, None, np.nan, True, False, {}, rng_state, None))
+                break
+            try:
+                next_obs, reward, termination, truncation, info = env.step(action)
+            except Exception as e:
+                records.append(Step(obs, action, None, np.nan, True, False, {}, rng_state, e))
+                break
+            records.append(Step(obs, action, next_obs, reward, termination, truncation, info, rng_state, None))
+            if len(records) > window:
+                _detach(history, records.popleft())
+            trajectory["rewards"].append(reward)
+            trajectory["terminations"].append(termination)
+            trajectory["truncations"].append(truncation)
+            trajectory["infos"].append(info)
+            trajectory["steps"] += 1
+            if termination or truncation:
+                break
+            obs = next_obs
+
+    if not records:
+        return trajectory, None
+
+    final_rng_state = (random.getstate(), np.random.get_state())
+    start = records[0]
+    if history["detached_steps"]:
+        description = (f"[window_start] Observation after {history['detached_steps']} untraced steps; "
+                       f"the steps before it are summarized in the feedback.")
+    else:
+        description = "[window_start] Initial observation of the episode."
+    obs_node = node(start.obs, name="window_start", description=description)
+    trajectory["observations"].append(obs_node)
+    error = None
+    try:
+        for record in records:
+            random.setstate(record.rng_state[0])
+            np.random.set_state(record.rng_state[1])
+            action = policy(obs_node)
+            if record.next_obs is None:
+                if record.exception is None:
+                    # The policy failed untraced but not when replayed (e.g. it depends on unseeded state);
+                    # stop the window here as the untraced rollout did.
+                    break
+                if is_macro_action(action):
+                    raise step_many_error(record.exception, action)
+                e_node = ExceptionNode(
+                    record.exception,
+                    inputs={"action": action},
+                    description="[exception] The operator step raises an exception.",
+                    name="exception_step",
+                )
+                raise ExecutionError(e_node)
+            if is_macro_action(action):
+                obs_node = traced_step_many(action, record.next_obs)
+            else:
+                obs_node = traced_step(action, record.next_obs)
+            trajectory["observations"].append(obs_node)
+            trajectory["actions"].append(action)
+    except ExecutionError as e:
+        error = e
+    finally:
+        random.setstate(final_rng_state[0])
+        np.random.set_state(final_rng_state[1])
+
+    return trajectory, error
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import threading
+from collections.abc import Mapping
+from numbers import Number
+from pathlib import Path
+
+import numpy as np
+
+# Keys of numbered objects of one category, e.g. Space Invaders' Alien0 ... Alien35.
+NUMBERED_KEY = re.compile(r"(?P<category>.*\D)(?P<number>\d+)")
+
+
+def _data(value):
+    # Traced rollouts hold nodes; the store keeps their data.
+    return getattr(value, "data", value) if not isinstance(value, Mapping) else value
+
+
+def _controls(action):
+    # A macro action (a list of actions, or a Node holding one) contributes each of its controls.
+    action = _data(action)
+    return [_data(control) for control in action] if isinstance(action, (list, tuple)) else [action]
+
+
+def _file_name(column):
+    return re.sub(r"[^\w.-]", "_", column)
+
+
+def _numeric_fields(obj):
+    return [field for field, value in obj.items() if isinstance(value, Number) and not isinstance(value, bool)]
+
+
+def _compact(values):
+    """Smallest of int16/int32/float32 that holds values exactly (float32 for non-integral values)."""
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    if finite.size == len(values.ravel()) and np.all(finite == np.round(finite)):
+        if finite.size == 0 or (finite.min() >= np.iinfo(np.int16).min and finite.max() <= np.iinfo(np.int16).max):
+            return values.astype(np.int16)
+        if finite.min() >= np.iinfo(np.int32).min and finite.max() <= np.iinfo(np.int32).max:
+            return values.astype(np.int32)
+    return values.astype(np.float32)
+
+
+def observation_columns(observations):
+    """
+    Convert a list of observations (OCAtari ObjectStates or dicts of objects) into columnar arrays.
+
+    For every key of the observations:
+      - numbered single objects of one category (Alien0, Alien1, ...) become "cat/<category>", the rows
+        of all steps concatenated, "cat/<category>/offsets", where the objects of step t are rows
+        offsets[t]:offsets[t + 1], and "cat/<category>/numbers", the number of each row's key;
+      - any other single object becomes "obj/<key>" with one row of its numeric fields per step and
+        "obj/<key>/present" marking the steps where the object was in the observation;
+      - a group of objects (list) becomes "grp/<key>", the rows of all steps concatenated, and
+        "grp/<key>/offsets", where the objects of step t are rows offsets[t]:offsets[t + 1];
+      - a scalar (e.g. the reward) becomes "extra/<key>", NaN where missing.
+
+    Returns:
+        tuple: (columns, fields), where fields maps each object, group or category key to its field names.
+    """
+    observations = [_data(obs) for obs in observations]
+    steps = len(observations)
+    fields = {}
+    singles = {}
+    groups = {}
+    numbered = {}
+    extras = {}
+    for t, obs in enumerate(observations):
+        if not isinstance(obs, Mapping):
+            continue
+        for key, value in obs.items():
+            match = NUMBERED_KEY.fullmatch(key) if isinstance(value, Mapping) else None
+            if match:
+                # One column per category instead of one per numbered key, most of them absent at any step.
+                category = match["category"]
+                names = fields.setdefault(category, _numeric_fields(value))
+                rows, numbers, counts = numbered.setdefault(category, ([], [], np.zeros(steps, dtype=np.int64)))
+                rows.append([value.get(name, 0) for name in names])
+                numbers.append(int(match["number"]))
+                counts[t] += 1
+            elif isinstance(value, Mapping):
+                names = fields.setdefault(key, _numeric_fields(value))
+                rows, present = singles.setdefault(key, (np.zeros((steps, len(names))), np.zeros(steps, dtype=bool)))
+                rows[t] = [value.get(name, 0) for name in names]
+                present[t] = True
+            elif isinstance(value, (list, tuple)):
+                members = [member for member in value if isinstance(member, Mapping)]
+                names = fields.setdefault(key, _numeric_fields(members[0]) if members else [])
+                rows, counts = groups.setdefault(key, ([], np.zeros(steps, dtype=np.int64)))
+                rows.extend([member.get(name, 0) for name in names] for member in members)
+                counts[t] = len(members)
+            elif isinstance(value, Number):
+                extras.setdefault(key, np.full(steps, np.nan))[t] = value
+
+    columns = {}
+    for key, (rows, present) in singles.items():
+        columns[f"obj/{key}"] = _compact(rows)
+        columns[f"obj/{key}/present"] = present
+    for key, (rows, counts) in groups.items():
+        columns[f"grp/{key}"] = _compact(np.asarray(rows, dtype=np.float64).reshape(-1, len(fields[key])))
+        columns[f"grp/{key}/offsets"] = np.concatenate([[0], np.cumsum(counts)])
+    for category, (rows, numbers, counts) in numbered.items():
+        columns[f"cat/{category}"] = _compact(np.asarray(rows, dtype=np.float64).reshape(-1, len(fields[category])))
+        columns[f"cat/{category}/offsets"] = np.concatenate([[0], np.cumsum(counts)])
+        columns[f"cat/{category}/numbers"] = _compact(numbers)
+    for key, values in extras.items():
+        columns[f"extra/{key}"] = values.astype(np.float32)
+    return columns, fields
+
+
+class TrajectoryStore:
+    """
+    Columnar on-disk store of rollout and evaluation episodes of one run.
+
+    The columns of an episode (see observation_columns, plus "actions", "rewards", "terminations" and
+    "truncations") are written to one compressed .npz, a few percent of the size of the pickled
+    trajectory dicts. With compress=False every column is instead a plain .npy file in a directory of
+    its own, which np.load memory-maps, so long episodes can be sliced without reading them whole.
+    Episodes with macro actions store the controls of all steps concatenated in "actions" and
+    "actions/offsets", where the controls of step t are actions[offsets[t]:offsets[t + 1]].
+    Object coordinates are stored as int16 where they fit. A line per episode is appended to
+    index.jsonl, so episodes can be listed by iteration and kind without opening them.
+
+    Args:
+        root (str): Store directory, e.g. <run dir>/trajectories.
+        compress (bool): Write compressed .npz episodes instead of memory-mappable .npy columns.
+    """
+
+    def __init__(self, root, compress=True):
+        self.root = Path(root)
+        self.compress = compress
+        self._lock = threading.Lock()
+
+    def write(self, kind, iteration, episode, observations, actions, rewards, terminations=None, truncations=None,
+              **metadata):
+        """
+        Store one episode.
+
+        Args:
+            kind (str): "rollout" or "eval".
+            iteration (int): Optimization step the episode was played in.
+            episode (int): Episode number within the iteration.
+            observations (list): Observations (or traced nodes of them).
+            actions, rewards, terminations, truncations (list): Per-step values. A windowed rollout
+                holds fewer observations and actions than rewards; first_observation_step and
+                first_action_step record the steps of the first stored observation and action.
+            metadata: Extra JSON-serializable fields for the index entry.
+        Returns:
+            dict: The index entry.
+        """
+        columns, fields = observation_columns(observations)
+        if any(isinstance(_data(action), (list, tuple)) for action in actions):
+            # Macro actions have different lengths: store them like groups.
+            controls = [_controls(action) for action in actions]
+            columns["actions"] = _compact([control for step in controls for control in step])
+            columns["actions/offsets"] = np.concatenate([[0], np.cumsum([len(step) for step in controls])])
+        else:
+            columns["actions"] = _compact([_data(action) for action in actions])
+        columns["rewards"] = np.asarray(rewards, dtype=np.float32)
+        if terminations is not None:
+            columns["terminations"] = np.asarray(terminations, dtype=bool)
+        if truncations is not None:
+            columns["truncations"] = np.asarray(truncations, dtype=bool)
+
+        name = f"{kind}_{iteration:05d}_{episode:03d}"
+        entry = {
+            "kind": kind,
+            "iteration": iteration,
+            "episode": episode,
+            "path": f"{name}.npz" if self.compress else name,
+            "steps": len(rewards),
+            "total_reward": float(np.nansum(columns["rewards"])),
+            "first_observation_step": max(0, len(rewards) + 1 - len(observations)) if observations else None,
+            "first_action_step": max(0, len(rewards) - len(actions)) if actions else None,
+            "fields": fields,
+            "columns": {column: _file_name(column) for column in columns},
+            **metadata,
+        }
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            if self.compress:
+                np.savez_compressed(self.root / entry["path"],
+                                    **{_file_name(column): values for column, values in columns.items()})
+            else:
+                episode_dir = self.root / name
+                episode_dir.mkdir(exist_ok=True)
+                for column, values in columns.items():
+                    np.save(episode_dir / f"{_file_name(column)}.npy", values)
+            with open(self.root / "index.jsonl", "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
+
+    def index(self, iteration=None, kind=None):
+        """Index entries of the stored episodes, optionally only those of an iteration and/or kind."""
+        path = self.root / "index.jsonl"
+        if not path.exists():
+            return []
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return [entry for entry in entries
+                if (iteration is None or entry["iteration"] == iteration) and (kind is None or entry["kind"] == kind)]
+
+    def load(self, entry, mmap_mode="r"):
+        """Columns of an episode as a dict of arrays (memory-mapped for .npy episodes unless mmap_mode is None)."""
+        if entry["path"].endswith(".npz"):
+            with np.load(self.root / entry["path"]) as data:
+                return {column: data[name] for column, name in entry["columns"].items()}
+        return {column: np.load(self.root / entry["path"] / f"{name}.npy", mmap_mode=mmap_mode)
+                for column, name in entry["columns"].items()}
+
+
+class EpisodeRecorder:
+    """
+    Collect the steps of the episodes played by vector_eval.run_episodes (its record argument) and
+    write every finished episode to a TrajectoryStore. Episodes dropped by early stopping are not written.
+    """
+
+    def __init__(self, store, kind, iteration):
+        self.store = store
+        self.kind = kind
+        self.iteration = iteration
+        self._episodes = {}
+
+    def reset(self, episode, obs):
+        self._episodes[episode] = dict(observations=[obs], actions=[], rewards=[], terminations=[], truncations=[])
+
+    def step(self, episode, action, obs, reward, terminated, truncated):
+        steps = self._episodes[episode]
+        steps["observations"].append(obs)
+        steps["actions"].append(action)
+        steps["rewards"].append(reward)
+        steps["terminations"].append(terminated)
+        steps["truncations"].append(truncated)
+
+    def end(self, episode):
+        steps = self._episodes.pop(episode, None)
+        if steps is not None:
+            self.store.write(self.kind, self.iteration, episode, **steps)
@@ -0,0 +1,190 @@
+import contextlib
+import logging
+import random
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def seed_episode(env, seed):
+    """Seed the emulator (including sticky actions) and the random modules policies draw from for the next reset()."""
+    random.seed(seed)
+    np.random.seed(seed)
+    env.seed(seed)
+
+
+@contextlib.contextmanager
+def preserved_random_state():
+    """Put the random/np.random states back on exit, so that seeding inside does not change the caller's later draws."""
+    state = (random.getstate(), np.random.get_state())
+    try:
+        yield
+    finally:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+
+
+def _drain(envs, pending):
+    """Receive the step replies still owed by worker-hosted envs, so that their pipes stay in sync after an error."""
+    for k in pending:
+        try:
+            envs[k].step_wait()
+        except Exception:
+            pass
+    pending.clear()
+
+
+def run_episodes(envs, policy, num_episodes, steps_per_episode, catch_errors=False, stop_when=None, record=None,
+                 base_seed=None):
+    """
+    Play num_episodes episodes of a policy on several traced envs stepping together.
+
+    Every tick the policy is queried once for each live env and then all live envs are
+    stepped with their actions. When an env finishes an episode it picks up the next pending
+    one; once no episodes are left it is masked out until the remaining envs finish.
+
+    Args:
+        envs (list): Traced envs exposing reset() -> (obs, info) and step(action) -> (obs, reward, terminated, truncated, info).
+        policy: Callable mapping an observation to an action.
+        num_episodes (int): Total number of episodes to play across all envs.
+        steps_per_episode (int): Maximum number of steps per episode.
+        catch_errors (bool): If True, an exception while acting or stepping ends that episode with
+            the reward collected so far, and an exception during reset skips the episode.
+            Otherwise exceptions propagate to the caller.
+        stop_when (callable): Called with the rewards of the finished episodes in episode order,
+            each time that list grows by one: an episode is only passed on once every episode before
+            it has finished, so short episodes finishing first on other envs do not bias the rule. If
+            it returns True, the evaluation stops; episodes in progress or beyond the passed ones are
+            dropped (see early_stopping.EarlyStopping).
+        record: Optional recorder (e.g. trajectory_store.EpisodeRecorder) told about every reset
+            (record.reset(episode, obs)), step (record.step(episode, action, obs, reward, terminated,
+            truncated)) and finished episode (record.end(episode)).
+        base_seed (int): If set, episode i is seeded with base_seed + i (see seed_episode) and keeps its
+            own random module state while envs step together, so its reward does not depend on how many
+            envs play alongside it or which env plays it; it matches parallel_eval's worker episodes.
+            The random module states are restored afterwards, so the caller's own draws (e.g. a training
+            rollout) are not reset to the evaluation seeds. Otherwise the episodes are unseeded.
+
+    Returns:
+        list: Total reward of every played episode (after an early stop, of those passed to stop_when),
+            in episode order.
+    """
+    num_envs = len(envs)
+    obs = [None] * num_envs
+    episode_ids = np.full(num_envs, -1, dtype=np.int64)
+    steps = np.zeros(num_envs, dtype=np.int64)
+    returns = np.zeros(num_envs, dtype=np.float64)
+    live = np.zeros(num_envs, dtype=bool)
+    rng_states = [None] * num_envs  # Per-env (random, np.random) states of seeded lockstep episodes
+    results = {}
+    skipped = set()
+    finished = []  # Rewards of episodes 0..reported-1 in order, as passed to stop_when
+    reported = 0
+    stopped = False
+    next_episode = 0
+
+    def start_next_episode(k):
+        nonlocal next_episode
+        live[k] = False
+        while next_episode < num_episodes:
+            episode = next_episode
+            next_episode += 1
+            try:
+                if base_seed is not None:
+                    seed_episode(envs[k], base_seed + episode)
+                obs[k], _ = envs[k].reset()
+            except Exception as e:
+                if not catch_errors:
+                    raise
+                logger.warning(f"Error during test episode {episode}: {str(e)}")
+                skipped.add(episode)
+                continue
+            episode_ids[k] = episode
+            if record is not None:
+                record.reset(episode, obs[k])
+            if base_seed is not None and num_envs > 1:
+                rng_states[k] = (random.getstate(), np.random.get_state())
+            steps[k] = 0
+            returns[k] = 0.0
+            live[k] = True
+            return
+
+    with preserved_random_state() if base_seed is not None else contextlib.nullcontext():
+        for k in range(num_envs):
+            start_next_episode(k)
+
+        while live.any():
+            live_envs = np.flatnonzero(live)
+            actions = {}
+            for k in live_envs:
+                try:
+                    if rng_states[k] is not None:
+                        random.setstate(rng_states[k][0])
+                        np.random.set_state(rng_states[k][1])
+                    try:
+                        actions[k] = policy(obs[k])
+                    finally:
+                        if rng_states[k] is not None:
+                            rng_states[k] = (random.getstate(), np.random.get_state())
+                except Exception as e:
+                    if not catch_errors:
+                        raise
+                    logger.warning(f"Error during test episode {episode_ids[k]} step: {str(e)}")
+
+            # Envs hosted in other processes (see shm_transport) are all sent their actions before waiting on any.
+            # pending holds the envs whose reply has not been received yet; if an error propagates, those replies
+            # are drained first so that the next call does not read a stale one.
+            pending = set()
+            try:
+                for k in live_envs:
+                    if k in actions and hasattr(envs[k], "step_async"):
+                        try:
+                            envs[k].step_async(actions[k])
+                            pending.add(k)
+                        except Exception as e:
+                            if not catch_errors:
+                                raise
+                            logger.warning(f"Error during test episode {episode_ids[k]} step: {str(e)}")
+                            del actions[k]
+
+                for k in live_envs:
+                    done = k not in actions
+                    if not done:
+                        try:
+                            if hasattr(envs[k], "step_async"):
+                                pending.discard(k)
+                                obs[k], reward, terminated, truncated, _ = envs[k].step_wait()
+                            else:
+                                obs[k], reward, terminated, truncated, _ = envs[k].step(actions[k])
+                            returns[k] += reward
+                            steps[k] += 1
+                            done = terminated or truncated or steps[k] >= steps_per_episode
+                            if record is not None:
+                                record.step(int(episode_ids[k]), actions[k], obs[k], reward, terminated, truncated)
+                        except Exception as e:
+                            if not catch_errors:
+                                raise
+                            logger.warning(f"Error during test episode {episode_ids[k]} step: {str(e)}")
+                            done = True
+                    if done and not stopped:
+                        results[int(episode_ids[k])] = float(returns[k])
+                        if record is not None:
+                            record.end(int(episode_ids[k]))
+                        while stop_when is not None and not stopped and (reported in results or reported in skipped):
+                            if reported in results:
+                                finished.append(results[reported])
+                                stopped = stop_when(finished)
+                            reported += 1
+                        if not stopped:
+                            start_next_episode(k)
+            except BaseException:
+                _drain(envs, pending)
+                raise
+            # Finish the tick first so that no env is left waiting on an action it was sent.
+            if stopped:
+                break
+
+        if stopped:
+            return finished
+        return [results[episode] for episode in sorted(results)]